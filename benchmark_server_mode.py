@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器模式性能基准测试
+启动进程内模拟SSH服务器（fake_ssh_server.py），在无界面的ImageManager上依次执行图片检测、
+完整的服务器模式任务、各个执行策略（原子事务、批量脚本、并行、tar流、rsync、服务器之间直接传输）以及下载到本地，报告每一项的
+耗时和网络往返次数。
+
+用法：
+    python benchmark_server_mode.py --images 200 --latency 20 --bandwidth 100M
+"""
+
+import os, io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tkinter as tk
+from pathlib import Path
+
+from fake_ssh_server import FakeSSHServer, parse_size
+from image_manager import ImageManager, TransferProgressTracker, SSHOperationStats
+
+
+class HeadlessRoot:
+    """无界面的根窗口替身：after回调立即执行，其他窗口方法忽略"""
+
+    def __init__(self):
+        # Tk变量需要默认根对象，使用不创建窗口的Tcl解释器
+        self.tcl = tk.Tcl()
+        tk._default_root = self.tcl
+
+    def after(self, ms, func=None, *args):
+        if func:
+            func(*args)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class HeadlessProgress:
+    """进度对话框替身，只记录最后的状态"""
+
+    def __init__(self):
+        self.last_progress = None
+        self.last_stats = None
+
+    def update_overall_progress(self, current, total, text=""):
+        self.last_progress = (current, total, text)
+
+    def update_transfer_stats(self, stats):
+        self.last_stats = stats
+
+    def is_cancelled(self):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class HeadlessImageManager(ImageManager):
+    """不创建界面组件的ImageManager，用于基准测试"""
+
+    def create_menu(self):
+        pass
+
+    def create_widgets(self):
+        pass
+
+    def update_mode_display(self):
+        pass
+
+    def add_operation_log(self, message):
+        pass
+
+
+def create_dataset(share, count, image_size, label_ratio=1.0):
+    """在共享目录下创建测试数据集 ds/images + ds/labels"""
+    images_dir = share / "ds" / "images"
+    labels_dir = share / "ds" / "labels"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    labels_dir.mkdir(parents=True, exist_ok=True)
+    payload = os.urandom(image_size)
+    label_every = max(1, round(1 / label_ratio)) if label_ratio > 0 else 0
+    for i in range(count):
+        (images_dir / f"img_{i:05d}.jpg").write_bytes(payload)
+        if label_every and i % label_every == 0:
+            (labels_dir / f"img_{i:05d}.txt").write_text(f"0 0.5 0.5 0.1 0.1\n")
+
+
+def reset_targets(share, names):
+    """清空并重建目标目录"""
+    for name in names:
+        target = share / name
+        shutil.rmtree(target, ignore_errors=True)
+        (target / "images").mkdir(parents=True)
+        (target / "labels").mkdir(parents=True)
+
+
+def build_operations(share, target_name):
+    """构造某个目标目录的复制操作列表 [(src, dst, ftype), ...]"""
+    operations = []
+    for kind, ftype in (("images", "image"), ("labels", "label")):
+        for path in sorted((share / "ds" / kind).iterdir()):
+            operations.append((str(path), str(share / target_name / kind / path.name), ftype))
+    return operations
+
+
+def measure(app, server, name, func, files):
+    """执行一项测试并记录耗时、服务器统计和客户端自身估算的往返次数"""
+    server.reset_stats()
+    app.ssh_stats = SSHOperationStats()
+    start = time.time()
+    try:
+        result = func()
+        error = None if not isinstance(result, dict) or result.get("success", True) else result.get("error")
+    except Exception as e:
+        error = str(e)
+    elapsed = time.time() - start
+    stats = server.stats()
+    # 服务器模式任务会在开始时重建ssh_stats，这里读取的总是本项测试的统计
+    app_stats = app.ssh_stats.snapshot()
+    stats.update(name=name, files=files, seconds=round(elapsed, 3), error=error,
+                 app_round_trips=app_stats["totals"]["round_trips"], app_ssh=app_stats)
+    return stats
+
+
+def print_report(rows):
+    """以表格形式打印结果"""
+    header = f"{'测试项':<24}{'文件数':>8}{'耗时(秒)':>10}{'往返':>8}{'channel':>9}{'exec':>6}{'shell命令':>10}{'SFTP':>7}{'上行KB':>9}{'下行KB':>9}{'客户端估算往返':>10}"
+    print(header)
+    print("-" * 124)
+    for row in rows:
+        print(f"{row['name']:<24}{row['files']:>8}{row['seconds']:>10.3f}{row['round_trips']:>8}"
+              f"{row['channels']:>9}{row['exec']:>6}{row['shell_commands']:>10}{row['sftp_requests']:>7}"
+              f"{row['bytes_up'] / 1024:>9.1f}{row['bytes_down'] / 1024:>9.1f}{row['app_round_trips']:>10}")
+        if row["error"]:
+            print(f"    失败: {row['error']}")
+
+
+def run_benchmark(args):
+    """执行全部基准测试，返回结果列表"""
+    work_dir = Path(tempfile.mkdtemp(prefix="imgmgr_bench_"))
+    share = work_dir / "share"
+    share.mkdir()
+    create_dataset(share, args.images, args.image_size, args.label_ratio)
+
+    server = FakeSSHServer(root=str(share), latency=args.latency / 1000.0, bandwidth=args.bandwidth)
+    host, port = server.start()
+
+    # 在工作目录中运行，配置、清单和能力缓存不影响当前目录
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)
+    rows = []
+    try:
+        app = HeadlessImageManager(HeadlessRoot())
+        app.progress_dialog = HeadlessProgress()
+        app.status_label = HeadlessProgress()
+        app.ssh_config.update(host=host, port=port, username="bench", password="bench", share_path=str(share))
+        app.operation_mode.set("server")
+        app.source_dir.set(f"\\\\{host}\\share\\ds")
+
+        # 预先建立连接，测量的是稳定状态下每项操作的开销
+        app.execute_ssh_command("true")
+        print(f"SSH传输配置档: {app.get_transport_profile(host)}")
+        total_files = sum(1 for _ in (share / "ds").rglob("*") if _.is_file())
+
+        rows.append(measure(app, server, "detect_images", app.detect_images, total_files))
+
+        targets = ["t1", "t2"][:args.targets]
+        selected_targets = [(name, f"\\\\{host}\\share\\{name}") for name in targets]
+        dataset = Path(app.source_dir.get())
+        for copy in (True, False):
+            label = "worker_ssh(copy)" if copy else "worker_ssh(move)"
+            reset_targets(share, targets)
+            selected = list(app.image_files)
+            rows.append(measure(app, server, label, lambda: app.process_images_worker_ssh(
+                selected, selected_targets, dataset / "images", dataset / "labels", copy),
+                total_files * len(targets)))
+            if not copy:
+                # 把移动走的文件放回数据集，供后续测试使用
+                for kind in ("images", "labels"):
+                    for path in (share / targets[0] / kind).iterdir():
+                        shutil.move(str(path), str(share / "ds" / kind / path.name))
+                app.detect_images()
+
+        strategies = [
+            ("atomic", lambda ops: app._execute_atomic_operations(ops, "copy", 4, None)),
+            ("batch_script", lambda ops: app._execute_batch_script(ops, "copy", None)),
+            ("parallel", lambda ops: app._execute_parallel_operations(ops, "copy", 4, None)),
+        ]
+        capabilities = app.get_server_capabilities(refresh=True)
+        if capabilities.get("tar"):
+            strategies.append(("tar_pipe", lambda ops: app.execute_tar_pipe_operations(
+                app.plan_tar_pipe(ops)[0], TransferProgressTracker(len(ops)))))
+        if capabilities.get("rsync"):
+            strategies.append(("rsync", lambda ops: app.execute_rsync_batch_operations(
+                ops, "copy", TransferProgressTracker(len(ops)))))
+        else:
+            print("服务器上未安装rsync，跳过rsync策略")
+
+        for name, strategy in strategies:
+            reset_targets(share, targets[:1])
+            operations = build_operations(share, targets[0])
+            rows.append(measure(app, server, name, lambda: strategy(operations), len(operations)))
+
+        # 选中范围下载到本地目录（多连接SFTP预读）
+        # 图片路径是Windows格式的SMB路径，换成/分隔以便在Linux上运行时也能取出文件名
+        local_dir = work_dir / "download"
+        selected = [path.replace("\\", "/") for path in app.image_files]
+        rows.append(measure(app, server, "download", lambda: app.download_images_worker(
+            selected, dataset / "images", dataset / "labels", str(local_dir)), total_files))
+
+        # 第二台模拟服务器（以localhost作为主机名区分），测试源服务器直接推送到目标服务器
+        share2 = work_dir / "share2"
+        share2.mkdir()
+        server2 = FakeSSHServer(root=str(share2), latency=args.latency / 1000.0, bandwidth=args.bandwidth)
+        _, port2 = server2.start()
+        try:
+            app.ssh_config["hosts"] = {"localhost": {"port": port2, "share_path": str(share2)}}
+            method = app.get_direct_transfer_method("localhost")
+            if method:
+                operations = [(src, dst.replace(str(share), str(share2), 1), ftype)
+                              for src, dst, ftype in build_operations(share, targets[0])]
+                rows.append(measure(app, server, f"direct({method})", lambda: app.execute_direct_transfer(
+                    "localhost", operations, "copy", TransferProgressTracker(len(operations))), len(operations)))
+            else:
+                print("两台服务器之间没有可用的直接传输方式，跳过direct策略")
+        finally:
+            server2.stop()
+    finally:
+        os.chdir(old_cwd)
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return rows
+
+
+def main():
+    """主函数"""
+    # 强制标准输出/错误使用 UTF-8 编码（兼容 Windows 控制台）
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description="服务器模式性能基准测试")
+    parser.add_argument("--images", type=int, default=100, help="测试图片数量")
+    parser.add_argument("--image-size", type=parse_size, default=64 * 1024, help="单张图片大小（支持K/M单位）")
+    parser.add_argument("--label-ratio", type=float, default=1.0, help="有标签文件的图片比例")
+    parser.add_argument("--targets", type=int, choices=(1, 2), default=2, help="完整任务的目标目录数")
+    parser.add_argument("--latency", type=float, default=20.0, help="注入的往返延迟（毫秒）")
+    parser.add_argument("--bandwidth", type=parse_size, default=0, help="链路带宽（字节/秒，支持K/M/G单位），0表示不限")
+    parser.add_argument("--json", help="把结果另存为JSON文件")
+    parser.add_argument("--keep", action="store_true", help="保留测试数据目录")
+    args = parser.parse_args()
+
+    print(f"图片: {args.images} 张 x {args.image_size} 字节，延迟: {args.latency}ms，"
+          f"带宽: {args.bandwidth or '不限'} 字节/秒")
+    rows = run_benchmark(args)
+    print_report(rows)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
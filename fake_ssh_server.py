@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内模拟SSH/SFTP服务器
+基于paramiko的ServerInterface实现，在本机临时目录上执行命令，用于在没有Linux服务器的
+情况下测试和调优服务器模式。客户端与服务器之间经过一个链路模拟器，可以注入往返延迟和带宽限制，
+并统计实际发生的网络往返次数。
+
+用法（独立运行，供图片管理器连接）：
+    python fake_ssh_server.py --root D:/share --port 2222 --latency 20 --bandwidth 100
+然后在config.json的ssh_config中设置 host=127.0.0.1、port=2222、share_path=<root>，用户名密码任意。
+"""
+
+import os, io
+import re
+import sys
+import time
+import queue
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+try:
+    import paramiko
+    from paramiko import SFTPServerInterface, SFTPServer, SFTPAttributes, SFTPHandle, SFTP_OK
+except ImportError:
+    print("错误: 需要paramiko库，请运行: pip install paramiko")
+    raise
+
+
+class _SFTPHandle(SFTPHandle):
+    """SFTP文件句柄"""
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            SFTPServer.set_file_attr(self.filename, attr)
+            return SFTP_OK
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class _SFTPServer(SFTPServerInterface):
+    """直接映射到本机文件系统的SFTP服务端（路径按原样使用，不做chroot）"""
+
+    def __init__(self, server, *args, fake_server=None, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.fake_server = fake_server
+
+    def _count(self):
+        if self.fake_server:
+            self.fake_server._count("sftp_requests")
+
+    def _call(self, func, *args):
+        """执行文件系统操作，把OSError转换为SFTP错误码"""
+        self._count()
+        try:
+            result = func(*args)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK if result is None else result
+
+    def list_folder(self, path):
+        def list_entries():
+            entries = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        return self._call(list_entries)
+
+    def stat(self, path):
+        return self._call(lambda: SFTPAttributes.from_stat(os.stat(path)))
+
+    def lstat(self, path):
+        return self._call(lambda: SFTPAttributes.from_stat(os.lstat(path)))
+
+    def open(self, path, flags, attr):
+        self._count()
+        try:
+            mode = getattr(attr, "st_mode", None) or 0o666
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), mode)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            fstr = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            fstr = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            fstr = "rb"
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, fstr)
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        return self._call(SFTPServer.set_file_attr, path, attr)
+
+    def symlink(self, target_path, path):
+        return self._call(os.symlink, target_path, path)
+
+    def readlink(self, path):
+        return self._call(os.readlink, path)
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    """接受任意用户名密码，允许exec和sftp子系统"""
+
+    def __init__(self, fake_server):
+        self.fake_server = fake_server
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            self.fake_server._count("channels")
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        self.fake_server._count("exec")
+        threading.Thread(target=self.fake_server._run_command,
+                         args=(channel, command.decode("utf-8", errors="replace")),
+                         daemon=True).start()
+        return True
+
+    def check_global_request(self, kind, msg):
+        # keepalive等全局请求
+        return True
+
+
+class _Pacer:
+    """共享链路带宽的发送节奏控制"""
+
+    def __init__(self, bytes_per_sec):
+        self.bytes_per_sec = bytes_per_sec
+        self._next_free = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, nbytes):
+        if not self.bytes_per_sec:
+            return
+        with self._lock:
+            start = max(time.time(), self._next_free)
+            self._next_free = start + nbytes / self.bytes_per_sec
+            delay = self._next_free - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _LinkEmulator:
+    """TCP链路模拟器：在客户端和SSH服务端之间转发数据，注入单向延迟和带宽限制
+
+    每个方向由读线程按到达时间入队、写线程到期后发送，流水线数据不会被逐块串行延迟。
+    客户端在收到服务端数据后再次发送时计为一次往返。
+    """
+
+    def __init__(self, fake_server, target_port, latency, bandwidth):
+        self.fake_server = fake_server
+        self.target_port = target_port
+        self.one_way = latency / 2.0
+        self.pacers = {"up": _Pacer(bandwidth), "down": _Pacer(bandwidth)}
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def listen(self, host, port):
+        self.sock.bind((host, port))
+        self.sock.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self.sock.getsockname()[1]
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            try:
+                upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            except OSError:
+                client.close()
+                continue
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            state = {"last": None}
+            self._forward(client, upstream, "up", state)
+            self._forward(upstream, client, "down", state)
+
+    def _forward(self, src, dst, direction, state):
+        pending = queue.Queue()
+        pacer = self.pacers[direction]
+
+        def reader():
+            while True:
+                try:
+                    data = src.recv(65536)
+                except OSError:
+                    data = b""
+                if direction == "up" and data and state["last"] != "up":
+                    self.fake_server._count("round_trips")
+                state["last"] = direction
+                self.fake_server._count("bytes_" + direction, len(data))
+                pending.put((time.time() + self.one_way, data))
+                if not data:
+                    return
+
+        def writer():
+            while True:
+                due, data = pending.get()
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                if not data:
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+                pacer.wait(len(data))
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=reader, daemon=True).start()
+        threading.Thread(target=writer, daemon=True).start()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class FakeSSHServer:
+    """进程内模拟SSH/SFTP服务器
+
+    exec请求在root目录下用bash执行（HOME也指向root），SFTP直接读写本机文件系统。
+    统计信息包括会话channel数、exec次数、SFTP请求数、持久shell中执行的分帧命令数、
+    网络往返次数和双向字节数。
+    """
+
+    # 图片管理器持久shell分帧协议中每个命令结尾的stderr标记
+    FRAME_PATTERN = re.compile(rb"printf '\\n%s\\n' '__IMGMGR_[0-9a-f]+__' >&2")
+
+    def __init__(self, root=None, latency=0.0, bandwidth=0, host="127.0.0.1", port=0, shell="bash"):
+        """
+        Args:
+            root: 命令执行目录，默认为新建的临时目录
+            latency: 注入的往返延迟（秒）
+            bandwidth: 链路带宽（字节/秒），0表示不限
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            shell: 执行命令使用的shell
+        """
+        self.root = root or tempfile.mkdtemp(prefix="fake_ssh_")
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host = host
+        self.port = port
+        self.shell = shell
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._transports = []
+        self._sock = None
+        self._link = None
+        self.reset_stats()
+
+    def start(self):
+        """启动服务器，返回 (host, port)"""
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+        # 客户端始终经过链路模拟器连接，未注入延迟和带宽时也用于统计往返次数
+        self._link = _LinkEmulator(self, self._sock.getsockname()[1], self.latency, self.bandwidth)
+        self.port = self._link.listen(self.host, self.port)
+        return self.host, self.port
+
+    def stop(self):
+        """停止服务器并断开所有连接"""
+        if self._link:
+            self._link.close()
+        if self._sock:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def reset_stats(self):
+        """清零统计信息"""
+        with self._stats_lock:
+            self._stats = {
+                "round_trips": 0,
+                "channels": 0,
+                "exec": 0,
+                "shell_commands": 0,
+                "sftp_requests": 0,
+                "bytes_up": 0,
+                "bytes_down": 0,
+            }
+
+    def stats(self):
+        """获取统计信息的副本"""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] = self._stats.get(key, 0) + amount
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, _SFTPServer, fake_server=self)
+            try:
+                transport.start_server(server=_ServerInterface(self))
+            except Exception as e:
+                print(f"SSH握手失败: {e}")
+                continue
+            self._transports.append(transport)
+
+    def _run_command(self, channel, command):
+        """在root目录下执行命令，stdin/stdout/stderr与channel双向转发"""
+        env = dict(os.environ, HOME=self.root)
+        try:
+            process = subprocess.Popen([self.shell, "-c", command], cwd=self.root, env=env,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            channel.sendall_stderr(f"{e}\n".encode("utf-8"))
+            channel.send_exit_status(127)
+            channel.close()
+            return
+
+        def pump_stdin():
+            tail = b""
+            try:
+                while True:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    # 统计持久shell中写入的分帧命令数（保留尾部以匹配跨块的标记）
+                    buffer = tail + data
+                    end = 0
+                    for match in self.FRAME_PATTERN.finditer(buffer):
+                        self._count("shell_commands")
+                        end = match.end()
+                    tail = buffer[end:][-80:]
+                    process.stdin.write(data)
+                    process.stdin.flush()
+            except (OSError, EOFError, ValueError):
+                pass
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+        def pump_output(stream, send):
+            try:
+                for chunk in iter(lambda: stream.read1(65536), b""):
+                    send(chunk)
+            except (OSError, EOFError):
+                pass
+
+        threading.Thread(target=pump_stdin, daemon=True).start()
+        stderr_thread = threading.Thread(target=pump_output, args=(process.stderr, channel.sendall_stderr), daemon=True)
+        stderr_thread.start()
+        pump_output(process.stdout, channel.sendall)
+        stderr_thread.join()
+        exit_code = process.wait()
+        try:
+            channel.send_exit_status(exit_code)
+            channel.close()
+        except Exception:
+            pass
+
+
+def parse_size(text):
+    """解析带单位的大小，如 100M、512K、1.5G（字节）"""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?)i?B?\s*", str(text), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"无效的大小: {text}")
+    factor = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[match.group(2).upper()]
+    return int(float(match.group(1)) * factor)
+
+
+def main():
+    """主函数"""
+    # 强制标准输出/错误使用 UTF-8 编码（兼容 Windows 控制台）
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description="进程内模拟SSH/SFTP服务器")
+    parser.add_argument("--root", help="命令执行目录（默认新建临时目录）")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=2222, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.0, help="注入的往返延迟（毫秒）")
+    parser.add_argument("--bandwidth", type=parse_size, default=0, help="链路带宽（字节/秒，支持K/M/G单位），0表示不限")
+    args = parser.parse_args()
+
+    server = FakeSSHServer(root=args.root, latency=args.latency / 1000.0, bandwidth=args.bandwidth,
+                           host=args.host, port=args.port)
+    host, port = server.start()
+    print(f"模拟SSH服务器已启动: {host}:{port}，根目录: {server.root}")
+    print(f"延迟: {args.latency}ms，带宽: {args.bandwidth or '不限'} 字节/秒，按Ctrl+C退出")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"统计: {server.stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
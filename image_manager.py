@@ -16,11 +16,20 @@ import time
 from pathlib import Path
 import re
 import json
+import hashlib
+import zlib
 from PIL import Image, ImageTk
 import psutil
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import queue
+import shlex
+import uuid
+import posixpath
+import tarfile
+import heapq
+import asyncio
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 try:
     import paramiko
@@ -36,6 +45,249 @@ except ImportError:
     WIN32_AVAILABLE = False
     print("注意: pywin32库未安装，窗口监控功能将被禁用。如需完整功能，请运行: pip install pywin32")
 
+# 上传到服务器执行的辅助程序源码（兼容Python 3.6+，仅使用标准库）
+REMOTE_AGENT_SOURCE = r'''
+import hashlib, json, os, shutil, signal, sys, time, zlib
+
+BUFFER_SIZE = 1024 * 1024
+
+
+def new_hasher(algorithm):
+    if algorithm == "crc32":
+        return None
+    return hashlib.blake2b()
+
+
+def copy_with_hash(src, dst, algorithm):
+    hasher = new_hasher(algorithm)
+    crc = 0
+    size = 0
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            while True:
+                chunk = fsrc.read(BUFFER_SIZE)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                if hasher is None:
+                    crc = zlib.crc32(chunk, crc)
+                else:
+                    hasher.update(chunk)
+                size += len(chunk)
+        except BaseException:
+            # 出错或被中止时删除不完整的目标文件
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+    digest = "%08x" % (crc & 0xffffffff) if hasher is None else hasher.hexdigest()
+    return size, digest
+
+
+def hash_file(path, algorithm):
+    hasher = new_hasher(algorithm)
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(BUFFER_SIZE)
+            if not chunk:
+                break
+            if hasher is None:
+                crc = zlib.crc32(chunk, crc)
+            else:
+                hasher.update(chunk)
+    return "%08x" % (crc & 0xffffffff) if hasher is None else hasher.hexdigest()
+
+
+def op_scan(req):
+    exts = set(e.lower() for e in req.get("extensions", []))
+    files = []
+    for entry in os.scandir(req["dir"]):
+        if not entry.is_file():
+            continue
+        if exts and os.path.splitext(entry.name)[1].lower() not in exts:
+            continue
+        st = entry.stat()
+        files.append({"name": entry.name, "size": st.st_size, "inode": st.st_ino, "dev": st.st_dev})
+    return {"files": files}
+
+
+def op_pair(req):
+    labels_dir = req["labels_dir"]
+    try:
+        existing = set(os.listdir(labels_dir))
+    except OSError:
+        existing = set()
+    labels = {}
+    for image in req["images"]:
+        base = os.path.splitext(os.path.basename(image))[0]
+        for ext in req.get("exts", [".txt"]):
+            if base + ext in existing:
+                labels[os.path.basename(image)] = base + ext
+                break
+    return {"labels": labels}
+
+
+def op_copy(req):
+    start = time.time()
+    size, digest = copy_with_hash(req["src"], req["dst"], req.get("algorithm", "blake2b"))
+    return {"size": size, "hash": digest, "duration": time.time() - start}
+
+
+def op_move(req):
+    start = time.time()
+    src, dst = req["src"], req["dst"]
+    size = os.path.getsize(src)
+    try:
+        os.rename(src, dst)
+        digest = None
+    except OSError:
+        # 跨文件系统：复制（同时计算校验值）后删除源文件
+        size, digest = copy_with_hash(src, dst, req.get("algorithm", "blake2b"))
+        os.unlink(src)
+    return {"size": size, "hash": digest, "duration": time.time() - start}
+
+
+def op_hash(req):
+    return {"hash": hash_file(req["path"], req.get("algorithm", "blake2b"))}
+
+
+def op_mkdir(req):
+    for path in req["paths"]:
+        os.makedirs(path, exist_ok=True)
+    return {"count": len(req["paths"])}
+
+
+def op_restore(req):
+    # 回滚移动：只移回确实已移动的文件（目标存在且源位置空闲）
+    restored = 0
+    failed = []
+    for src, dst in req["pairs"]:
+        if not os.path.lexists(dst) or os.path.lexists(src):
+            continue
+        try:
+            try:
+                os.rename(dst, src)
+            except OSError:
+                shutil.move(dst, src)
+            restored += 1
+        except Exception as e:
+            failed.append("%s: %s" % (dst, e))
+    return {"count": restored, "failed": failed}
+
+
+HANDLERS = {"scan": op_scan, "pair": op_pair, "copy": op_copy, "move": op_move,
+            "hash": op_hash, "mkdir": op_mkdir, "restore": op_restore}
+
+
+def main():
+    # 任务取消时客户端向进程组发送SIGTERM，转为SystemExit以便清理不完整的文件
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(130))
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        req = json.loads(line)
+        result = {"id": req.get("id"), "op": req.get("op")}
+        try:
+            result.update(HANDLERS[req["op"]](req))
+            result["ok"] = True
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
+'''
+REMOTE_AGENT_HASH = hashlib.sha256(REMOTE_AGENT_SOURCE.encode('utf-8')).hexdigest()[:16]
+
+# SSH传输配置档：只允许列出的加密/MAC算法（未列出时使用paramiko默认协商顺序），按顺序作为基准测试候选
+SSH_TRANSPORT_PROFILES = {
+    "aead": {"ciphers": ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com")},  # AES-GCM，加密和认证一次完成
+    "ctr-etm": {"ciphers": ("aes128-ctr", "aes256-ctr"),
+                "macs": ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-512-etm@openssh.com")},
+    "default": {}
+}
+
+# 服务器之间直接传输（tcp方式）的接收端：在目标服务器上监听临时端口，把端口号写到stderr，
+# 校验发送端送来的令牌后把数据流写到stdout（交给tar解包）；连接前stdin关闭表示发送端已失败。
+# 令牌经环境变量传入（由shell从stdin读取），不出现在命令行中，其他用户无法通过ps看到
+DIRECT_RECEIVER_SOURCE = r'''
+import os, select, socket, sys, time
+token = os.environ["IMGMGR_DIRECT_TOKEN"].encode()
+bind_address, timeout, port = sys.argv[1], float(sys.argv[2]), int(sys.argv[3])
+server = socket.socket()
+server.bind((bind_address, port))
+server.listen(4)
+sys.stderr.write("PORT %d\n" % server.getsockname()[1])
+sys.stderr.flush()
+deadline = time.time() + timeout
+while True:
+    remaining = deadline - time.time()
+    ready = select.select([server, 0], [], [], remaining)[0] if remaining > 0 else []
+    if not ready:
+        sys.exit("等待发送端连接超时")
+    if 0 in ready and not os.read(0, 4096):
+        sys.exit("发送端已放弃连接")
+    if server in ready:
+        conn, peer = server.accept()
+        conn.settimeout(30)
+        received = b""
+        try:
+            while len(received) <= len(token):
+                chunk = conn.recv(len(token) + 1 - len(received))
+                if not chunk:
+                    break
+                received += chunk
+        except OSError:
+            pass
+        if received == token + b"\n":
+            break
+        conn.close()
+server.close()
+conn.settimeout(None)
+out = sys.stdout.buffer
+while True:
+    data = conn.recv(1 << 20)
+    if not data:
+        break
+    out.write(data)
+out.flush()
+'''
+
+# 服务器之间直接传输（tcp方式）的发送端：在源服务器上连接接收端，先发送令牌（同样经环境变量传入），
+# 再转发stdin中的tar流
+DIRECT_SENDER_SOURCE = r'''
+import os, socket, sys
+conn = socket.create_connection((sys.argv[1], int(sys.argv[2])), timeout=30)
+conn.settimeout(None)
+conn.sendall(os.environ["IMGMGR_DIRECT_TOKEN"].encode() + b"\n")
+stdin = sys.stdin.buffer
+while True:
+    data = stdin.read1(1 << 20)
+    if not data:
+        break
+    conn.sendall(data)
+conn.shutdown(socket.SHUT_WR)
+conn.recv(1)
+'''
+
+def format_bytes(size):
+    """将字节数格式化为易读的字符串"""
+    size = float(size or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def format_duration(seconds):
+    """将秒数格式化为 时:分:秒"""
+    seconds = int(max(0, seconds or 0))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
 class ProgressDialog:
     """进度条对话框"""
     
@@ -57,6 +309,7 @@ class ProgressDialog:
         # 任务相关变量
         self.tasks = {}  # {task_id: {"name": str, "progress": int, "status": str}}
         self.cancelled = False
+        self.on_cancel = None  # 点击取消时立即调用的回调（例如中止正在执行的远程命令）
         
     def create_widgets(self):
         """创建界面组件"""
@@ -70,7 +323,15 @@ class ProgressDialog:
         
         # 总体进度条
         self.overall_progress = ttk.Progressbar(main_frame, mode='determinate')
-        self.overall_progress.pack(fill=tk.X, pady=(0, 20))
+        self.overall_progress.pack(fill=tk.X, pady=(0, 5))
+        
+        # 传输统计（文件数、字节数、吞吐量、剩余时间）
+        self.stats_label = ttk.Label(main_frame, text="")
+        self.stats_label.pack(pady=(0, 2))
+        
+        # SSH往返统计（服务器模式）
+        self.ssh_stats_label = ttk.Label(main_frame, text="", foreground="gray")
+        self.ssh_stats_label.pack(pady=(0, 8))
         
         # 任务列表框架
         list_frame = ttk.LabelFrame(main_frame, text="任务详情", padding="5")
@@ -106,6 +367,28 @@ class ProgressDialog:
         if text:
             self.overall_label.config(text=text)
             
+    def update_transfer_stats(self, stats):
+        """根据TransferProgressTracker的快照更新进度条和统计信息"""
+        if stats["total_bytes"] > 0:
+            self.overall_progress['value'] = min(100, stats["done_bytes"] / stats["total_bytes"] * 100)
+        elif stats["total_files"] > 0:
+            self.overall_progress['value'] = min(100, stats["done_files"] / stats["total_files"] * 100)
+        
+        parts = [f"文件 {stats['done_files']}/{stats['total_files']}"]
+        if stats["total_bytes"] > 0:
+            parts.append(f"{format_bytes(stats['done_bytes'])}/{format_bytes(stats['total_bytes'])}")
+        if stats["byte_rate"] > 0:
+            parts.append(f"{format_bytes(stats['byte_rate'])}/s")
+        else:
+            parts.append(f"{stats['file_rate']:.1f} 文件/s")
+        if stats["eta"] is not None:
+            parts.append(f"剩余 {format_duration(stats['eta'])}")
+        self.stats_label.config(text="  |  ".join(parts))
+        
+    def update_ssh_stats(self, stats):
+        """根据SSHOperationStats的快照更新SSH往返统计"""
+        self.ssh_stats_label.config(text=SSHOperationStats.format_summary(stats))
+        
     def add_task_log(self, message):
         """添加任务日志"""
         self.text_widget.config(state=tk.NORMAL)
@@ -118,6 +401,8 @@ class ProgressDialog:
         self.cancelled = True
         self.cancel_button.config(state=tk.DISABLED)
         self.add_task_log("正在取消任务...")
+        if self.on_cancel:
+            self.on_cancel()
         
     def task_completed(self):
         """任务完成"""
@@ -133,6 +418,1539 @@ class ProgressDialog:
         """检查是否已取消"""
         return self.cancelled
 
+class TransferManifest:
+    """传输清单，每个任务一个JSONL文件，每行记录一次文件传输"""
+    
+    def __init__(self, manifest_path, hash_algorithm="blake2b"):
+        self.manifest_path = manifest_path
+        self.hash_algorithm = hash_algorithm
+        self.entry_count = 0
+        self._recorded = {}  # {目标路径: (字节数, 校验值)}，供派生副本复用
+        self._lock = threading.Lock()
+        
+        manifest_dir = os.path.dirname(manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        self._file = open(manifest_path, 'a', encoding='utf-8')
+    
+    def record(self, src, dst, size, file_hash, duration):
+        """记录一次传输（线程安全）"""
+        entry = {
+            "src": str(src),
+            "dst": str(dst),
+            "size": size,
+            "hash": file_hash,
+            "algorithm": self.hash_algorithm,
+            "duration": round(duration, 6)
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entry_count += 1
+            self._recorded[str(dst)] = (size, file_hash)
+    
+    def lookup(self, dst):
+        """已记录的目标文件 (字节数, 校验值)，未记录时返回None"""
+        with self._lock:
+            return self._recorded.get(str(dst))
+    
+    def close(self):
+        """关闭清单文件"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+class StreamChecksum:
+    """增量计算文件校验值，算法与传输清单一致（blake2b或crc32）"""
+    
+    def __init__(self, algorithm="blake2b"):
+        self.algorithm = algorithm
+        self.size = 0
+        self._crc = 0
+        self._hasher = None if algorithm == "crc32" else hashlib.blake2b()
+    
+    def update(self, data):
+        if self._hasher is None:
+            self._crc = zlib.crc32(data, self._crc)
+        else:
+            self._hasher.update(data)
+        self.size += len(data)
+    
+    def hexdigest(self):
+        if self._hasher is None:
+            return f"{self._crc & 0xffffffff:08x}"
+        return self._hasher.hexdigest()
+
+class ChecksumReader:
+    """只读文件包装：读取的同时计算校验值，供tarfile打包时使用"""
+    
+    def __init__(self, fileobj, checksum, on_read=None):
+        """
+        Args:
+            fileobj: 以二进制模式打开的源文件
+            checksum: StreamChecksum
+            on_read: 每读取一块后调用 on_read(字节数)，用于限速
+        """
+        self.fileobj = fileobj
+        self.checksum = checksum
+        self.on_read = on_read
+    
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if data:
+            self.checksum.update(data)
+            if self.on_read:
+                self.on_read(len(data))
+        return data
+
+class ChannelWriter:
+    """只写文件包装：数据直接通过SSH channel发送（不缓冲），供tarfile流式打包时使用"""
+    
+    def __init__(self, channel):
+        self.channel = channel
+        self.bytes_written = 0
+    
+    def write(self, data):
+        self.channel.sendall(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+class RemoteCommand:
+    """在独立channel上执行的远程命令
+    
+    两个后台线程持续读取stdout和stderr，输出窗口不会填满；调用方可以随时写入stdin、
+    等待stderr中出现指定内容（如接收端报告的端口号），最后等待命令结束。
+    """
+    
+    def __init__(self, channel, on_output=None, on_close=None):
+        """
+        Args:
+            channel: 已执行exec_command的paramiko channel
+            on_output: 可选的stdout流式回调 on_output(text)
+            on_close: 命令结束后的回调 on_close(channel)，用于注销channel、归还连接
+        """
+        self.channel = channel
+        self.on_output = on_output
+        self.on_close = on_close
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._stdout = []
+        self._stderr = ""
+        self._stderr_closed = False
+        self._cond = threading.Condition()
+        self._readers = [threading.Thread(target=self._read_stdout, daemon=True),
+                         threading.Thread(target=self._read_stderr, daemon=True)]
+        for reader in self._readers:
+            reader.start()
+    
+    def _read_stdout(self):
+        try:
+            while True:
+                data = self.channel.recv(65536)
+                if not data:
+                    break
+                self.bytes_received += len(data)
+                self._stdout.append(data)
+                if self.on_output:
+                    self.on_output(data.decode('utf-8', errors='replace'))
+        except Exception:
+            pass
+    
+    def _read_stderr(self):
+        try:
+            while True:
+                data = self.channel.recv_stderr(65536)
+                if not data:
+                    break
+                with self._cond:
+                    self._stderr += data.decode('utf-8', errors='replace')
+                    self._cond.notify_all()
+        except Exception:
+            pass
+        finally:
+            with self._cond:
+                self._stderr_closed = True
+                self._cond.notify_all()
+    
+    def write(self, data):
+        self.channel.sendall(data)
+        self.bytes_sent += len(data)
+    
+    def close_stdin(self):
+        try:
+            self.channel.shutdown_write()
+        except Exception:
+            pass
+    
+    def wait_for_stderr(self, pattern, timeout=30):
+        """等待stderr中出现匹配pattern的内容
+        
+        Returns:
+            re.Match；命令先结束或超时时返回None
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                match = re.search(pattern, self._stderr)
+                remaining = deadline - time.time()
+                if match or self._stderr_closed or remaining <= 0:
+                    return match
+                self._cond.wait(remaining)
+    
+    def wait(self):
+        """等待命令结束
+        
+        Returns:
+            tuple: (stdout, stderr, exit_code)，channel被关闭而没有退出码时exit_code为-1
+        """
+        try:
+            for reader in self._readers:
+                reader.join()
+            exit_code = self.channel.recv_exit_status()
+        finally:
+            self.channel.close()
+            if self.on_close:
+                self.on_close(self.channel)
+        return b"".join(self._stdout).decode('utf-8', errors='replace'), self._stderr, exit_code
+
+class TransferProgressTracker:
+    """汇总传输进度，计算吞吐量和剩余时间
+    
+    远程rsync和批量脚本在输出中逐文件打印进度标记，stream_parser返回的解析函数
+    增量解析这些输出；辅助程序等本地可见结果的路径直接调用add。
+    """
+    
+    OP_MARKER = "__IMGMGR_OP__"      # 批量脚本: __IMGMGR_OP__ <操作序号>
+    FILE_MARKER = "__IMGMGR_FILE__"  # rsync --out-format: __IMGMGR_FILE__ <字节数> <文件名>
+    
+    def __init__(self, total_files, total_bytes=0, source_sizes=None, on_update=None, update_interval=0.3):
+        """
+        Args:
+            total_files: 总文件数
+            total_bytes: 总字节数（未知时为0，按文件数估算剩余时间）
+            source_sizes: {源文件路径: 字节数}，用于将批量脚本的操作序号换算为字节数
+            on_update: 进度更新回调 on_update(snapshot)，按update_interval节流
+            update_interval: 回调最小间隔（秒）
+        """
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.source_sizes = source_sizes or {}
+        self.on_update = on_update
+        self.update_interval = update_interval
+        
+        self.done_files = 0
+        self.done_bytes = 0
+        self.start_time = time.time()
+        self._last_update = 0.0
+        self._lock = threading.Lock()
+    
+    def add(self, files=1, nbytes=0):
+        """记录已完成的文件（线程安全）"""
+        with self._lock:
+            self.done_files += files
+            self.done_bytes += nbytes
+            now = time.time()
+            due = now - self._last_update >= self.update_interval
+            if due:
+                self._last_update = now
+        if due:
+            self._notify()
+    
+    def size_of(self, source_path):
+        """已知的源文件大小"""
+        return self.source_sizes.get(source_path, 0)
+    
+    def stream_parser(self, sources=None):
+        """创建一个输出流解析函数，每个远程命令各用一个（各自缓存不完整的行）
+        
+        Args:
+            sources: 批量脚本的源文件列表，下标与__IMGMGR_OP__后的序号对应
+            
+        Returns:
+            callable: feed(text)
+        """
+        buffer = [""]
+        
+        def feed(text):
+            buffer[0] += text
+            # 兼容以\r刷新的进度行；最后一段可能不完整，留待下次
+            lines = re.split(r"[\r\n]", buffer[0])
+            buffer[0] = lines.pop()
+            for line in lines:
+                line = line.strip()
+                if line.startswith(self.OP_MARKER):
+                    try:
+                        index = int(line[len(self.OP_MARKER):].strip())
+                    except ValueError:
+                        continue
+                    source = sources[index] if sources and 0 <= index < len(sources) else None
+                    self.add(1, self.size_of(source) if source else 0)
+                elif line.startswith(self.FILE_MARKER):
+                    fields = line[len(self.FILE_MARKER):].split(None, 1)
+                    try:
+                        self.add(1, int(fields[0].replace(",", "")))
+                    except (IndexError, ValueError):
+                        self.add(1, 0)
+        
+        return feed
+    
+    def snapshot(self):
+        """当前进度快照"""
+        with self._lock:
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            byte_rate = self.done_bytes / elapsed
+            file_rate = self.done_files / elapsed
+            eta = None
+            if self.total_bytes > 0 and byte_rate > 0:
+                eta = max(0, self.total_bytes - self.done_bytes) / byte_rate
+            elif self.total_files > 0 and file_rate > 0:
+                eta = max(0, self.total_files - self.done_files) / file_rate
+            return {
+                "done_files": self.done_files,
+                "total_files": self.total_files,
+                "done_bytes": self.done_bytes,
+                "total_bytes": self.total_bytes,
+                "elapsed": elapsed,
+                "byte_rate": byte_rate,
+                "file_rate": file_rate,
+                "eta": eta
+            }
+    
+    def _notify(self):
+        if self.on_update:
+            self.on_update(self.snapshot())
+    
+    def finish(self):
+        """任务阶段结束时强制刷新一次"""
+        self._notify()
+
+class SSHOperationStats:
+    """按命令类别统计SSH往返次数、字节数和耗时
+    
+    每个服务器模式任务使用一个实例，持久shell命令、exec命令、SFTP操作和异步编排器中的命令
+    都记录到当前实例；耗时按固定区间累计直方图，往返次数的回退可以直接从任务摘要中看出。
+    往返次数由调用方按执行方式估算（如流水线批次计1次、exec命令计2次），并非逐个报文实测，
+    摘要中标注为估算；失败的尝试只计入失败次数和耗时，不计入往返、命令数和字节数。
+    """
+    
+    HISTOGRAM_BOUNDS = (0.005, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)  # 直方图区间上限（秒），最后一档为超过5秒
+    PROBE_COMMANDS = {"test", "[", "stat", "find", "ls", "command", "which", "cat", "df", "du",
+                      "nproc", "uname", "echo", "true", "readlink", "printf"}
+    
+    def __init__(self, on_update=None, update_interval=0.5):
+        """
+        Args:
+            on_update: 统计更新回调 on_update(stats)，按update_interval节流
+            update_interval: 回调最小间隔（秒）
+        """
+        self.on_update = on_update
+        self.update_interval = update_interval
+        self.start_time = time.time()
+        self.categories = {}  # {类别: {"operations", "commands", "round_trips", "failures", "seconds", "max_seconds", "bytes_sent", "bytes_received", "histogram"}}
+        self._last_update = 0.0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def classify(cls, command):
+        """根据命令内容判断类别：probe、mkdir、cp、mv、rsync、script、agent、rm或other"""
+        text = command.strip()
+        if text.startswith("if command -v setsid "):
+            # cancellable_command包装的命令按被包装的原始命令归类
+            try:
+                tokens = shlex.split(text)
+                inner = tokens[tokens.index("-c") + 1]
+                return cls.classify(inner.split("; ", 1)[1].split("\n", 1)[0])
+            except (ValueError, IndexError):
+                pass
+        if "rsync " in text:
+            return "rsync"
+        words = text.split(None, 1)
+        program = os.path.basename(words[0]) if words else ""
+        # printf ... | xargs <程序> 或 xargs <程序> < 列表文件：参数经管道或列表文件传入的批量命令按实际执行的程序归类
+        piped = re.search(r"(?:^|\|)\s*xargs\s+(?:-\S+\s+)*(\S+)", text)
+        if program in ("printf", "xargs") and piped:
+            program = os.path.basename(piped.group(1))
+        if program in ("mkdir", "cp", "mv", "rm"):
+            return program
+        if program in ("bash", "sh"):
+            return "script"
+        if program.startswith("python"):
+            return "agent"
+        if program in cls.PROBE_COMMANDS:
+            return "probe"
+        return "other"
+    
+    def record(self, category, seconds, bytes_sent=0, bytes_received=0, round_trips=1, commands=1, failed=False):
+        """记录一次操作（线程安全）
+        
+        Args:
+            category: 命令类别
+            seconds: 耗时（秒）
+            bytes_sent: 发送的字节数（命令文本或上传内容）
+            bytes_received: 接收的字节数
+            round_trips: 按执行方式估算的网络往返次数
+            commands: 该操作包含的命令数（流水线批量执行时大于1）
+            failed: 是否为失败的尝试（只计入failures和耗时）
+        """
+        with self._lock:
+            entry = self.categories.get(category)
+            if entry is None:
+                entry = self.categories[category] = {
+                    "operations": 0, "commands": 0, "round_trips": 0, "failures": 0, "seconds": 0.0, "max_seconds": 0.0,
+                    "bytes_sent": 0, "bytes_received": 0,
+                    "histogram": [0] * (len(self.HISTOGRAM_BOUNDS) + 1)
+                }
+            entry["operations"] += 1
+            if failed:
+                # 无法确定失败前实际发生了多少交换，不计入往返和字节
+                entry["failures"] += 1
+            else:
+                entry["commands"] += commands
+                entry["round_trips"] += round_trips
+                entry["bytes_sent"] += bytes_sent
+                entry["bytes_received"] += bytes_received
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            bucket = next((i for i, bound in enumerate(self.HISTOGRAM_BOUNDS) if seconds <= bound),
+                          len(self.HISTOGRAM_BOUNDS))
+            entry["histogram"][bucket] += 1
+            
+            now = time.time()
+            due = now - self._last_update >= self.update_interval
+            if due:
+                self._last_update = now
+        if due and self.on_update:
+            self.on_update(self.snapshot())
+    
+    def record_command(self, command, seconds, stdout="", stderr="", round_trips=1, failed=False):
+        """记录单个shell命令"""
+        self.record(self.classify(command), seconds, len(command.encode('utf-8')),
+                    len(stdout.encode('utf-8')) + len(stderr.encode('utf-8')), round_trips, failed=failed)
+    
+    def snapshot(self):
+        """统计快照，包含汇总和各类别明细"""
+        with self._lock:
+            categories = {name: dict(entry, histogram=list(entry["histogram"]))
+                          for name, entry in self.categories.items()}
+        totals = {key: sum(entry[key] for entry in categories.values())
+                  for key in ("operations", "commands", "round_trips", "failures", "seconds", "bytes_sent", "bytes_received")}
+        totals["elapsed"] = time.time() - self.start_time
+        # round_trips为估算值（见类说明），写入任务摘要时一并标明
+        return {"totals": totals, "categories": categories, "round_trips_estimated": True,
+                "histogram_bounds": list(self.HISTOGRAM_BOUNDS)}
+    
+    @staticmethod
+    def format_summary(stats):
+        """一行摘要，用于进度对话框"""
+        totals = stats["totals"]
+        failures = f"失败 {totals['failures']}  |  " if totals.get("failures") else ""
+        return (f"SSH往返(估算) {totals['round_trips']}  |  命令 {totals['commands']}  |  {failures}"
+                f"↑{format_bytes(totals['bytes_sent'])} ↓{format_bytes(totals['bytes_received'])}  |  "
+                f"SSH耗时 {totals['seconds']:.1f}s")
+    
+    @classmethod
+    def format_details(cls, stats):
+        """各类别明细，每个类别一行"""
+        labels = [f"≤{int(bound * 1000)}ms" for bound in cls.HISTOGRAM_BOUNDS]
+        labels.append(f">{int(cls.HISTOGRAM_BOUNDS[-1] * 1000)}ms")
+        lines = []
+        for name, entry in sorted(stats["categories"].items(), key=lambda item: -item[1]["round_trips"]):
+            average = entry["seconds"] / entry["operations"] * 1000 if entry["operations"] else 0
+            histogram = " ".join(f"{label}:{count}" for label, count in zip(labels, entry["histogram"]) if count)
+            failures = f"失败 {entry['failures']}，" if entry.get("failures") else ""
+            lines.append(f"{name}: 往返(估算) {entry['round_trips']}，命令 {entry['commands']}，{failures}"
+                         f"平均 {average:.0f}ms，最长 {entry['max_seconds'] * 1000:.0f}ms [{histogram}]")
+        return lines
+
+class AdaptiveConcurrencyController:
+    """AIMD并发控制器，根据实测吞吐量和错误率动态调整在途操作数
+    
+    每个统计窗口结束时：吞吐量未下降且错误率正常则并发数加1（加性增），
+    出现错误或吞吐量明显下降则按比例缩减（乘性减），最终收敛到吞吐量最高的并发数附近。
+    """
+    
+    def __init__(self, name, initial=2, min_limit=1, max_limit=16, window_seconds=2.0,
+                 error_threshold=0.1, decrease_factor=0.5):
+        self.name = name
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.window_seconds = window_seconds
+        self.error_threshold = error_threshold
+        self.decrease_factor = decrease_factor
+        
+        self.in_flight = 0
+        self.best_limit = int(self.limit)
+        self.best_throughput = 0.0
+        self.last_throughput = 0.0
+        self.last_error_rate = 0.0
+        
+        self._cond = threading.Condition()
+        self._reset_window()
+    
+    def _reset_window(self):
+        """开始新的统计窗口"""
+        self._window_start = time.time()
+        self._window_files = 0
+        self._window_ops = 0
+        self._window_errors = 0
+        self._window_peak = self.in_flight
+    
+    def acquire(self, is_cancelled=None):
+        """获取一个在途操作名额
+        
+        Args:
+            is_cancelled: 返回是否已取消的函数
+            
+        Returns:
+            bool: 是否获取成功（取消时返回False）
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                if is_cancelled and is_cancelled():
+                    return False
+                self._cond.wait(0.1)
+            self.in_flight += 1
+            self._window_peak = max(self._window_peak, self.in_flight)
+            return True
+    
+    def try_acquire(self):
+        """非阻塞地获取名额（供事件循环中的协程轮询使用）"""
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            self._window_peak = max(self._window_peak, self.in_flight)
+            return True
+    
+    def release(self, success=True, files=1):
+        """归还名额并记录操作结果
+        
+        Args:
+            success: 操作是否成功
+            files: 本次操作完成的文件数
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._window_ops += 1
+            if success:
+                self._window_files += files
+            else:
+                self._window_errors += 1
+            self._adjust()
+            self._cond.notify_all()
+    
+    def _adjust(self):
+        """窗口结束时按AIMD规则调整并发上限（调用方持有锁）"""
+        elapsed = time.time() - self._window_start
+        if elapsed < self.window_seconds or self._window_ops == 0:
+            return
+        
+        throughput = self._window_files / elapsed
+        error_rate = self._window_errors / self._window_ops
+        window_limit = int(self.limit)
+        # 只有并发上限真正成为瓶颈时才尝试增加，避免任务不足时盲目放大
+        limit_reached = self._window_peak >= window_limit
+        
+        # 记录历史最佳吞吐量及对应并发数，最佳值缓慢衰减以适应链路变化
+        if throughput > self.best_throughput:
+            self.best_throughput = throughput
+            self.best_limit = window_limit
+        else:
+            self.best_throughput *= 0.98
+        
+        if error_rate > self.error_threshold:
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        elif throughput < self.best_throughput * 0.85 and window_limit > self.best_limit:
+            # 增加并发后吞吐量反而下降，回退到历史最佳并发数
+            self.limit = float(max(self.min_limit, self.best_limit))
+        elif limit_reached:
+            self.limit = min(self.max_limit, self.limit + 1)
+        
+        self.last_throughput = throughput
+        self.last_error_rate = error_rate
+        self._reset_window()
+    
+    def snapshot(self):
+        """获取当前控制器状态"""
+        with self._cond:
+            return {
+                "name": self.name,
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "throughput": round(self.last_throughput, 2),
+                "error_rate": round(self.last_error_rate, 3),
+                "best_limit": self.best_limit
+            }
+
+class TokenBucket:
+    """令牌桶，按固定速率补充令牌，超出容量的请求以透支方式等待"""
+    
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate: 每秒补充的令牌数，0或None表示不限速
+            capacity: 桶容量，默认为1秒的令牌量
+        """
+        self.rate = float(rate or 0)
+        self.capacity = float(capacity or self.rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def consume(self, amount, is_cancelled=None):
+        """消耗令牌，令牌不足时阻塞等待
+        
+        Args:
+            amount: 需要的令牌数
+            is_cancelled: 返回是否已取消的函数
+            
+        Returns:
+            bool: 是否成功消耗（取消时返回False）
+        """
+        if self.rate <= 0 or amount <= 0:
+            return True
+        
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            # 允许透支，大块请求不会因超过容量而永远等待
+            self.tokens -= amount
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+        
+        while wait_time > 0:
+            if is_cancelled and is_cancelled():
+                return False
+            step = min(wait_time, 0.2)
+            time.sleep(step)
+            wait_time -= step
+        return True
+
+class TransferRateLimiter:
+    """传输限速器，分别限制带宽（字节/秒）和IOPS（操作/秒）"""
+    
+    def __init__(self, name, bytes_per_sec=0, ops_per_sec=0):
+        self.name = name
+        self.bytes_per_sec = bytes_per_sec or 0
+        self.ops_per_sec = ops_per_sec or 0
+        self.byte_bucket = TokenBucket(self.bytes_per_sec)
+        self.op_bucket = TokenBucket(self.ops_per_sec, capacity=max(1, self.ops_per_sec))
+    
+    def consume(self, nbytes=0, ops=0, is_cancelled=None):
+        """消耗带宽和操作配额"""
+        if ops and not self.op_bucket.consume(ops, is_cancelled):
+            return False
+        if nbytes and not self.byte_bucket.consume(nbytes, is_cancelled):
+            return False
+        return True
+    
+    def is_limited(self):
+        """是否设置了任何限速"""
+        return self.bytes_per_sec > 0 or self.ops_per_sec > 0
+
+class TransferLane:
+    """单个目标目录的独立传输通道，拥有自己的队列、并发度和进度"""
+    
+    def __init__(self, name, worker_func, workers=1, is_cancelled=None, controller=None, item_weight=None):
+        """
+        Args:
+            name: 通道名称（通常为目标目录显示名）
+            worker_func: 处理单个条目的函数，返回完成的操作数，失败时抛出异常
+            workers: 通道内并发线程数（使用controller时为线程上限）
+            is_cancelled: 返回是否已取消的函数
+            controller: 可选的AdaptiveConcurrencyController，动态限制在途操作数
+            item_weight: 条目计入进度的数量 item_weight(item)，默认每个条目计1（一个条目是一批文件时使用）
+        """
+        self.name = name
+        self.queue = queue.Queue()
+        self.workers = max(1, int(workers))
+        self.worker_func = worker_func
+        self.is_cancelled = is_cancelled or (lambda: False)
+        self.controller = controller
+        self.item_weight = item_weight or (lambda item: 1)
+        
+        self.total = 0
+        self.completed = 0
+        self.operations = 0
+        self.failed = []  # [(item, error), ...]
+        self.start_time = None
+        self.end_time = None
+        
+        self._lock = threading.Lock()
+        self._threads = []
+    
+    def put(self, item):
+        """向通道队列添加条目（需在start之前调用）"""
+        self.queue.put(item)
+        self.total += self.item_weight(item)
+    
+    def start(self):
+        """启动通道工作线程"""
+        self.start_time = time.time()
+        for i in range(min(self.workers, max(1, self.total))):
+            thread = threading.Thread(target=self._run, name=f"lane-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def _run(self):
+        """工作线程主循环"""
+        while not self.is_cancelled():
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if self.controller and not self.controller.acquire(self.is_cancelled):
+                break
+            
+            success = True
+            try:
+                operations = self.worker_func(item)
+                with self._lock:
+                    self.completed += self.item_weight(item)
+                    self.operations += operations
+            except Exception as e:
+                success = False
+                with self._lock:
+                    self.completed += self.item_weight(item)
+                    self.failed.append((item, str(e)))
+            finally:
+                if self.controller:
+                    # 按条目包含的文件数计入吞吐量（tar流一个条目是一批文件）
+                    self.controller.release(success=success, files=self.item_weight(item))
+        
+        with self._lock:
+            self.end_time = time.time()
+    
+    def is_done(self):
+        """通道内所有线程是否已结束"""
+        return all(not thread.is_alive() for thread in self._threads)
+    
+    def join(self, timeout=None):
+        """等待通道完成"""
+        for thread in self._threads:
+            thread.join(timeout)
+    
+    def elapsed(self):
+        """通道耗时（秒）"""
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+class RemoteCommandTimeout(Exception):
+    """远程命令超过时限没有任何输出"""
+
+class RemoteShellSession:
+    """持久的远程shell会话，通过分帧协议执行命令
+    
+    每个命令以唯一标记结尾，stdout标记中附带退出码，stderr单独标记结束。
+    多个命令可以一次性写入（流水线），再按顺序读取结果，省去每个命令的
+    channel打开和远程进程启动开销。
+    """
+    
+    PIPELINE_BATCH = 500  # 每批写入的命令数
+    # 会话启动后先加载~/.bashrc（sshd以bash -c执行exec命令时同样会加载），用户或conda、module
+    # 加入PATH的rsync、python3、setsid等工具与exec方式一样可用；其输出丢弃，不干扰分帧
+    STARTUP = '[ -r "$HOME/.bashrc" ] && . "$HOME/.bashrc" >/dev/null 2>&1 </dev/null\n'
+    
+    def __init__(self, client, shell_command="exec bash --noprofile --norc"):
+        self.channel = client.get_transport().open_session()
+        self.channel.exec_command(shell_command)
+        self.channel.sendall(self.STARTUP.encode('utf-8'))
+        self._stdout_buffer = b""
+        self._stderr_buffer = b""
+        self._lock = threading.Lock()
+        self._last_activity = time.time()  # 最后一次收发数据的时间，超时按无活动时长计算
+        self.command_count = 0
+    
+    def is_alive(self):
+        """会话是否仍可用"""
+        return not self.channel.closed and not self.channel.exit_status_ready()
+    
+    def close(self):
+        """关闭会话"""
+        try:
+            self.channel.close()
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _frame(command, token):
+        """构造分帧命令：在子shell中eval执行，避免exit或语法错误终止会话"""
+        return (
+            f"( eval {shlex.quote(command)} ) < /dev/null; "
+            f"printf '\\n%s %d\\n' '{token}' \"$?\"; "
+            f"printf '\\n%s\\n' '{token}' >&2\n"
+        )
+    
+    def _pump(self, timeout):
+        """读取两个流中已到达的数据，避免任一流的窗口被填满造成死锁"""
+        delay = 0.0005
+        while True:
+            received = False
+            if self.channel.recv_ready():
+                self._stdout_buffer += self.channel.recv(65536)
+                received = True
+            if self.channel.recv_stderr_ready():
+                self._stderr_buffer += self.channel.recv_stderr(65536)
+                received = True
+            if received:
+                self._last_activity = time.time()
+                return
+            if self.channel.closed or self.channel.exit_status_ready():
+                raise Exception("远程shell会话已关闭")
+            if time.time() - self._last_activity > timeout:
+                raise RemoteCommandTimeout("远程shell命令执行超时")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+    
+    def _read_result(self, token, timeout, on_output=None):
+        """读取指定标记对应的命令结果
+        
+        on_output不为空时，标记之前已完整到达的输出会边读边回调，不必等命令结束。
+        """
+        stdout_marker = b"\n" + token.encode() + b" "
+        stderr_marker = b"\n" + token.encode() + b"\n"
+        stdout_data = None
+        exit_code = None
+        stderr_data = None
+        streamed = []
+        
+        while stdout_data is None or stderr_data is None:
+            if stdout_data is None:
+                index = self._stdout_buffer.find(stdout_marker)
+                if index >= 0:
+                    line_end = self._stdout_buffer.find(b"\n", index + len(stdout_marker))
+                    if line_end >= 0:
+                        stdout_data = b"".join(streamed) + self._stdout_buffer[:index]
+                        exit_code = int(self._stdout_buffer[index + len(stdout_marker):line_end])
+                        if on_output and index > 0:
+                            on_output(self._stdout_buffer[:index].decode('utf-8', errors='replace'))
+                        self._stdout_buffer = self._stdout_buffer[line_end + 1:]
+                elif on_output:
+                    # 标记以\n开头，最后一个\n之后可能是不完整的标记，只回调它之前的部分
+                    safe_end = max(self._stdout_buffer.rfind(b"\r") + 1, self._stdout_buffer.rfind(b"\n"))
+                    if safe_end > 0:
+                        chunk = self._stdout_buffer[:safe_end]
+                        self._stdout_buffer = self._stdout_buffer[safe_end:]
+                        streamed.append(chunk)
+                        on_output(chunk.decode('utf-8', errors='replace'))
+            if stderr_data is None:
+                index = self._stderr_buffer.find(stderr_marker)
+                if index >= 0:
+                    stderr_data = self._stderr_buffer[:index]
+                    self._stderr_buffer = self._stderr_buffer[index + len(stderr_marker):]
+            if stdout_data is None or stderr_data is None:
+                self._pump(timeout)
+        
+        return stdout_data.decode('utf-8', errors='replace'), stderr_data.decode('utf-8', errors='replace'), exit_code
+    
+    def _send(self, data, timeout):
+        """分块发送命令，发送窗口已满时先读取已到达的输出
+        
+        远程输出填满channel窗口后bash不再读取stdin，只发送不读取会互相等待。
+        """
+        sent = 0
+        delay = 0.0005
+        while sent < len(data):
+            progressed = False
+            if self.channel.send_ready():
+                sent += self.channel.send(data[sent:sent + 32768])
+                progressed = True
+            if self.channel.recv_ready():
+                self._stdout_buffer += self.channel.recv(65536)
+                progressed = True
+            if self.channel.recv_stderr_ready():
+                self._stderr_buffer += self.channel.recv_stderr(65536)
+                progressed = True
+            if progressed:
+                self._last_activity = time.time()
+                delay = 0.0005
+                continue
+            if self.channel.closed or self.channel.exit_status_ready():
+                raise Exception("远程shell会话已关闭")
+            if time.time() - self._last_activity > timeout:
+                raise RemoteCommandTimeout("远程shell命令执行超时")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+    
+    def run_many(self, commands, timeout=600, on_output=None):
+        """流水线执行多个命令
+        
+        命令按PIPELINE_BATCH分批发送，读取一批结果前先发出下一批，
+        缓冲的输出不随命令数增长，批与批之间也不必等待往返。
+        
+        Args:
+            commands: 命令列表
+            timeout: 没有任何数据收发的最长时间（秒），每次收到输出重新计时，
+                持续输出的长时间命令不会超时
+            on_output: 可选的stdout流式回调 on_output(text)
+            
+        Returns:
+            list: [(stdout, stderr, exit_code), ...]，与commands顺序一致
+        """
+        with self._lock:
+            self._last_activity = time.time()
+            batches = []
+            for start in range(0, len(commands), self.PIPELINE_BATCH):
+                batch = commands[start:start + self.PIPELINE_BATCH]
+                tokens = [f"__IMGMGR_{uuid.uuid4().hex}__" for _ in batch]
+                payload = "".join(self._frame(command, token) for command, token in zip(batch, tokens))
+                batches.append((payload.encode('utf-8'), tokens))
+            
+            results = []
+            for index, (payload, tokens) in enumerate(batches):
+                if index == 0:
+                    self._send(payload, timeout)
+                    self.command_count += len(tokens)
+                if index + 1 < len(batches):
+                    self._send(batches[index + 1][0], timeout)
+                    self.command_count += len(batches[index + 1][1])
+                results.extend(self._read_result(token, timeout, on_output) for token in tokens)
+            return results
+    
+    def run(self, command, timeout=600, on_output=None):
+        """执行单个命令，返回 (stdout, stderr, exit_code)"""
+        return self.run_many([command], timeout, on_output)[0]
+
+class PooledSSHConnection:
+    """连接池中的单个SSH连接及其健康状态"""
+    
+    def __init__(self, host, client):
+        self.host = host
+        self.client = client
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.use_count = 0
+        self.failures = 0
+        self.shell_session = None  # 该连接上的持久shell会话（按需创建）
+        self.sftp = None  # 该连接上的持久SFTP会话（按需创建）
+    
+    def get_shell_session(self):
+        """获取该连接上的持久shell会话，失效时重建"""
+        if self.shell_session is None or not self.shell_session.is_alive():
+            if self.shell_session:
+                self.shell_session.close()
+            self.shell_session = RemoteShellSession(self.client)
+        return self.shell_session
+    
+    def reset_shell_session(self):
+        """丢弃shell会话（例如超时后分帧状态不可信时）"""
+        if self.shell_session:
+            self.shell_session.close()
+            self.shell_session = None
+    
+    def get_sftp(self):
+        """获取该连接上的持久SFTP会话，channel关闭后重建"""
+        if self.sftp is None or self.sftp.sock.closed:
+            self.reset_sftp()
+            self.sftp = self.client.open_sftp()
+        return self.sftp
+    
+    def reset_sftp(self):
+        """丢弃SFTP会话（出错后请求状态不可信时）"""
+        if self.sftp:
+            try:
+                self.sftp.close()
+            except Exception:
+                pass
+            self.sftp = None
+    
+    def is_active(self):
+        """底层transport是否仍处于活动状态"""
+        try:
+            transport = self.client.get_transport()
+            return transport is not None and transport.is_active()
+        except Exception:
+            return False
+    
+    def close(self):
+        """关闭连接"""
+        self.reset_shell_session()
+        self.reset_sftp()
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+class SSHConnectionPool:
+    """线程安全的SSH连接池
+    
+    每个主机最多维护max_per_host个独立的paramiko transport，线程通过checkout借出、
+    checkin归还；连接失败次数过多、超过生命周期或空闲过久时自动淘汰。
+    """
+    
+    def __init__(self, connect_func, max_per_host=4, idle_timeout=300, max_lifetime=7200,
+                 max_uses=1000, max_failures=3, health_check=None):
+        """
+        Args:
+            connect_func: 创建连接的函数 connect_func(host) -> paramiko.SSHClient
+            max_per_host: 每个主机的最大连接数
+            idle_timeout: 空闲超过该秒数的连接被回收
+            max_lifetime: 连接最长生命周期（秒）
+            max_uses: 单个连接最大借出次数
+            max_failures: 连续失败超过该次数的连接被淘汰
+            health_check: 可选的健康检查函数 health_check(connection) -> bool
+        """
+        self.connect_func = connect_func
+        self.max_per_host = max(1, int(max_per_host))
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.max_uses = max_uses
+        self.max_failures = max_failures
+        self.health_check = health_check
+        
+        self._idle = {}  # {主机: [PooledSSHConnection, ...]}
+        self._open_counts = {}  # {主机: 已打开连接数（含借出）}
+        self._cond = threading.Condition()
+    
+    def _is_usable(self, connection):
+        """按本地状态判断空闲连接是否可以继续使用（不涉及网络，可在持锁时调用）"""
+        now = time.time()
+        if connection.failures >= self.max_failures:
+            return False
+        if now - connection.created_at > self.max_lifetime or connection.use_count >= self.max_uses:
+            return False
+        if not connection.is_active():
+            return False
+        return True
+    
+    def _passes_health_check(self, connection):
+        """执行健康检查（可能发送keepalive并等待回复，必须在锁外调用）"""
+        if not self.health_check:
+            return True
+        try:
+            return bool(self.health_check(connection))
+        except Exception:
+            return False
+    
+    def _discard(self, connection):
+        """丢弃连接并释放主机名额（调用方持有锁）"""
+        self._open_counts[connection.host] = max(0, self._open_counts.get(connection.host, 1) - 1)
+        connection.close()
+        self._cond.notify_all()
+    
+    def evict_idle(self):
+        """回收所有空闲超时的连接"""
+        now = time.time()
+        with self._cond:
+            for host, connections in self._idle.items():
+                keep = []
+                for connection in connections:
+                    if now - connection.last_used > self.idle_timeout:
+                        self._discard(connection)
+                    else:
+                        keep.append(connection)
+                self._idle[host] = keep
+    
+    def checkout(self, host, timeout=120):
+        """借出一个连接，池满时等待其他线程归还
+        
+        Args:
+            host: 主机名
+            timeout: 最长等待秒数
+            
+        Returns:
+            PooledSSHConnection对象
+        """
+        self.evict_idle()
+        deadline = time.time() + timeout
+        
+        while True:
+            candidate = None
+            with self._cond:
+                while True:
+                    idle = self._idle.setdefault(host, [])
+                    while idle:
+                        # 优先复用最近使用的连接（LIFO），让多余的连接自然空闲回收
+                        connection = idle.pop()
+                        if self._is_usable(connection):
+                            candidate = connection
+                            break
+                        self._discard(connection)
+                    if candidate:
+                        break
+                    
+                    if self._open_counts.get(host, 0) < self.max_per_host:
+                        self._open_counts[host] = self._open_counts.get(host, 0) + 1
+                        break
+                    
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Exception(f"等待SSH连接池超时（主机: {host}，上限: {self.max_per_host}）")
+                    self._cond.wait(min(remaining, 1.0))
+            
+            if candidate is None:
+                break
+            # 取出的连接已计入借出数，在锁外做健康检查，不阻塞其他线程借出和归还
+            if self._passes_health_check(candidate):
+                candidate.use_count += 1
+                return candidate
+            with self._cond:
+                self._discard(candidate)
+        
+        # 在锁外建立连接，避免阻塞其他线程归还连接
+        try:
+            client = self.connect_func(host)
+        except Exception:
+            with self._cond:
+                self._open_counts[host] = max(0, self._open_counts.get(host, 1) - 1)
+                self._cond.notify_all()
+            raise
+        
+        connection = PooledSSHConnection(host, client)
+        connection.use_count = 1
+        return connection
+    
+    def checkin(self, connection, broken=False):
+        """归还连接
+        
+        Args:
+            connection: 借出的连接
+            broken: 连接是否已损坏（损坏的连接直接关闭）
+        """
+        with self._cond:
+            if broken:
+                connection.failures += 1
+            else:
+                connection.failures = 0
+            
+            if broken and (connection.failures >= self.max_failures or not connection.is_active()):
+                self._discard(connection)
+                return
+            
+            # last_used只记录成功的活动，供健康检查判断是否需要主动探测
+            if not broken:
+                connection.last_used = time.time()
+            self._idle.setdefault(connection.host, []).append(connection)
+            self._cond.notify_all()
+    
+    def connection(self, host, timeout=120):
+        """以上下文管理器方式借出连接，块内抛出异常时按损坏连接归还"""
+        pool = self
+        
+        class _Checkout:
+            def __enter__(self):
+                self.connection = pool.checkout(host, timeout)
+                return self.connection
+            
+            def __exit__(self, exc_type, exc, tb):
+                pool.checkin(self.connection, broken=exc_type is not None)
+                return False
+        
+        return _Checkout()
+    
+    def close_all(self, host=None):
+        """关闭空闲连接（借出中的连接在归还后仍可使用）"""
+        with self._cond:
+            hosts = [host] if host else list(self._idle.keys())
+            for h in hosts:
+                for connection in self._idle.pop(h, []):
+                    self._discard(connection)
+    
+    def stats(self):
+        """连接池状态 {主机: {"open": n, "idle": m}}"""
+        with self._cond:
+            return {
+                host: {"open": count, "idle": len(self._idle.get(host, []))}
+                for host, count in self._open_counts.items()
+            }
+
+class AsyncRemoteShell:
+    """由事件循环驱动的持久shell会话
+    
+    与RemoteShellSession使用相同的分帧协议，但写入命令后立即返回future，不占用线程等待；
+    channel可读时由事件循环回调解析输出并按提交顺序完成future，同一会话可以有任意多个在途命令。
+    """
+    
+    def __init__(self, loop, channel, connection=None):
+        self.loop = loop
+        self.channel = channel
+        self.connection = connection
+        self.pending = deque()  # 在途命令，按提交顺序排列
+        self.closed = False
+        self._stdout_buffer = b""
+        self._stderr_buffer = b""
+        self._outgoing = bytearray()  # 尚未写入channel的命令数据
+        self._flush_scheduled = False
+        self.last_activity = time.time()  # 最后一次收发数据的时间，用于按无活动时长判断超时
+        # paramiko为channel提供一个同时反映stdout和stderr可读状态的管道描述符
+        loop.add_reader(channel.fileno(), self._on_readable)
+    
+    def submit(self, command, on_output=None):
+        """提交命令，返回结果为 (stdout, stderr, exit_code) 的future"""
+        future = self.loop.create_future()
+        # 调用方超时或取消后可能不再等待该future，避免未读取的异常被事件循环报警
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if self.closed:
+            future.set_exception(Exception("远程shell会话已关闭"))
+            return future
+        
+        token = f"__IMGMGR_{uuid.uuid4().hex}__"
+        if not self.pending:
+            # 空闲期间没有输出不算无活动
+            self.last_activity = time.time()
+        self.pending.append({
+            "command": command,
+            "token": token.encode(),
+            "future": future,
+            "on_output": on_output,
+            "streamed": [],
+            "stdout": None,
+            "exit_code": None,
+        })
+        self._outgoing += RemoteShellSession._frame(command, token).encode('utf-8')
+        self._flush()
+        return future
+    
+    def _flush(self):
+        """在不阻塞事件循环的前提下写入待发送数据
+        
+        sendall在对端窗口用尽时会阻塞整个事件循环（所有任务的输出都无法读取），
+        这里只在send_ready()时写入，剩余部分稍后再试。
+        """
+        self._flush_scheduled = False
+        if self.closed:
+            return
+        try:
+            while self._outgoing and self.channel.send_ready():
+                sent = self.channel.send(bytes(self._outgoing[:32768]))
+                if sent <= 0:
+                    raise Exception("远程shell会话已关闭")
+                del self._outgoing[:sent]
+                self.last_activity = time.time()
+        except Exception as e:
+            self.close(e)
+            return
+        if self._outgoing and not self._flush_scheduled:
+            # channel没有可写事件的描述符，短暂间隔后重试
+            self._flush_scheduled = True
+            self.loop.call_later(0.005, self._flush)
+    
+    def _on_readable(self):
+        """事件循环回调：读取已到达的数据并完成对应的命令"""
+        try:
+            while self.channel.recv_ready():
+                self._stdout_buffer += self.channel.recv(65536)
+                self.last_activity = time.time()
+            while self.channel.recv_stderr_ready():
+                self._stderr_buffer += self.channel.recv_stderr(65536)
+                self.last_activity = time.time()
+        except Exception as e:
+            self.close(e)
+            return
+        
+        self._parse()
+        if self.channel.closed or self.channel.eof_received or self.channel.exit_status_ready():
+            self.close()
+    
+    def _parse(self):
+        """按顺序解析缓冲区中的分帧结果（逻辑与RemoteShellSession._read_result一致）"""
+        while self.pending:
+            entry = self.pending[0]
+            token = entry["token"]
+            if entry["stdout"] is None:
+                stdout_marker = b"\n" + token + b" "
+                index = self._stdout_buffer.find(stdout_marker)
+                line_end = self._stdout_buffer.find(b"\n", index + len(stdout_marker)) if index >= 0 else -1
+                if line_end >= 0:
+                    head = self._stdout_buffer[:index]
+                    entry["stdout"] = b"".join(entry["streamed"]) + head
+                    entry["exit_code"] = int(self._stdout_buffer[index + len(stdout_marker):line_end])
+                    self._stdout_buffer = self._stdout_buffer[line_end + 1:]
+                    if entry["on_output"] and head:
+                        self._notify(entry, head)
+                elif index < 0 and entry["on_output"]:
+                    # 最后一个\n之后可能是不完整的标记，只回调它之前的部分
+                    safe_end = max(self._stdout_buffer.rfind(b"\r") + 1, self._stdout_buffer.rfind(b"\n"))
+                    if safe_end > 0:
+                        chunk = self._stdout_buffer[:safe_end]
+                        self._stdout_buffer = self._stdout_buffer[safe_end:]
+                        entry["streamed"].append(chunk)
+                        self._notify(entry, chunk)
+            if entry["stdout"] is None:
+                return
+            
+            stderr_marker = b"\n" + token + b"\n"
+            index = self._stderr_buffer.find(stderr_marker)
+            if index < 0:
+                return
+            stderr_data = self._stderr_buffer[:index]
+            self._stderr_buffer = self._stderr_buffer[index + len(stderr_marker):]
+            self.pending.popleft()
+            if not entry["future"].done():
+                entry["future"].set_result((
+                    entry["stdout"].decode('utf-8', errors='replace'),
+                    stderr_data.decode('utf-8', errors='replace'),
+                    entry["exit_code"]
+                ))
+    
+    def _notify(self, entry, data):
+        """调用流式输出回调，回调异常不影响会话"""
+        try:
+            entry["on_output"](data.decode('utf-8', errors='replace'))
+        except Exception as e:
+            print(f"输出回调异常: {e}")
+    
+    def close(self, error=None):
+        """关闭会话，所有在途命令以异常结束"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.loop.remove_reader(self.channel.fileno())
+        except Exception:
+            pass
+        try:
+            self.channel.close()
+        except Exception:
+            pass
+        while self.pending:
+            future = self.pending.popleft()["future"]
+            if not future.done():
+                future.set_exception(Exception(f"远程shell会话已关闭: {error}" if error else "远程shell会话已关闭"))
+
+class AsyncSSHJob:
+    """一次服务器端任务在事件循环中的执行上下文
+    
+    按需在连接池借出的连接上打开持久shell channel，命令分派到在途数最少的channel上
+    流水线执行；任务结束（包括取消和异常）时统一关闭本任务的channel并归还连接。
+    """
+    
+    def __init__(self, orchestrator, host, is_cancelled=None):
+        self.orchestrator = orchestrator
+        self.loop = orchestrator.loop
+        self.host = host
+        self.is_cancelled = is_cancelled or (lambda: False)
+        self.shells = []
+        self.connections = {}  # {PooledSSHConnection: 该连接上本任务打开的channel数}
+        self.broken_connections = set()
+        self.closed = False
+        self._opening = 0
+        self._connect_lock = asyncio.Lock()
+    
+    @property
+    def max_shells(self):
+        return self.orchestrator.max_connections * self.orchestrator.channels_per_connection
+    
+    async def execute(self, command, timeout=600, on_output=None, retry_count=2):
+        """执行单个命令（带重试机制），返回 (stdout, stderr, exit_code)
+        
+        timeout为channel上没有任何数据收发的最长时间（秒），持续输出的长时间命令不会超时。
+        """
+        for attempt in range(retry_count + 1):
+            shell = None
+            try:
+                shell = await self._get_shell()
+                started = time.time()
+                future = shell.submit(command, on_output)
+                result = await self._wait_active(shell, future, timeout)
+                if self.orchestrator.on_command:
+                    self.orchestrator.on_command(command, time.time() - started, result[0], result[1])
+                return result
+            except asyncio.TimeoutError:
+                # 先中止该channel上所有在途命令在服务器上的进程组（它们在独立进程组中，关闭channel
+                # 不会结束它们），调用方的重试或回退操作才不会与其同时写入同一批目标；
+                # 之后该channel的分帧状态不可信，直接关闭
+                if self.orchestrator.on_timeout:
+                    await self.to_thread(self.orchestrator.on_timeout,
+                                         [entry["command"] for entry in shell.pending], self.host)
+                self._drop_shell(shell)
+                raise RemoteCommandTimeout("远程shell命令执行超时")
+            except Exception as e:
+                if shell is not None:
+                    self._drop_shell(shell, broken=True)
+                # 任务取消时channel被中止，不再重试
+                if attempt < retry_count and self.orchestrator.is_connection_error(e) and not self.is_cancelled():
+                    print(f"SSH命令执行失败，{(attempt + 1) * 3}秒后重试: {e}")
+                    await asyncio.sleep((attempt + 1) * 3)
+                    continue
+                raise
+    
+    @staticmethod
+    async def _wait_active(shell, future, timeout):
+        """等待命令结果；channel超过timeout秒没有任何数据收发时抛出asyncio.TimeoutError"""
+        while True:
+            idle = time.time() - shell.last_activity
+            if idle >= timeout:
+                raise asyncio.TimeoutError()
+            # asyncio.wait超时不会取消future，命令结果仍按顺序解析
+            done, _ = await asyncio.wait({future}, timeout=timeout - idle)
+            if done:
+                return future.result()
+    
+    async def acquire(self, controller):
+        """获取自适应并发控制器的名额，不阻塞事件循环"""
+        delay = 0.002
+        while not controller.try_acquire():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    
+    async def to_thread(self, func, *args):
+        """在线程池中执行可能阻塞的函数（如限速等待）"""
+        return await self.loop.run_in_executor(None, func, *args)
+    
+    async def _get_shell(self):
+        """选择在途命令最少的channel，都在忙且未达上限时打开新的channel"""
+        while True:
+            if self.closed:
+                raise Exception("任务已结束")
+            self.shells = [shell for shell in self.shells if not shell.closed]
+            best = min(self.shells, key=lambda shell: len(shell.pending), default=None)
+            capacity_left = len(self.shells) + self._opening < self.max_shells
+            if best is not None and (not best.pending or not capacity_left):
+                return best
+            if capacity_left:
+                self._opening += 1
+                try:
+                    shell = await self._open_shell()
+                finally:
+                    self._opening -= 1
+                self.shells.append(shell)
+                return shell
+            # 其他协程正在打开channel，等待其完成
+            await asyncio.sleep(0.01)
+    
+    async def _open_shell(self):
+        """在有空余channel名额的连接上打开持久shell，必要时从连接池借出新连接"""
+        per_connection = self.orchestrator.channels_per_connection
+        async with self._connect_lock:
+            connection = next((c for c, count in self.connections.items()
+                               if count < per_connection and c not in self.broken_connections), None)
+            if connection is None:
+                connection = await self.loop.run_in_executor(None, self.orchestrator.pool.checkout, self.host)
+                self.connections[connection] = 0
+            self.connections[connection] += 1
+        
+        try:
+            channel = await self.loop.run_in_executor(None, self._open_channel, connection,
+                                                      self.orchestrator.shell_command())
+        except Exception:
+            self.connections[connection] -= 1
+            self.broken_connections.add(connection)
+            raise
+        if self.closed:
+            channel.close()
+            raise Exception("任务已结束")
+        return AsyncRemoteShell(self.loop, channel, connection)
+    
+    @staticmethod
+    def _open_channel(connection, shell_command):
+        channel = connection.client.get_transport().open_session()
+        channel.exec_command(shell_command)
+        channel.sendall(RemoteShellSession.STARTUP.encode('utf-8'))
+        return channel
+    
+    def _drop_shell(self, shell, broken=False):
+        """关闭出错的channel，并记录其所属连接的状态"""
+        if shell is None:
+            return
+        shell.close()
+        if shell in self.shells:
+            self.shells.remove(shell)
+            self.connections[shell.connection] -= 1
+        if broken and not shell.connection.is_active():
+            self.broken_connections.add(shell.connection)
+    
+    def close(self):
+        """关闭本任务的所有channel（远程shell随之收到SIGHUP）并归还连接"""
+        self.closed = True
+        for shell in self.shells:
+            shell.close()
+        self.shells = []
+        for connection in self.connections:
+            self.orchestrator.pool.checkin(connection, broken=connection in self.broken_connections)
+        self.connections = {}
+
+class AsyncSSHOrchestrator:
+    """基于asyncio的服务器端任务编排器
+    
+    后台线程运行一个事件循环，成百上千个远程操作以协程形式并发，在少量shell channel上
+    流水线执行，不再为每个在途操作占用一个线程。工作线程通过run()提交任务并等待结果，
+    界面更新仍由调用方经root.after交给Tk主循环。
+    """
+    
+    def __init__(self, pool, max_connections=2, channels_per_connection=6, is_connection_error=None,
+                 on_command=None, shell_command=None, on_timeout=None):
+        """
+        Args:
+            pool: SSHConnectionPool，任务期间借出连接，结束后归还
+            max_connections: 单个任务最多借出的连接数（给其他命令留出连接）
+            channels_per_connection: 每个连接上最多打开的shell channel数（受sshd MaxSessions限制）
+            is_connection_error: 判断异常是否可重试的函数
+            on_command: 命令完成回调 on_command(command, seconds, stdout, stderr)，用于统计
+            shell_command: 返回远程shell启动命令的函数，打开每个channel时调用
+            on_timeout: 命令超时回调 on_timeout(commands, host)，在关闭channel前中止
+                服务器上仍在运行的命令（在线程池中执行，可以阻塞）
+        """
+        self.pool = pool
+        self.max_connections = max(1, int(max_connections))
+        self.channels_per_connection = max(1, int(channels_per_connection))
+        self.is_connection_error = is_connection_error or (lambda error: False)
+        self.on_command = on_command
+        self.shell_command = shell_command or (lambda: "exec bash --noprofile --norc")
+        self.on_timeout = on_timeout
+        self.loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+    
+    def _ensure_loop(self):
+        """首次使用时启动事件循环线程"""
+        with self._start_lock:
+            if self.loop is None:
+                # Windows默认的Proactor循环不支持add_reader，统一使用Selector循环
+                self.loop = asyncio.SelectorEventLoop()
+                self._thread = threading.Thread(target=self._run_loop, args=(self.loop,), daemon=True)
+                self._thread.start()
+        return self.loop
+    
+    @staticmethod
+    def _run_loop(loop):
+        """事件循环线程：循环停止后关闭，释放selector和默认线程池"""
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+    
+    def run(self, host, job_func, is_cancelled=None):
+        """在事件循环中执行 job_func(job) 协程并阻塞等待结果（在工作线程中调用）
+        
+        Args:
+            host: 主机名
+            job_func: 接收AsyncSSHJob、返回协程的函数
+            is_cancelled: 返回是否已取消的函数，取消后任务协程被cancel并抛出异常
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._run_job(host, job_func, is_cancelled), loop).result()
+    
+    async def _run_job(self, host, job_func, is_cancelled):
+        job = AsyncSSHJob(self, host, is_cancelled)
+        task = self.loop.create_task(job_func(job))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=0.1)
+                if done:
+                    return task.result()
+                if is_cancelled and is_cancelled():
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+                    raise Exception("任务已取消")
+        finally:
+            job.close()
+    
+    def shutdown(self):
+        """停止并关闭事件循环"""
+        with self._start_lock:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                if self._thread is not threading.current_thread():
+                    self._thread.join(timeout=5)
+                self.loop = None
+                self._thread = None
+
 class ImageFileHandler(FileSystemEventHandler):
     """文件系统事件处理器，用于跟踪图片文件的打开"""
     
@@ -161,6 +1979,7 @@ class ImageManager:
         self.start_image = None
         self.end_image = None
         self.image_files = []
+        self.scan_index = {}  # 扫描索引 {图片路径: {"size": 字节数, "inode": inode号, "dev": 设备号}}
         self.current_opened_image = None
         self.observer = None
         self.is_detecting = False
@@ -181,25 +2000,155 @@ class ImageManager:
         self.current_task = None
         self.task_cancelled = False
         
+        # 取消任务时中止服务器上正在执行的命令
+        self.remote_job_id = uuid.uuid4().hex[:12]  # 本次任务的远程进程组标识（pid文件名的一部分）
+        self.active_channels = set()  # 正在执行命令的SSH channel，取消时直接关闭
+        self.active_channels_lock = threading.Lock()
+        self.remote_abort_done = threading.Event()  # 远程中止完成（进程组已退出）后置位
+        self.remote_abort_done.set()
+        
         # 模式相关变量
         self.operation_mode = tk.StringVar(value="windows")  # windows 或 server
         
         # SSH服务器配置
         self.ssh_config = {
             "host": "",
+            "port": 22,  # SSH端口（仅配置文件，默认22）
             "username": "",
             "password": "",
-            "share_path": "/data/share"  # 服务器上share目录的绝对路径
+            "share_path": "/data/share",  # 服务器上share目录的绝对路径
+            "smb_hosts": [],  # SMB路径中指向该服务器的其他主机名（如计算机名）；为空时所有未匹配其他服务器的 \\主机\share 路径都视为在主服务器上
+            # 其他存储服务器 {SSH主机: {"port", "username", "password", "share_path", "smb_hosts",
+            # "direct_address", "direct_user"}}，未填写的连接信息沿用上面的主服务器；
+            # 目标位于这些服务器的share下时，由源服务器直接推送，数据不经过客户端
+            "hosts": {}
         }
         self.ssh_client = None
         self.ssh_connection_time = None  # 连接建立时间
         self.ssh_last_activity = None    # 最后活动时间
         self.ssh_connection_timeout = 7200  # 连接超时时间（秒），增加到2小时
-        self.ssh_directory_cache = set()  # 已创建目录的缓存
-        self.ssh_connection_pool = {}  # SSH连接池
-        self.max_pool_size = 3  # 最大连接池大小
+        self.directory_cache_file = "server_directories.json"  # 已确认存在的远程目录缓存
+        self.directory_cache_ttl = 6 * 3600  # 目录缓存有效期（秒），过期后重新确认
+        self.ssh_directory_cache = None  # {主机: {目录: 确认时间}}，首次使用时从缓存文件加载
+        self.directory_cache_lock = threading.Lock()
         self.connection_reuse_count = 0  # 连接复用计数
         self.max_reuse_count = 1000  # 最大复用次数，超过后重建连接
+        self.ssh_lock = threading.RLock()  # 保护主连接状态
+        self.remote_agent_paths = {}  # 服务器辅助程序路径缓存 {主机: 路径或None}
+        self.capability_cache_file = "server_capabilities.json"  # 服务器能力探测结果缓存
+        self.capability_ttl = 24 * 3600  # 能力探测结果有效期（秒）
+        self.server_capabilities = None  # {主机: 能力字典}，首次使用时从缓存文件加载
+        self.capability_lock = threading.Lock()
+        self.ssh_use_persistent_shell = True  # 在每个池化连接的持久shell中执行命令
+        self.ssh_probe_idle_threshold = 60  # 空闲超过该秒数才主动探测连接
+        self.ssh_probe_timeout = 5  # 主动探测超时时间（秒）
+        self.max_pool_size = 4  # 每个主机的最大连接数
+        self.ssh_pool = SSHConnectionPool(
+            self._create_ssh_client,
+            max_per_host=self.max_pool_size,
+            max_lifetime=self.ssh_connection_timeout,
+            max_uses=self.max_reuse_count,
+            health_check=self._is_pooled_connection_alive
+        )  # SSH连接池，并行命令各自借出独立的transport
+        # 文本为主的流量（目录列表、扫描结果、标签配对）使用单独的压缩连接，图片数据走不压缩的连接池
+        self.ssh_text_pool = SSHConnectionPool(
+            lambda host: self._create_ssh_client(host, compress=True),
+            max_per_host=2,
+            max_lifetime=self.ssh_connection_timeout,
+            max_uses=self.max_reuse_count,
+            health_check=self._is_pooled_connection_alive
+        )
+        self.transport_profile_cache_file = "ssh_transport_profiles.json"  # 每个主机选定的传输配置档及基准测试结果
+        self.transport_profiles = None  # {主机: {"profile", "results", "measured_at"}}，首次使用时从缓存文件加载
+        self.transport_profile_lock = threading.Lock()
+        # 并发远程操作在事件循环中以协程执行，单个任务最多占用连接池的一半连接
+        self.async_orchestrator = AsyncSSHOrchestrator(
+            self.ssh_pool,
+            max_connections=max(1, self.max_pool_size // 2),
+            is_connection_error=self._is_connection_error,
+            on_command=lambda *args: self.ssh_stats.record_command(*args),
+            # 持久shell登记在本任务的远程进程组中，取消时连同已写入但未执行的命令一起中止
+            shell_command=lambda: self.cancellable_command("bash --noprofile --norc"),
+            # 命令超时后先中止其在服务器上的进程组，再关闭channel
+            on_timeout=self.abort_timed_out_commands
+        )
+        
+        # 传输相关配置
+        self.manifest_dir = "manifests"  # 传输清单目录
+        self.transfer_config = {
+            "hash_algorithm": "blake2b",  # 边复制边计算的校验算法: blake2b 或 crc32
+            "write_manifest": True,  # 是否为每个任务生成JSONL传输清单
+            "copy_buffer_size": 1024 * 1024,  # 复制缓冲区大小（字节）
+            "operation_order": "natural",  # 操作执行顺序: natural(自然排序) 或 inode(按磁盘位置，适合HDD)
+            "lane_workers": 2,  # 每个目标通道的默认（初始）并发数
+            "target_lane_workers": {},  # 按目标目录覆盖初始并发数 {目标路径: 并发数}
+            "rate_limits": {  # 限速配置，0表示不限速
+                "default": {"bytes_per_sec": 0, "ops_per_sec": 0},  # 未单独配置的目标使用
+                "targets": {},  # 按目标目录 {目标路径: {"bytes_per_sec": x, "ops_per_sec": y}}
+                "hosts": {}  # 按主机（SSH主机或SMB服务器） {主机: {...}}
+            },
+            "adaptive_concurrency": {  # AIMD自适应并发控制参数
+                "enabled": True,
+                "min": 1,
+                "max": 16,
+                "async_max": 256,  # 事件循环中并发执行的远程操作上限
+                "window_seconds": 2.0
+            },
+            "server_fanout": True,  # 服务器模式多目标时每个源文件只读取一次，其余目标从第一份副本派生
+            "fanout_hardlink_images": True,  # 同一文件系统内图片派生使用硬链接（标签可能被就地编辑，始终独立复制）
+            "transport_profile": {  # SSH加密算法和压缩选择
+                "mode": "auto",  # auto：首次连接主机时基准测试各配置档并缓存结果；也可指定aead、ctr-etm或default
+                "benchmark_bytes": 8 * 1024 * 1024,  # 基准测试每个配置档下载的数据量
+                "benchmark_seconds": 2.0,  # 每个配置档最长测量时间（秒）
+                "ttl": 7 * 24 * 3600,  # 基准测试结果有效期（秒）
+                "compress_text": True  # 文本为主的流量使用压缩连接（图片数据始终不压缩）
+            },
+            "rsync_shards": {  # 单个目标目录文件很多时拆成多个按字节数均衡的分片，并发执行rsync
+                "enabled": True,
+                "min_files_per_shard": 500,  # 每个分片至少的文件数，文件少时不拆分
+                "max_shards": 8  # 单个目录的分片数上限（同时不超过服务器CPU核数）
+            },
+            "tar_pipe": {  # 大量小文件打包为一个tar流顺序传输，省去逐文件的进程和往返开销
+                "enabled": True,
+                "min_files": 32,  # 服务器端：同一 源目录/目标目录 至少有这么多文件才整组打包
+                "max_avg_size": 256 * 1024,  # 服务器端：组内平均文件大小不超过该值（字节）才打包
+                "client_stream": True,  # 客户端执行的目标一端在服务器上时，经SSH通道传输tar流代替逐文件SMB读写
+                "stream_batch_files": 200  # 客户端tar流每批的图片数，各批在通道内并发
+            },
+            "direct_transfer": {  # 目标在ssh_config.hosts中的其他服务器上时，由源服务器直接推送到目标服务器
+                "enabled": True,
+                # 按顺序选用第一个可用的方式：rsync、ssh（tar流）需要源服务器能以密钥免密登录目标服务器；
+                # tcp经目标服务器上的临时端口传输tar流（两端需要python3，数据不加密，只用于可信内网）
+                "methods": ["rsync", "ssh", "tcp"],
+                "tcp_port": 0,  # tcp方式接收端监听的端口，0表示由系统分配
+                "connect_timeout": 60  # tcp方式接收端等待发送端连接的秒数
+            },
+            "download": {  # 把选中范围从服务器下载到本地目录（SFTP预读流水线）
+                "connections": 4,  # 并发下载使用的连接数（不超过连接池上限）
+                "block_size": 1024 * 1024,  # 每次写入本地文件的块大小（字节）
+                "window_size": 8 * 1024 * 1024,  # 每轮预读的数据量（字节），取消在两轮之间生效
+                "prefetch_requests": 64,  # 每个文件同时在途的SFTP读请求数（paramiko 3.3及以上支持限制）
+                "last_dir": ""  # 上次选择的本地目录
+            },
+            "routing": {  # 服务器模式下按 源/目标 估算耗时，选择服务器端或客户端执行
+                "enabled": True,
+                "smb_bytes_per_sec": 100 * 1024 * 1024,  # 客户端经SMB读写的估计带宽
+                "smb_file_overhead": 0.01,  # 客户端每个文件的SMB往返开销（秒）
+                "server_bytes_per_sec": 400 * 1024 * 1024,  # 服务器本地复制的估计带宽
+                "server_file_overhead": 0.001,  # 服务器端每个文件的开销（秒，辅助程序或rsync）
+                "server_script_file_overhead": 0.003,  # 只能用批量脚本时每个文件的开销（秒）
+                "server_round_trips": 8,  # 服务器端任务固定的命令往返次数
+                "default_rtt": 0.05,  # 无法测量SSH往返时间时使用的估计值（秒）
+                "direct_bytes_per_sec": 100 * 1024 * 1024  # 服务器之间直接传输的估计带宽
+            }
+        }
+        self.ssh_rtt = {}  # 测得的SSH命令往返时间 {主机: (秒, 测量时间)}
+        self.direct_transfer_methods = {}  # 主服务器向其他服务器直接传输的方式 {目标主机: (方式或None, 探测时间)}
+        self.direct_transfer_lock = threading.Lock()
+        self.ssh_stats = SSHOperationStats()  # 当前任务的SSH操作统计，每个服务器模式任务开始时重建
+        self.concurrency_controllers = {}  # 自适应并发控制器 {键: AdaptiveConcurrencyController}
+        self.rate_limiters = {}  # 限速器 {(类型, 名称): TransferRateLimiter}，同一目标/主机的所有线程共享
+        self.concurrency_lock = threading.Lock()
         
         # 加载配置
         self.load_config()
@@ -247,6 +2196,10 @@ class ImageManager:
                     ssh_config = config.get('ssh_config', {})
                     self.ssh_config.update(ssh_config)
                     
+                    # 加载传输配置
+                    transfer_config = config.get('transfer_config', {})
+                    self.transfer_config.update(transfer_config)
+                    
                     # 如果有旧格式的target_directories，转换为新格式
                     if self.target_directories and not self.scenarios:
                         self.scenarios = {}
@@ -289,7 +2242,8 @@ class ImageManager:
                 'target_directories': self.target_directories,  # 保持兼容性
                 'scenarios': self.scenarios,
                 'operation_mode': self.operation_mode.get(),
-                'ssh_config': self.ssh_config
+                'ssh_config': self.ssh_config,
+                'transfer_config': self.transfer_config
             }
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=2)
@@ -360,7 +2314,8 @@ class ImageManager:
                    "• Windows本地模式: 直接在本地文件系统进行操作\n" + \
                    "• SSH服务器模式: 通过SSH连接到远程服务器执行操作\n" + \
                    "• 服务器share目录: 服务器上共享目录的绝对路径\n" + \
-                   "• 例如: /data/share 对应 \\\\192.168.11.189\\share"
+                   "• 例如: /data/share 对应 \\\\192.168.11.189\\share\n" + \
+                   "• 其他存储服务器在config.json的ssh_config.hosts中配置，跨服务器的目标由源服务器直接推送"
         
         info_label = ttk.Label(ssh_frame, text=info_text, foreground="gray", font=("Arial", 8))
         info_label.grid(row=4, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
@@ -387,7 +2342,7 @@ class ImageManager:
                 # 创建SSH客户端测试连接
                 test_client = paramiko.SSHClient()
                 test_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                test_client.connect(hostname=host, username=username, password=password, timeout=10)
+                test_client.connect(hostname=host, port=int(self.ssh_config.get("port", 22) or 22), username=username, password=password, timeout=10)
                 test_client.close()
                 messagebox.showinfo("成功", "SSH连接测试成功！")
             except Exception as e:
@@ -418,7 +2373,7 @@ class ImageManager:
                 try:
                     test_client = paramiko.SSHClient()
                     test_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                    test_client.connect(hostname=host, username=username, password=password, timeout=10)
+                    test_client.connect(hostname=host, port=int(self.ssh_config.get("port", 22) or 22), username=username, password=password, timeout=10)
                     
                     # 测试共享路径是否存在
                     stdin, stdout, stderr = test_client.exec_command(f'test -d "{share_path}" && echo "exists" || echo "not_exists"')
@@ -458,13 +2413,8 @@ class ImageManager:
             # 先保存配置
             save_config_only()
             
-            # 关闭SSH连接（如果存在）
-            if self.ssh_client:
-                try:
-                    self.ssh_client.close()
-                except:
-                    pass
-                self.ssh_client = None
+            # 关闭SSH连接（如果存在），配置变更后重新建立
+            self.close_ssh_connection()
             
             mode_window.destroy()
         
@@ -478,6 +2428,55 @@ class ImageManager:
         for i in range(4):
             button_frame.columnconfigure(i, weight=1)
     
+    def get_host_config(self, host=None):
+        """获取某台服务器的连接配置
+        
+        Args:
+            host: SSH主机，默认为主服务器（ssh_config.host）
+        
+        Returns:
+            dict: 主服务器配置与ssh_config.hosts中该主机配置的合并结果（未填写的项沿用主服务器）
+        """
+        primary = self.ssh_config.get("host", "")
+        config = {key: value for key, value in self.ssh_config.items() if key != "hosts"}
+        if host and host != primary:
+            overrides = self.ssh_config.get("hosts", {}).get(host, {})
+            # 其他服务器的SMB主机名和share目录各自独立，不沿用主服务器
+            config.update(smb_hosts=[], share_path="/data/share")
+            config.update(overrides)
+            config["host"] = host
+        return config
+    
+    def host_for_path(self, path):
+        """路径位于哪台已配置服务器的share下
+        
+        主服务器没有配置smb_hosts时沿用原来的规则：未匹配到其他服务器的 \\\\主机\\share 路径
+        都视为主服务器上的路径（共享可能以机器名或其他IP访问）。
+        
+        Args:
+            path: SMB路径，如 \\\\192.168.11.190\\share\\数据
+        
+        Returns:
+            str: SSH主机（主服务器或ssh_config.hosts中的主机）；不在任何服务器上时返回None
+        """
+        path = str(path).replace('/', '\\')
+        if not path.startswith('\\\\'):
+            return None
+        parts = [part for part in path.split('\\') if part]
+        if len(parts) < 2 or parts[1].lower() != 'share':
+            return None
+        smb_host = parts[0].lower()
+        for host in [self.ssh_config.get("host", "")] + list(self.ssh_config.get("hosts", {})):
+            if not host:
+                continue
+            names = {host.lower()}
+            names.update(name.lower() for name in self.get_host_config(host).get("smb_hosts", []))
+            if smb_host in names:
+                return host
+        if self.ssh_config.get("host") and not self.ssh_config.get("smb_hosts"):
+            return self.ssh_config["host"]
+        return None
+    
     def convert_smb_to_linux_path(self, smb_path):
         """将SMB路径转换为Linux绝对路径
         
@@ -501,8 +2500,8 @@ class ImageManager:
             
         # 第一部分是IP地址，第二部分是share，从第三部分开始是实际路径
         if len(path_parts) >= 2 and path_parts[1] == 'share':
-            # 获取服务器share目录的绝对路径
-            server_share_path = self.ssh_config.get('share_path', '/data/share')
+            # 获取路径所在服务器share目录的绝对路径
+            server_share_path = self.get_host_config(self.host_for_path(smb_path)).get('share_path', '/data/share')
             
             # 构建Linux路径：服务器share路径 + 相对路径
             if len(path_parts) > 2:
@@ -556,8 +2555,216 @@ class ImageManager:
         else:
              return path  # Windows模式直接返回原路径
      
+    def _create_ssh_client(self, host=None, retry_count=3, compress=False, profile=None):
+        """建立一个新的SSH连接（带重试机制）
+        
+        Args:
+            host: 主机名，默认使用ssh_config中的主服务器（其他服务器的连接信息见get_host_config）
+            retry_count: 重试次数
+            compress: 是否启用zlib压缩（只用于文本为主的连接，图片已是压缩格式）
+            profile: 传输配置档名称，默认使用该主机选定的配置档（服务器不支持时退回default）
+            
+        Returns:
+            已连接的paramiko.SSHClient对象
+        """
+        if not PARAMIKO_AVAILABLE:
+            raise Exception("paramiko库未安装，无法使用SSH功能")
+        
+        host = host or self.ssh_config.get("host", "")
+        host_config = self.get_host_config(host)
+        profile_name = profile or self.get_transport_profile(host)
+        last_error = None
+        attempt = 0
+        while attempt < retry_count:
+            ssh_client = None
+            try:
+                ssh_client = paramiko.SSHClient()
+                ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                
+                username = host_config.get("username", "")
+                password = host_config.get("password", "")
+                
+                if not all([host, username, password]):
+                    raise Exception("SSH配置信息不完整")
+                
+                # 增加连接参数以提高稳定性
+                ssh_client.connect(
+                    hostname=host,
+                    port=int(host_config.get("port", 22) or 22),
+                    username=username,
+                    password=password,
+                    timeout=60,  # 增加连接超时
+                    banner_timeout=60,  # 增加banner超时
+                    auth_timeout=60,  # 增加认证超时
+                    look_for_keys=False,
+                    allow_agent=False,
+                    compress=compress,
+                    disabled_algorithms=self._transport_disabled_algorithms(profile_name),
+                    sock=None,
+                    gss_auth=False,
+                    gss_kex=False,
+                    gss_deleg_creds=True,
+                    gss_host=None
+                )
+                
+                # 设置TCP keepalive和socket选项以保持连接稳定
+                transport = ssh_client.get_transport()
+                if transport:
+                    # 设置更长的keepalive间隔，减少服务器压力
+                    transport.set_keepalive(120)  # 每2分钟发送keepalive
+                    
+                    # 设置socket选项
+                    sock = transport.sock
+                    if sock:
+                        import socket
+                        # 启用TCP keepalive
+                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                        # 设置keepalive参数（Windows）
+                        if hasattr(socket, 'TCP_KEEPIDLE'):
+                            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 120)
+                        if hasattr(socket, 'TCP_KEEPINTVL'):
+                            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30)
+                        if hasattr(socket, 'TCP_KEEPCNT'):
+                            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+                        # 设置接收缓冲区大小
+                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+                        # 设置发送缓冲区大小
+                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
+                        # 禁用Nagle算法以减少延迟
+                        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                
+                print(f"SSH连接建立成功，主机: {host}")
+                return ssh_client
+                
+            except Exception as e:
+                last_error = e
+                if ssh_client:
+                    try:
+                        ssh_client.close()
+                    except:
+                        pass
+                
+                if profile is None and profile_name != "default" and "no acceptable" in str(e).lower():
+                    # 服务器不再支持选定配置档的算法，立即改用默认协商，下次连接重新测试
+                    print(f"服务器不支持传输配置档 {profile_name}，改用default: {e}")
+                    profile_name = "default"
+                    self.forget_transport_profile(host)
+                    continue
+                
+                # 如果不是最后一次尝试，等待后重试
+                if attempt < retry_count - 1:
+                    wait_time = (attempt + 1) * 2  # 指数退避：2, 4, 6秒
+                    time.sleep(wait_time)
+                attempt += 1
+        
+        # 如果所有重试都失败，抛出最后的错误
+        raise Exception(f"SSH连接失败（重试{retry_count}次后）: {str(last_error)}")
+    
+    def _transport_disabled_algorithms(self, profile_name):
+        """传输配置档对应的paramiko disabled_algorithms参数（禁用配置档未列出的算法）"""
+        profile = SSH_TRANSPORT_PROFILES.get(profile_name) or {}
+        disabled = {}
+        for key, preferred_attr in (("ciphers", "_preferred_ciphers"), ("macs", "_preferred_macs")):
+            allowed = profile.get(key)
+            if allowed:
+                disabled[key] = [name for name in getattr(paramiko.Transport, preferred_attr, ()) if name not in allowed]
+        return disabled
+    
+    def get_transport_profile(self, host):
+        """获取主机使用的传输配置档（auto模式下首次连接时基准测试并缓存）
+        
+        Returns:
+            str: SSH_TRANSPORT_PROFILES中的名称
+        """
+        options = self.transfer_config.get("transport_profile", {})
+        mode = options.get("mode", "auto")
+        if mode != "auto":
+            return mode if mode in SSH_TRANSPORT_PROFILES else "default"
+        
+        # 持锁测试，同时建立的其他连接等待结果而不是各自重复测试
+        with self.transport_profile_lock:
+            if self.transport_profiles is None:
+                self.transport_profiles = {}
+                try:
+                    if os.path.exists(self.transport_profile_cache_file):
+                        with open(self.transport_profile_cache_file, 'r', encoding='utf-8') as f:
+                            self.transport_profiles = json.load(f)
+                except Exception as e:
+                    print(f"加载传输配置档缓存失败: {e}")
+            
+            cached = self.transport_profiles.get(host)
+            if (cached and cached.get("profile") in SSH_TRANSPORT_PROFILES and
+                    time.time() - cached.get("measured_at", 0) < options.get("ttl", 7 * 24 * 3600)):
+                return cached["profile"]
+            
+            result = self.benchmark_transport_profiles(host)
+            self.transport_profiles[host] = result
+            try:
+                with open(self.transport_profile_cache_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.transport_profiles, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                print(f"保存传输配置档缓存失败: {e}")
+            return result["profile"]
+    
+    def forget_transport_profile(self, host):
+        """清除主机的配置档选择，下次连接时重新测试"""
+        with self.transport_profile_lock:
+            if self.transport_profiles:
+                self.transport_profiles.pop(host, None)
+    
+    def benchmark_transport_profiles(self, host):
+        """依次用每个传输配置档连接主机，测量下载随机数据的吞吐量，选出最快的配置档
+        
+        随机数据不可压缩，测得的是加密、MAC和网络本身的开销；吞吐量相差不到5%时
+        优先选择SSH_TRANSPORT_PROFILES中靠前的配置档。
+        
+        Returns:
+            dict: {"profile": 选定的名称, "results": {名称: {"bytes_per_sec", "cipher"} 或 {"error"}}, "measured_at"}
+        """
+        options = self.transfer_config.get("transport_profile", {})
+        sample_bytes = int(options.get("benchmark_bytes", 8 * 1024 * 1024))
+        max_seconds = options.get("benchmark_seconds", 2.0)
+        
+        results = {}
+        for name in SSH_TRANSPORT_PROFILES:
+            client = None
+            try:
+                client = self._create_ssh_client(host, retry_count=1, profile=name)
+                transport = client.get_transport()
+                channel = transport.open_session()
+                channel.exec_command(f"head -c {sample_bytes} /dev/urandom")
+                # 从收到第一块数据开始计时，不计入命令启动的往返
+                received = len(channel.recv(65536))
+                started = time.time()
+                while received < sample_bytes and time.time() - started < max_seconds:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    received += len(data)
+                elapsed = max(time.time() - started, 1e-6)
+                channel.close()
+                results[name] = {"bytes_per_sec": received / elapsed, "cipher": transport.local_cipher}
+            except Exception as e:
+                results[name] = {"error": str(e)}
+            finally:
+                if client:
+                    client.close()
+        
+        rates = {name: result["bytes_per_sec"] for name, result in results.items() if "bytes_per_sec" in result}
+        best = "default"
+        if rates:
+            fastest = max(rates.values())
+            best = next(name for name in SSH_TRANSPORT_PROFILES if rates.get(name, 0) >= fastest * 0.95)
+        
+        summary = ", ".join(f"{name} {format_bytes(rate)}/s" for name, rate in rates.items())
+        self.add_operation_log(f"SSH传输配置档测试 {host}: {summary or '全部失败'}，选用 {best}")
+        return {"profile": best, "results": results, "measured_at": time.time()}
+    
     def get_ssh_client(self, retry_count=3):
-        """获取SSH客户端连接（支持持久连接和自动重连）
+        """获取主SSH客户端连接（支持持久连接和自动重连，线程安全）
+        
+        主连接用于连通性检查等串行场景；并行执行的命令应通过execute_ssh_command
+        使用连接池中的独立连接。
         
         Args:
             retry_count: 重试次数
@@ -568,165 +2775,297 @@ class ImageManager:
         if not PARAMIKO_AVAILABLE:
             raise Exception("paramiko库未安装，无法使用SSH功能")
         
-        current_time = time.time()
-        
-        # 检查现有连接是否有效
-        if self.ssh_client is not None:
-            # 检查连接是否超时
-            if (self.ssh_connection_time and 
-                current_time - self.ssh_connection_time > self.ssh_connection_timeout):
-                self.close_ssh_connection()
-            # 检查连接复用次数是否超限
-            elif self.connection_reuse_count >= self.max_reuse_count:
-                print(f"连接复用次数达到上限({self.max_reuse_count})，重建连接")
-                self.close_ssh_connection()
-            # 检查连接是否仍然活跃
-            elif not self._is_ssh_connection_alive():
-                self.close_ssh_connection()
-        
-        # 如果没有有效连接，创建新连接（带重试机制）
-        if self.ssh_client is None:
-            last_error = None
-            
-            for attempt in range(retry_count):
+        with self.ssh_lock:
+            current_time = time.time()
+            
+            # 检查现有连接是否有效
+            if self.ssh_client is not None:
+                # 检查连接是否超时
+                if (self.ssh_connection_time and 
+                    current_time - self.ssh_connection_time > self.ssh_connection_timeout):
+                    self._close_primary_ssh_client()
+                # 检查连接复用次数是否超限
+                elif self.connection_reuse_count >= self.max_reuse_count:
+                    print(f"连接复用次数达到上限({self.max_reuse_count})，重建连接")
+                    self._close_primary_ssh_client()
+                # 检查连接是否仍然活跃
+                elif not self._is_ssh_connection_alive():
+                    self._close_primary_ssh_client()
+            
+            # 如果没有有效连接，创建新连接（带重试机制）
+            if self.ssh_client is None:
+                self.ssh_client = self._create_ssh_client(retry_count=retry_count)
+                
+                # 记录连接时间
+                self.ssh_connection_time = current_time
+                self.ssh_last_activity = current_time
+                self.connection_reuse_count = 0  # 重置复用计数
+            
+            # 更新最后活动时间和复用计数
+            self.ssh_last_activity = current_time
+            self.connection_reuse_count += 1
+            return self.ssh_client
+    
+    def _is_connection_error(self, error):
+        """判断异常是否为连接相关的错误"""
+        error_str = str(error).lower()
+        connection_errors = [
+            'connection reset',
+            'connection closed',
+            'connection lost',
+            'broken pipe',
+            'socket is closed',
+            '远程主机强迫关闭',
+            'connection aborted',
+            'connection refused',
+            'ssh session not active',
+            '远程shell会话已关闭'
+        ]
+        return any(err in error_str for err in connection_errors)
+    
+    def cancellable_command(self, command):
+        """把长时间运行的远程命令包装为可中止的命令
+        
+        命令在新的进程组（setsid）中执行，组长进程号写入以任务标识命名的pid文件，
+        取消任务时abort_remote_commands按pid文件向整个进程组发送SIGTERM。
+        
+        Args:
+            command: 原始shell命令
+            
+        Returns:
+            str: 包装后的命令，退出码与原命令一致；任务已取消时返回直接失败的命令
+        """
+        if self.task_cancelled:
+            return "exit 130"
+        # 文件名中的随机部分用于超时后单独中止这条命令（abort_timed_out_commands）
+        pid_file = f"/tmp/image_manager_{self.remote_job_id}_{uuid.uuid4().hex[:8]}_$$.pid"
+        # 被信号终止时不删除pid文件，由中止命令确认进程组退出后再删除
+        inner = f"echo $$ > {pid_file}; {command}\nrc=$?; rm -f {pid_file}; exit $rc"
+        quoted = shlex.quote(inner)
+        return (f"if command -v setsid >/dev/null 2>&1; then setsid bash -c {quoted}; "
+                f"else bash -c {quoted}; fi")
+    
+    def register_active_channel(self, channel):
+        """登记正在执行命令的channel，任务取消时会被直接关闭"""
+        with self.active_channels_lock:
+            self.active_channels.add(channel)
+    
+    def unregister_active_channel(self, channel):
+        """命令结束后注销channel"""
+        with self.active_channels_lock:
+            self.active_channels.discard(channel)
+    
+    def cancel_current_task(self):
+        """取消当前任务：设置取消标志，并在后台中止服务器上正在执行的命令
+        
+        由进度对话框的取消按钮调用，立即返回，不阻塞界面。
+        """
+        self.task_cancelled = True
+        if self.operation_mode.get() == "server" and self.remote_abort_done.is_set():
+            self.remote_abort_done.clear()
+            threading.Thread(target=self.abort_remote_commands, daemon=True).start()
+    
+    def abort_remote_commands(self):
+        """中止本任务在服务器上正在执行的命令
+        
+        先关闭所有正在执行命令的channel，让等待结果的工作线程立即返回；再向本任务
+        登记的远程进程组发送SIGTERM（批量脚本、事务脚本中的trap据此清理半成品或回滚），
+        等待进程组全部退出后置位remote_abort_done，之后的回滚命令不会与被中止的命令交错。
+        中止命令在已有transport上新开channel执行，不必等待连接池归还或新建连接；
+        命令分布在多台服务器上时每台服务器各执行一次。
+        """
+        try:
+            with self.active_channels_lock:
+                channels = list(self.active_channels)
+                self.active_channels.clear()
+            transports = []
+            for channel in channels:
+                transports.append(channel.get_transport())
                 try:
-                    self.ssh_client = paramiko.SSHClient()
-                    self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                    
-                    host = self.ssh_config.get("host", "")
-                    username = self.ssh_config.get("username", "")
-                    password = self.ssh_config.get("password", "")
-                    
-                    if not all([host, username, password]):
-                        raise Exception("SSH配置信息不完整")
-                    
-                    # 增加连接参数以提高稳定性
-                    self.ssh_client.connect(
-                        hostname=host,
-                        username=username,
-                        password=password,
-                        timeout=60,  # 增加连接超时
-                        banner_timeout=60,  # 增加banner超时
-                        auth_timeout=60,  # 增加认证超时
-                        look_for_keys=False,
-                        allow_agent=False,
-                        compress=True,  # 启用压缩减少网络负载
-                        sock=None,
-                        gss_auth=False,
-                        gss_kex=False,
-                        gss_deleg_creds=True,
-                        gss_host=None
-                    )
-                    
-                    # 设置TCP keepalive和socket选项以保持连接稳定
-                    transport = self.ssh_client.get_transport()
-                    if transport:
-                        # 设置更长的keepalive间隔，减少服务器压力
-                        transport.set_keepalive(120)  # 每2分钟发送keepalive
-                        
-                        # 设置socket选项
-                        sock = transport.sock
-                        if sock:
-                            import socket
-                            # 启用TCP keepalive
-                            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                            # 设置keepalive参数（Windows）
-                            if hasattr(socket, 'TCP_KEEPIDLE'):
-                                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 120)
-                            if hasattr(socket, 'TCP_KEEPINTVL'):
-                                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30)
-                            if hasattr(socket, 'TCP_KEEPCNT'):
-                                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
-                            # 设置接收缓冲区大小
-                            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
-                            # 设置发送缓冲区大小
-                            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
-                            # 禁用Nagle算法以减少延迟
-                            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                    
-                    # 记录连接时间
-                    self.ssh_connection_time = current_time
-                    self.ssh_last_activity = current_time
-                    self.connection_reuse_count = 0  # 重置复用计数
-                    
-                    print(f"SSH连接建立成功，主机: {host}")
-                    
-                    # 连接成功，跳出重试循环
-                    break
-                    
+                    channel.close()
+                except Exception:
+                    pass
+            if self.ssh_client:
+                transports.append(self.ssh_client.get_transport())
+            # 任务可能同时在多台服务器上执行命令（服务器之间直接传输），每台服务器取一个transport
+            host_transports = {}
+            for transport in transports:
+                if transport is not None and transport.is_active():
+                    host_transports.setdefault(transport.getpeername(), transport)
+            
+            abort_cmd = self.remote_abort_command(f"/tmp/image_manager_{self.remote_job_id}_*.pid")
+            if not host_transports:
+                self.execute_ssh_command(abort_cmd, retry_count=1)
+                return
+            
+            def abort_on(transport):
+                try:
+                    started = time.time()
+                    channel = transport.open_session(timeout=10)
+                    channel.exec_command(abort_cmd)
+                    channel.recv_exit_status()
+                    channel.close()
+                    self.ssh_stats.record_command(abort_cmd, time.time() - started, round_trips=2)
                 except Exception as e:
-                    last_error = e
-                    if self.ssh_client:
-                        try:
-                            self.ssh_client.close()
-                        except:
-                            pass
-                        self.ssh_client = None
-                        self.ssh_connection_time = None
-                        self.ssh_last_activity = None
-                    
-                    # 如果不是最后一次尝试，等待后重试
-                    if attempt < retry_count - 1:
-                        wait_time = (attempt + 1) * 2  # 指数退避：2, 4, 6秒
-                        time.sleep(wait_time)
-                    
-            # 如果所有重试都失败，抛出最后的错误
-            if self.ssh_client is None and last_error:
-                raise Exception(f"SSH连接失败（重试{retry_count}次后）: {str(last_error)}")
-        
-        # 更新最后活动时间和复用计数
-        self.ssh_last_activity = current_time
-        self.connection_reuse_count += 1
-        return self.ssh_client
+                    print(f"中止远程命令失败: {e}")
+            
+            # 各服务器并行中止，全部确认后才置位remote_abort_done
+            threads = [threading.Thread(target=abort_on, args=(transport,), daemon=True)
+                       for transport in host_transports.values()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        except Exception as e:
+            print(f"中止远程命令失败: {e}")
+        finally:
+            self.remote_abort_done.set()
+    
+    @staticmethod
+    def remote_abort_command(pid_files):
+        """向pid文件登记的进程组发送SIGTERM并等待其退出的远程命令
+        
+        Args:
+            pid_files: 以空格分隔的pid文件路径或通配符
+        """
+        # 进程组中还有非僵尸进程即视为未退出（僵尸进程可能要等init回收）；没有setsid时检查进程本身
+        group_alive = ('{ ps -eo pgid=,stat= 2>/dev/null | '
+                       'awk -v g="$p" \'$1 == g && $2 !~ /^Z/ {f = 1} END {exit !f}\'; } || '
+                       '{ ! kill -0 -- "-$p" 2>/dev/null && kill -0 "$p" 2>/dev/null; }')
+        # 每个进程组只发送一次SIGTERM，避免打断trap中的回滚；至少观察0.3秒，
+        # 中止前已发出但尚未写入pid文件的命令也能被中止；最多等待10秒
+        return (
+            f'killed=" "; for i in $(seq 100); do alive=0; '
+            f'for f in {pid_files}; do [ -f "$f" ] || continue; p=$(cat "$f"); '
+            f'if {group_alive}; then alive=1; case "$killed" in *" $p "*) ;; '
+            f'*) kill -TERM -- "-$p" 2>/dev/null || kill -TERM "$p" 2>/dev/null; killed="$killed$p ";; esac; '
+            f'else rm -f "$f"; fi; done; '
+            f'[ $alive -eq 0 ] && [ $i -ge 3 ] && break; sleep 0.1; done'
+        )
+    
+    def abort_timed_out_commands(self, commands, host=None):
+        """中止超时命令在服务器上启动的进程组
+        
+        客户端超时后放弃等待，但经cancellable_command启动的命令在独立进程组中继续运行；
+        按命令中的pid文件中止这些进程组并等待其退出，之后的重试或回退操作不会与其同时
+        写入同一批目标。
+        
+        Args:
+            commands: 超时的命令列表
+            host: 执行命令的主机，默认为主服务器
+        """
+        pid_files = sorted({path.replace("$$", "*") for command in commands
+                            for path in re.findall(r"/tmp/image_manager_\w+_\$\$\.pid", command)})
+        if not pid_files:
+            return
+        try:
+            self.execute_ssh_command(self.remote_abort_command(" ".join(pid_files)), retry_count=1, host=host)
+        except Exception as e:
+            print(f"中止超时命令失败: {e}")
+    
+    def wait_remote_abort(self, timeout=15):
+        """等待远程中止完成（未取消时立即返回），回滚前调用"""
+        return self.remote_abort_done.wait(timeout)
      
-    def execute_ssh_command(self, command, retry_count=2):
+    def get_ssh_pool(self, compressed=False):
+        """文本为主的操作使用压缩连接池（可在transport_profile.compress_text中关闭），其余使用普通连接池"""
+        if compressed and self.transfer_config.get("transport_profile", {}).get("compress_text", True):
+            return self.ssh_text_pool
+        return self.ssh_pool
+    
+    def execute_ssh_command(self, command, retry_count=2, on_output=None, compressed=False, host=None):
          """执行SSH命令（带重试机制）
          
+         命令在连接池借出的独立连接上执行，多个线程可以真正并行执行命令。
+         
          Args:
              command: 要执行的命令
              retry_count: 重试次数
+             on_output: 可选的stdout流式回调 on_output(text)，用于长时间命令的实时进度
+             compressed: 输出以文本为主且较大（如文件列表）时使用压缩连接
+             host: 执行命令的主机，默认为主服务器
              
          Returns:
              tuple: (stdout, stderr, exit_code)
          """
          last_error = None
+         host = host or self.ssh_config.get("host", "")
+         pool = self.get_ssh_pool(compressed)
          
          for attempt in range(retry_count + 1):
+             connection = None
+             channel = None
+             started = time.time()
              try:
-                 ssh_client = self.get_ssh_client()
-                 
-                 # 设置更长的命令超时时间，适应大批量操作
-                 stdin, stdout, stderr = ssh_client.exec_command(command, timeout=600)
+                 connection = pool.checkout(host)
                  
-                 # 等待命令执行完成
-                 exit_code = stdout.channel.recv_exit_status()
-                 
-                 stdout_text = stdout.read().decode('utf-8')
-                 stderr_text = stderr.read().decode('utf-8')
+                 if self.ssh_use_persistent_shell:
+                     # 在连接的持久shell会话中执行，省去channel打开和远程shell启动
+                     try:
+                         session = connection.get_shell_session()
+                         channel = session.channel
+                         self.register_active_channel(channel)
+                         result = session.run(command, timeout=600, on_output=on_output)
+                     except Exception as e:
+                         if isinstance(e, RemoteCommandTimeout):
+                             # 先中止服务器上仍在运行的命令，再放弃会话
+                             self.abort_timed_out_commands([command], host)
+                         # 超时或异常后会话分帧状态不可信，丢弃会话
+                         connection.reset_shell_session()
+                         raise
+                 else:
+                     # 设置更长的命令超时时间，适应大批量操作
+                     stdin, stdout, stderr = connection.client.exec_command(command, timeout=600)
+                     channel = stdout.channel
+                     self.register_active_channel(channel)
+                     
+                     if on_output:
+                         # 边读边回调，stderr也同时读取，避免窗口填满阻塞远程进程
+                         stdout_chunks, stderr_chunks = [], []
+                         while not (channel.exit_status_ready() and not channel.recv_ready()
+                                    and not channel.recv_stderr_ready()):
+                             if channel.recv_ready():
+                                 chunk = channel.recv(65536)
+                                 stdout_chunks.append(chunk)
+                                 on_output(chunk.decode('utf-8', errors='replace'))
+                             elif channel.recv_stderr_ready():
+                                 stderr_chunks.append(channel.recv_stderr(65536))
+                             else:
+                                 time.sleep(0.01)
+                         exit_code = channel.recv_exit_status()
+                         result = (b"".join(stdout_chunks).decode('utf-8', errors='replace'),
+                                   b"".join(stderr_chunks).decode('utf-8', errors='replace'), exit_code)
+                     else:
+                         # 等待命令执行完成
+                         exit_code = stdout.channel.recv_exit_status()
+                         
+                         result = (stdout.read().decode('utf-8'), stderr.read().decode('utf-8'), exit_code)
                  
-                 return stdout_text, stderr_text, exit_code
+                 if result[2] == -1 and channel.closed:
+                     # channel被取消操作关闭时，exec方式会以-1退出码返回已读到的部分输出
+                     raise Exception("SSH channel已关闭")
+                 self.unregister_active_channel(channel)
+                 pool.checkin(connection)
+                 # 持久shell中一个命令一次往返；exec方式还需打开channel
+                 self.ssh_stats.record_command(command, time.time() - started, result[0], result[1],
+                                               round_trips=1 if self.ssh_use_persistent_shell else 2)
+                 return result
                  
              except Exception as e:
                  last_error = e
-                 error_str = str(e).lower()
-                 
-                 # 检查是否是连接相关的错误
-                 connection_errors = [
-                     'connection reset',
-                     'connection closed',
-                     'connection lost',
-                     'broken pipe',
-                     'socket is closed',
-                     '远程主机强迫关闭',
-                     'connection aborted',
-                     'connection refused'
-                 ]
-                 
-                 is_connection_error = any(err in error_str for err in connection_errors)
+                 self.ssh_stats.record_command(command, time.time() - started, failed=True)
+                 if channel is not None:
+                     self.unregister_active_channel(channel)
+                 # 任务取消时channel被主动关闭，连接本身仍可用，也不再重试
+                 aborted = self.task_cancelled and channel is not None and channel.closed
+                 is_connection_error = self._is_connection_error(e)
+                 if connection:
+                     pool.checkin(connection, broken=is_connection_error and not aborted)
                  
+                 if aborted:
+                     raise Exception("任务已取消")
                  if is_connection_error and attempt < retry_count:
-                     # 连接错误，关闭当前连接并重试
-                     self.close_ssh_connection()
+                     # 连接错误，等待后换一个连接重试
                      wait_time = (attempt + 1) * 3  # 指数退避：3, 6秒
                      time.sleep(wait_time)
                      continue
@@ -737,6 +3076,185 @@ class ImageManager:
          # 抛出最后的错误
          raise Exception(f"SSH命令执行失败（重试{retry_count}次后）: {str(last_error)}")
      
+    def execute_ssh_commands(self, commands, retry_count=2, compressed=False):
+        """流水线执行多个SSH命令（同一持久shell会话内依次执行）
+        
+        所有命令一次性写入会话，结果按顺序返回，适合大量mkdir、test、mv等小命令。
+        
+        Args:
+            commands: 命令列表
+            retry_count: 连接错误时的重试次数
+            compressed: 是否使用压缩连接（命令和输出以文本为主且总量较大时）
+            
+        Returns:
+            list: [(stdout, stderr, exit_code), ...]
+        """
+        if not commands:
+            return []
+        if not self.ssh_use_persistent_shell:
+            return [self.execute_ssh_command(command, retry_count, compressed=compressed) for command in commands]
+        
+        last_error = None
+        host = self.ssh_config.get("host", "")
+        pool = self.get_ssh_pool(compressed)
+        
+        categories = {SSHOperationStats.classify(command) for command in commands}
+        category = categories.pop() if len(categories) == 1 else "batch"
+        bytes_sent = sum(len(command.encode('utf-8')) for command in commands)
+        
+        for attempt in range(retry_count + 1):
+            connection = None
+            channel = None
+            started = time.time()
+            try:
+                connection = pool.checkout(host)
+                try:
+                    session = connection.get_shell_session()
+                    channel = session.channel
+                    self.register_active_channel(channel)
+                    results = session.run_many(commands, timeout=600)
+                except Exception as e:
+                    if isinstance(e, RemoteCommandTimeout):
+                        self.abort_timed_out_commands(commands, host)
+                    connection.reset_shell_session()
+                    raise
+                finally:
+                    if channel is not None:
+                        self.unregister_active_channel(channel)
+                pool.checkin(connection)
+                # 所有命令一次写入，整批只有一次往返
+                bytes_received = sum(len(stdout.encode('utf-8')) + len(stderr.encode('utf-8'))
+                                     for stdout, stderr, exit_code in results)
+                self.ssh_stats.record(category, time.time() - started, bytes_sent, bytes_received,
+                                      round_trips=1, commands=len(commands))
+                return results
+            except Exception as e:
+                last_error = e
+                self.ssh_stats.record(category, time.time() - started, failed=True)
+                aborted = self.task_cancelled and channel is not None and channel.closed
+                is_connection_error = self._is_connection_error(e)
+                if connection:
+                    pool.checkin(connection, broken=is_connection_error and not aborted)
+                if aborted:
+                    raise Exception("任务已取消")
+                if is_connection_error and attempt < retry_count:
+                    time.sleep((attempt + 1) * 3)
+                    continue
+                break
+        
+        raise Exception(f"SSH批量命令执行失败（重试{retry_count}次后）: {str(last_error)}")
+    
+    def run_sftp(self, func, retry_count=2, category="sftp", round_trips=1, bytes_sent=0, compressed=False):
+        """在连接池连接的持久SFTP会话上执行操作（带重试机制）
+        
+        SFTP会话随连接长期保留，多次上传、列目录只需一次会话建立。
+        
+        Args:
+            func: 操作函数 func(sftp) -> 结果
+            retry_count: 连接错误时的重试次数
+            category: 统计类别（upload、probe等）
+            round_trips: 该操作的预计往返次数，用于SSH统计
+            bytes_sent: 上传的字节数，用于SSH统计
+            compressed: 是否使用压缩连接（目录列表等文本为主的操作）
+            
+        Returns:
+            func的返回值
+        """
+        last_error = None
+        host = self.ssh_config.get("host", "")
+        pool = self.get_ssh_pool(compressed)
+        
+        for attempt in range(retry_count + 1):
+            connection = None
+            started = time.time()
+            try:
+                connection = pool.checkout(host)
+                try:
+                    result = func(connection.get_sftp())
+                except Exception:
+                    # 出错后会话中可能残留未完成的请求，丢弃会话
+                    connection.reset_sftp()
+                    raise
+                pool.checkin(connection)
+                self.ssh_stats.record(category, time.time() - started, bytes_sent, round_trips=round_trips)
+                return result
+            except Exception as e:
+                last_error = e
+                self.ssh_stats.record(category, time.time() - started, failed=True)
+                is_connection_error = self._is_connection_error(e)
+                if connection:
+                    pool.checkin(connection, broken=is_connection_error)
+                if is_connection_error and attempt < retry_count:
+                    time.sleep((attempt + 1) * 3)
+                    continue
+                break
+        
+        raise Exception(f"SFTP操作失败（重试{retry_count}次后）: {str(last_error)}")
+    
+    def upload_remote_files(self, files, mode=None, atomic=False):
+        """通过持久SFTP会话上传多个小文件（脚本、文件列表等）
+        
+        写入使用流水线模式，不逐块等待服务器确认；需要执行权限时直接通过
+        SFTP设置，省去单独的chmod命令。
+        
+        Args:
+            files: {远程路径: 文本内容}
+            mode: 可选的文件权限，如0o755
+            atomic: 是否先写临时文件再重命名，避免其他进程读到不完整的文件
+        """
+        total_bytes = sum(len(content.encode('utf-8')) for content in files.values())
+        self.throttle(self.get_rate_limiters(host=self.ssh_config.get("host", "")),
+                      nbytes=total_bytes, ops=len(files))
+        
+        def upload(sftp):
+            for remote_path, content in files.items():
+                write_path = f"{remote_path}.{uuid.uuid4().hex[:8]}.tmp" if atomic else remote_path
+                with sftp.open(write_path, 'w') as f:
+                    f.set_pipelined(True)
+                    f.write(content.encode('utf-8'))
+                if mode is not None:
+                    sftp.chmod(write_path, mode)
+                if atomic:
+                    sftp.posix_rename(write_path, remote_path)
+        
+        # 每个文件打开、关闭各一次往返（写入流水线化），设置权限和重命名各再加一次
+        round_trips = len(files) * (2 + (mode is not None) + bool(atomic))
+        self.run_sftp(upload, category="upload", round_trips=round_trips, bytes_sent=total_bytes)
+    
+    def _is_transport_alive(self, transport, last_activity):
+        """低开销的连接存活检查
+        
+        优先依据transport状态和最后一次成功活动时间判断，只有空闲超过阈值时
+        才发送一次keepalive全局请求（不打开channel、不启动远程进程）。
+        
+        Args:
+            transport: paramiko Transport对象
+            last_activity: 最后一次成功活动的时间戳
+            
+        Returns:
+            bool: 连接是否存活
+        """
+        if transport is None or not transport.is_active():
+            return False
+        
+        if last_activity and time.time() - last_activity < self.ssh_probe_idle_threshold:
+            return True
+        
+        # 空闲过久：发送keepalive请求并等待回复，带超时避免半开连接阻塞
+        result = {"alive": False}
+        
+        def probe():
+            try:
+                transport.global_request("keepalive@openssh.com", wait=True)
+                result["alive"] = transport.is_active()
+            except Exception:
+                result["alive"] = False
+        
+        probe_thread = threading.Thread(target=probe, daemon=True)
+        probe_thread.start()
+        probe_thread.join(self.ssh_probe_timeout)
+        return result["alive"] and not probe_thread.is_alive()
+    
     def _is_ssh_connection_alive(self):
         """检查SSH连接是否仍然活跃
         
@@ -747,32 +3265,38 @@ class ImageManager:
             return False
         
         try:
-            # 发送一个简单的命令来测试连接
-            transport = self.ssh_client.get_transport()
-            if transport is None or not transport.is_active():
-                return False
-            
-            # 执行一个轻量级命令
-            stdin, stdout, stderr = self.ssh_client.exec_command('echo test', timeout=5)
-            result = stdout.read().decode('utf-8').strip()
-            return result == 'test'
+            return self._is_transport_alive(self.ssh_client.get_transport(), self.ssh_last_activity)
         except:
             return False
     
+    def _is_pooled_connection_alive(self, connection):
+        """连接池健康检查：基于连接最后一次成功使用的时间"""
+        try:
+            return self._is_transport_alive(connection.client.get_transport(), connection.last_used)
+        except Exception:
+            return False
+    
+    def _close_primary_ssh_client(self):
+        """关闭主SSH连接"""
+        with self.ssh_lock:
+            if self.ssh_client:
+                try:
+                    print(f"关闭SSH连接，复用次数: {self.connection_reuse_count}")
+                    self.ssh_client.close()
+                except:
+                    pass
+                self.ssh_client = None
+                self.ssh_connection_time = None
+                self.ssh_last_activity = None
+                self.connection_reuse_count = 0  # 重置复用计数
+    
     def close_ssh_connection(self):
-        """关闭SSH连接并清理相关状态"""
+        """关闭SSH连接（主连接和连接池中的空闲连接）并清理相关状态"""
+        self.ssh_pool.close_all()
+        self.ssh_text_pool.close_all()
         if self.ssh_client:
-            try:
-                print(f"关闭SSH连接，复用次数: {self.connection_reuse_count}")
-                self.ssh_client.close()
-            except:
-                pass
-            self.ssh_client = None
-            self.ssh_connection_time = None
-            self.ssh_last_activity = None
-            self.connection_reuse_count = 0  # 重置复用计数
-            # 清理目录缓存（连接断开后重新建立时需要重新检查）
-            self.ssh_directory_cache.clear()
+            # 目录缓存按主机持久化并有有效期，断开连接不影响其有效性，不再清空
+            self._close_primary_ssh_client()
      
     def test_ssh_path_access(self, path):
          """测试SSH路径访问
@@ -790,42 +3314,96 @@ class ImageManager:
          except:
              return False
      
-    def create_ssh_directory(self, path):
-        """通过SSH创建目录（带缓存优化）
+    def _get_directory_cache(self):
+        """当前主机的已知目录缓存 {目录: 确认时间}（调用方持有directory_cache_lock）"""
+        if self.ssh_directory_cache is None:
+            self.ssh_directory_cache = {}
+            try:
+                if os.path.exists(self.directory_cache_file):
+                    with open(self.directory_cache_file, 'r', encoding='utf-8') as f:
+                        self.ssh_directory_cache = json.load(f)
+            except Exception as e:
+                print(f"加载远程目录缓存失败: {e}")
+        return self.ssh_directory_cache.setdefault(self.ssh_config.get("host", ""), {})
+    
+    def _save_directory_cache(self):
+        """保存目录缓存，顺带清除过期条目（调用方持有directory_cache_lock）"""
+        now = time.time()
+        for host, directories in self.ssh_directory_cache.items():
+            self.ssh_directory_cache[host] = {
+                path: verified_at for path, verified_at in directories.items()
+                if now - verified_at < self.directory_cache_ttl
+            }
+        try:
+            with open(self.directory_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(self.ssh_directory_cache, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"保存远程目录缓存失败: {e}")
+    
+    def forget_remote_directories(self, paths=None):
+        """从缓存中移除目录（例如发现目录已被外部删除时），paths为None时清空当前主机的缓存"""
+        with self.directory_cache_lock:
+            cache = self._get_directory_cache()
+            if paths is None:
+                cache.clear()
+            else:
+                for path in paths:
+                    cache.pop(path, None)
+            self._save_directory_cache()
+    
+    def ensure_remote_directories(self, paths):
+        """确保多个远程目录存在，缓存中未过期的目录直接跳过
+        
+        所有缺失的目录用一条命令创建：目录列表以NUL分隔写入上传的列表文件，
+        作为参数文件交给 xargs -0 mkdir -p，不受命令行长度限制，整批只需一次命令往返。
         
         Args:
-            path: 要创建的目录路径
+            paths: 远程目录路径列表
             
         Returns:
-            bool: 是否创建成功
+            list: 创建失败的目录（全部成功时为空列表）
         """
-        # 检查缓存，如果已经创建过则直接返回成功
-        if path in self.ssh_directory_cache:
-            return True
+        now = time.time()
+        with self.directory_cache_lock:
+            cache = self._get_directory_cache()
+            missing = sorted({path for path in paths
+                              if now - cache.get(path, 0) >= self.directory_cache_ttl})
+        if not missing:
+            return []
         
+        list_path = f"/tmp/image_manager_dirs_{uuid.uuid4().hex[:8]}.lst"
+        command = f"xargs -0 mkdir -p -- < {list_path}; rc=$?; rm -f {list_path}; exit $rc"
         try:
-            # 首先检查目录是否已存在
-            check_command = f"test -d '{path}' && echo 'exists' || echo 'not_exists'"
-            stdout, stderr, exit_code = self.execute_ssh_command(check_command)
-            
-            if exit_code == 0 and stdout.strip() == 'exists':
-                # 目录已存在，添加到缓存
-                self.ssh_directory_cache.add(path)
-                return True
-            
-            # 目录不存在，创建目录
-            create_command = f"mkdir -p '{path}'"
-            stdout, stderr, exit_code = self.execute_ssh_command(create_command)
-            
+            self.upload_remote_files({list_path: "".join(f"{path}\0" for path in missing)})
+            stdout, stderr, exit_code = self.execute_ssh_command(command)
             if exit_code == 0:
-                # 创建成功，添加到缓存
-                self.ssh_directory_cache.add(path)
-                return True
+                failed = []
             else:
-                return False
-                
+                # 少数目录失败时，一次流水线检查找出具体是哪些
+                checks = self.execute_ssh_commands([f"test -d {shlex.quote(path)}" for path in missing])
+                failed = [path for path, (_, _, code) in zip(missing, checks) if code != 0]
         except Exception as e:
-            return False
+            print(f"批量创建远程目录失败: {e}")
+            return missing
+        
+        with self.directory_cache_lock:
+            cache = self._get_directory_cache()
+            for path in missing:
+                if path not in failed:
+                    cache[path] = now
+            self._save_directory_cache()
+        return failed
+    
+    def create_ssh_directory(self, path):
+        """通过SSH创建目录（带持久缓存）
+        
+        Args:
+            path: 要创建的目录路径
+            
+        Returns:
+            bool: 是否创建成功
+        """
+        return not self.ensure_remote_directories([path])
      
     def open_target_config(self):
         """打开场景和子目录配置对话框"""
@@ -1265,7 +3843,8 @@ class ImageManager:
         
         # 复制和移动按钮
         ttk.Button(operation_btn_frame, text="复制图片", command=self.copy_images).pack(side=tk.LEFT, padx=(0, 5))
-        ttk.Button(operation_btn_frame, text="移动图片", command=self.move_images).pack(side=tk.LEFT)
+        ttk.Button(operation_btn_frame, text="移动图片", command=self.move_images).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(operation_btn_frame, text="下载到本地", command=self.download_images).pack(side=tk.LEFT)
         
         # 添加初始日志信息
         self.operation_status.config(state=tk.NORMAL)
@@ -1536,6 +4115,7 @@ class ImageManager:
         try:
             image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
             self.image_files = []
+            scan_index = {}
             
             # 检查数据集目录结构
             dataset_path = self.source_dir.get()
@@ -1576,30 +4156,28 @@ class ImageManager:
                 # 更新状态为正在扫描
                 self.root.after(0, lambda: self.status_label.config(text="正在扫描图片文件..."))
                 
-                # 扫描images目录中的图片文件 - 优化版本，减少输出
-                find_command = f"find '{server_images_path}' -maxdepth 1 -type f \\( -iname '*.jpg' -o -iname '*.jpeg' -o -iname '*.png' -o -iname '*.bmp' -o -iname '*.gif' -o -iname '*.tiff' -o -iname '*.webp' \\) | wc -l"
-                
-                # 先获取文件数量
-                stdout, stderr, exit_code = self.execute_ssh_command(find_command)
-                file_count = int(stdout.strip()) if stdout.strip().isdigit() else 0
+                # 优先使用服务器辅助程序扫描（一次请求返回文件名、大小、inode）
+                agent_scan = None
+                try:
+                    if self.ensure_remote_agent():
+                        agent_scan = self.run_remote_agent([{
+                            "op": "scan",
+                            "dir": server_images_path,
+                            "extensions": sorted(image_extensions)
+                        }], compressed=True)[0]
+                except Exception as e:
+                    print(f"辅助程序扫描失败，改用find: {e}")
                 
-                if file_count > 0:
-                    # 如果有文件，再获取文件列表
-                    find_command = f"find '{server_images_path}' -maxdepth 1 -type f \\( -iname '*.jpg' -o -iname '*.jpeg' -o -iname '*.png' -o -iname '*.bmp' -o -iname '*.gif' -o -iname '*.tiff' -o -iname '*.webp' \\) | sort"
-                    stdout, stderr, exit_code = self.execute_ssh_command(find_command)
-                    
-                    if exit_code == 0:
-                        server_files = stdout.strip().split('\n') if stdout.strip() else []
-                        
-                        # 批量转换路径，避免逐个日志输出
-                        for server_file in server_files:
-                            if server_file.strip():  # 跳过空行
-                                relative_path = server_file.replace(server_dataset_path, "").lstrip("/")
-                                local_file_path = os.path.join(dataset_path, relative_path).replace("/", "\\")
-                                self.image_files.append(local_file_path)
-                    else:
-                        self.add_operation_log(f"[服务器模式] 文件扫描失败: {stderr.strip()}")
+                if agent_scan and agent_scan.get("ok"):
+                    for entry in agent_scan["files"]:
+                        local_file_path = os.path.join(dataset_path, "images", entry["name"]).replace("/", "\\")
+                        self.image_files.append(local_file_path)
+                        scan_index[local_file_path] = {"size": entry["size"], "inode": entry["inode"], "dev": entry["dev"]}
+                    exit_code = 0
                 else:
+                    exit_code = self._scan_server_images_with_find(server_images_path, server_dataset_path, dataset_path, scan_index)
+                
+                if not self.image_files and exit_code == 0:
                     self.add_operation_log(f"[服务器模式] 未找到任何图片文件")
             else:
                 # 本地模式：使用原有逻辑
@@ -1614,13 +4192,21 @@ class ImageManager:
                 if not labels_path.exists():
                     self.root.after(0, lambda: self.status_label.config(text="警告: 数据集目录下未找到labels子目录"))
                 
-                # 扫描images目录中的图片文件
-                for file_path in images_path.iterdir():
-                    if file_path.is_file() and file_path.suffix.lower() in image_extensions:
-                        self.image_files.append(str(file_path))
+                # 扫描images目录中的图片文件，同时记录大小和inode用于扫描索引
+                with os.scandir(images_path) as entries:
+                    for entry in entries:
+                        if entry.is_file() and Path(entry.name).suffix.lower() in image_extensions:
+                            stat_result = entry.stat()
+                            self.image_files.append(entry.path)
+                            scan_index[entry.path] = {
+                                "size": stat_result.st_size,
+                                "inode": entry.inode(),  # Windows上scandir的stat不含inode
+                                "dev": stat_result.st_dev
+                            }
             
             # 按文件名排序
             self.image_files.sort(key=lambda x: self.natural_sort_key(os.path.basename(x)))
+            self.scan_index = scan_index
             
             # 更新界面
             self.root.after(0, self.update_image_list)
@@ -1642,12 +4228,71 @@ class ImageManager:
             error_msg = str(e)
             self.root.after(0, lambda: messagebox.showerror("错误", f"检测过程中出现错误: {error_msg}"))
     
+    def _scan_server_images_with_find(self, server_images_path, server_dataset_path, dataset_path, scan_index):
+        """使用find扫描服务器images目录（服务器没有python3时的后备方案）
+        
+        一次find调用同时输出inode、设备号和大小，结果写入self.image_files和scan_index。
+        
+        Returns:
+            int: find命令的退出码
+        """
+        find_command = f"find '{server_images_path}' -maxdepth 1 -type f \\( -iname '*.jpg' -o -iname '*.jpeg' -o -iname '*.png' -o -iname '*.bmp' -o -iname '*.gif' -o -iname '*.tiff' -o -iname '*.webp' \\) -printf '%i %D %s %p\\n'"
+        stdout, stderr, exit_code = self.execute_ssh_command(find_command, compressed=True)
+        
+        if exit_code == 0:
+            server_files = stdout.strip().split('\n') if stdout.strip() else []
+            
+            # 批量转换路径，避免逐个日志输出
+            for line in server_files:
+                parts = line.split(' ', 3)
+                if len(parts) != 4:  # 跳过空行
+                    continue
+                inode, dev, size, server_file = parts
+                relative_path = server_file.replace(server_dataset_path, "").lstrip("/")
+                local_file_path = os.path.join(dataset_path, relative_path).replace("/", "\\")
+                self.image_files.append(local_file_path)
+                scan_index[local_file_path] = {"size": int(size), "inode": int(inode), "dev": int(dev)}
+        else:
+            self.add_operation_log(f"[服务器模式] 文件扫描失败: {stderr.strip()}")
+        
+        return exit_code
+    
     def natural_sort_key(self, text):
         """自然排序键函数"""
         def convert(text):
             return int(text) if text.isdigit() else text.lower()
         return [convert(c) for c in re.split('([0-9]+)', text)]
     
+    def order_for_locality(self, items, key=None):
+        """按磁盘局部性重排操作顺序（仅影响执行顺序，不影响结果展示顺序）
+        
+        transfer_config["operation_order"]为"inode"时，按扫描索引中的(设备号, inode号)排序，
+        机械硬盘上inode顺序与文件在磁盘上的分配顺序高度相关，可减少寻道。
+        
+        Args:
+            items: 操作列表（已按自然顺序排列）
+            key: 从操作中取出图片路径的函数，默认为操作本身
+            
+        Returns:
+            重排后的新列表；未启用或扫描索引缺失时保持原顺序
+        """
+        if self.transfer_config.get("operation_order", "natural") != "inode" or not self.scan_index:
+            return list(items)
+        
+        key = key or (lambda item: item)
+        indexed = []
+        unindexed = []
+        for position, item in enumerate(items):
+            entry = self.scan_index.get(key(item))
+            if entry and entry.get("inode"):
+                indexed.append(((entry.get("dev", 0), entry["inode"], position), item))
+            else:
+                unindexed.append(item)
+        
+        indexed.sort(key=lambda pair: pair[0])
+        # 索引中没有的文件保持自然顺序排在最后
+        return [item for _, item in indexed] + unindexed
+    
     def check_image_order(self):
         """检查图片文件是否有序"""
         if len(self.image_files) <= 1:
@@ -2015,6 +4660,47 @@ class ImageManager:
         """移动选中的图片"""
         self.process_images(copy=False)
     
+    def download_images(self):
+        """把选中范围的图片和对应的标签下载到本地目录（服务器模式）"""
+        if self.operation_mode.get() != "server":
+            messagebox.showwarning("警告", "下载到本地只能在服务器模式下使用")
+            return
+        if not self.is_server_reachable(self.source_dir.get()):
+            messagebox.showerror("错误", "数据集目录不在SSH服务器的共享目录下")
+            return
+        
+        selected_images = self.get_selected_images()
+        if not selected_images:
+            return
+        
+        options = self.transfer_config.get("download", {})
+        local_dir = filedialog.askdirectory(title="选择下载目录", initialdir=options.get("last_dir") or None)
+        if not local_dir:
+            return
+        # 记住本次选择的目录
+        self.transfer_config["download"] = dict(options, last_dir=local_dir)
+        self.save_config()
+        
+        result = messagebox.askyesno("确认",
+            f"确定要下载 {len(selected_images)} 个数据集文件（images+labels）到以下目录吗？\n- {local_dir}\n\n"
+            "目录中大小一致的文件会跳过，上次未完成的文件继续下载")
+        if not result:
+            return
+        
+        dataset_path = Path(self.source_dir.get())
+        self.progress_dialog = ProgressDialog(self.root, "下载进度")
+        self.progress_dialog.add_task_log(f"开始下载任务: {len(selected_images)} 个文件到 {local_dir}")
+        
+        # 重置取消标志，取消后未完成的文件保留为.part，下次继续
+        self.task_cancelled = False
+        self.progress_dialog.on_cancel = self.cancel_current_task
+        
+        self.current_task = self.executor.submit(
+            self.download_images_worker,
+            selected_images, dataset_path / "images", dataset_path / "labels", local_dir
+        )
+        self.monitor_task_progress()
+    
     def process_images(self, copy=True):
         """处理数据集（复制或移动images和labels目录）"""
         # 获取选中的目标目录
@@ -2041,71 +4727,664 @@ class ImageManager:
                         messagebox.showerror("错误", f"目标目录不存在: {key} ({target_path})")
                         return
         
-        if not selected_targets:
-            messagebox.showerror("错误", "请先选择至少一个目标目录")
-            return
+        if not selected_targets:
+            messagebox.showerror("错误", "请先选择至少一个目标目录")
+            return
+        
+        selected_images = self.get_selected_images()
+        if not selected_images:
+            return
+        
+        # 获取数据集目录路径
+        dataset_path = Path(self.source_dir.get())
+        images_path = dataset_path / "images"
+        labels_path = dataset_path / "labels"
+        
+        operation = "复制" if copy else "移动"
+        target_names = [name for name, _ in selected_targets]
+        result = messagebox.askyesno("确认", 
+            f"确定要{operation} {len(selected_images)} 个数据集文件（images+labels）到以下目录吗？\n" +
+            "\n".join([f"- {name}" for name in target_names]))
+        if not result:
+            return
+        
+        # 启动异步任务
+        self.start_async_process(selected_images, selected_targets, images_path, labels_path, copy)
+    
+    def start_async_process(self, selected_images, selected_targets, images_path, labels_path, copy):
+        """启动异步处理任务"""
+        operation = "复制" if copy else "移动"
+        
+        # 创建进度对话框
+        self.progress_dialog = ProgressDialog(self.root, f"{operation}进度")
+        self.progress_dialog.add_task_log(f"开始{operation}任务: {len(selected_images)} 个文件到 {len(selected_targets)} 个目录")
+        
+        # 重置取消标志，点击取消时立即中止远程命令
+        self.task_cancelled = False
+        self.progress_dialog.on_cancel = self.cancel_current_task
+        
+        # 提交异步任务
+        self.current_task = self.executor.submit(
+            self.process_images_worker, 
+            selected_images, selected_targets, images_path, labels_path, copy
+        )
+        
+        # 启动进度监控
+        self.monitor_task_progress()
+    
+    def process_images_worker(self, selected_images, selected_targets, images_path, labels_path, copy):
+        """异步处理图片的工作线程"""
+        # 根据操作模式选择不同的处理方法
+        if self.operation_mode.get() == "server":
+            if not self.transfer_config.get("routing", {}).get("enabled", True):
+                return self.process_images_worker_ssh(selected_images, selected_targets, images_path, labels_path, copy)
+            
+            # 按目标选择服务器端或客户端执行
+            server_targets, client_targets = self.route_targets(selected_images, selected_targets, images_path)
+            if not client_targets:
+                return self.process_images_worker_ssh(selected_images, server_targets, images_path, labels_path, copy)
+            if not server_targets:
+                return self.process_images_worker_local(selected_images, client_targets, images_path, labels_path, copy)
+            return self.process_images_worker_mixed(selected_images, server_targets, client_targets,
+                                                    images_path, labels_path, copy)
+        else:
+            return self.process_images_worker_local(selected_images, selected_targets, images_path, labels_path, copy)
+    
+    def is_server_reachable(self, path):
+        """路径是否位于SSH服务器的share下（可以在服务器端直接操作）"""
+        host = self.host_for_path(path)
+        return host is not None and host == self.ssh_config.get("host", "")
+    
+    def measure_ssh_rtt(self, max_age=300):
+        """测量（并缓存）SSH命令往返时间
+        
+        Returns:
+            float: 往返秒数；无法连接时返回None
+        """
+        host = self.ssh_config.get("host", "")
+        cached = self.ssh_rtt.get(host)
+        if cached and time.time() - cached[1] < max_age:
+            return cached[0]
+        try:
+            # 第一次执行可能包含建立连接的时间，取第二次的结果
+            self.execute_ssh_command("true", retry_count=0)
+            start = time.time()
+            self.execute_ssh_command("true", retry_count=0)
+            rtt = time.time() - start
+        except Exception as e:
+            print(f"测量SSH往返时间失败: {e}")
+            return None
+        self.ssh_rtt[host] = (rtt, time.time())
+        return rtt
+    
+    def estimate_transfer_cost(self, route, files, total_bytes, source_path, target_path):
+        """估算一个 源/目标 组合在指定执行位置上的耗时（秒）
+        
+        Args:
+            route: "server" 或 "client"
+            files: 文件数
+            total_bytes: 总字节数
+            source_path: 源数据集路径
+            target_path: 目标目录路径
+            
+        Returns:
+            float: 估算秒数；该位置无法执行时返回None
+        """
+        options = self.transfer_config.get("routing", {})
+        source_remote = str(source_path).replace('/', '\\').startswith('\\\\')
+        target_remote = str(target_path).replace('/', '\\').startswith('\\\\')
+        
+        if route == "client":
+            # 源和目标都在网络共享上时，数据要经过客户端读一次、写一次
+            network_passes = max(1, int(source_remote) + int(target_remote))
+            return (files * options.get("smb_file_overhead", 0.01) +
+                    network_passes * total_bytes / max(1, options.get("smb_bytes_per_sec", 100 * 1024 * 1024)))
+        
+        # 目标在其他已配置服务器上时，由源服务器直接推送（需要可用的直接传输方式）
+        target_host = self.host_for_path(target_path)
+        if not self.is_server_reachable(source_path) or target_host is None:
+            return None
+        direct = target_host != self.ssh_config.get("host", "")
+        if direct and self.get_direct_transfer_method(target_host) is None:
+            return None
+        rtt = self.measure_ssh_rtt()
+        if rtt is None:
+            # 测量失败时按默认往返时间估算，不因此改为客户端执行
+            rtt = options.get("default_rtt", 0.05)
+        capabilities = self.get_server_capabilities()
+        if capabilities.get("python3") or capabilities.get("rsync"):
+            file_overhead = options.get("server_file_overhead", 0.001)
+        else:
+            file_overhead = options.get("server_script_file_overhead", 0.003)
+        if direct:
+            bytes_per_sec = options.get("direct_bytes_per_sec", 100 * 1024 * 1024)
+        else:
+            bytes_per_sec = options.get("server_bytes_per_sec", 400 * 1024 * 1024)
+        return (options.get("server_round_trips", 8) * rtt + files * file_overhead +
+                total_bytes / max(1, bytes_per_sec))
+    
+    def route_targets(self, selected_images, selected_targets, images_path):
+        """为每个目标选择执行位置，使整个任务耗时最短
+        
+        Returns:
+            tuple: (server_targets, client_targets)
+        """
+        source_path = os.path.dirname(str(images_path).rstrip('\\/'))
+        files = len(selected_images) * 2  # 含标签文件的估计
+        total_bytes = sum(self.scan_index.get(image_path, {}).get("size", 0) for image_path in selected_images)
+        
+        server_targets = []
+        client_targets = []
+        for target_name, target_path in selected_targets:
+            server_cost = self.estimate_transfer_cost("server", files, total_bytes, source_path, target_path)
+            client_cost = self.estimate_transfer_cost("client", files, total_bytes, source_path, target_path)
+            if server_cost is not None and server_cost <= client_cost:
+                server_targets.append((target_name, target_path))
+                route_text = f"服务器端（估计 {server_cost:.1f}s，客户端 {client_cost:.1f}s）"
+            else:
+                client_targets.append((target_name, target_path))
+                route_text = (f"客户端（估计 {client_cost:.1f}s，服务器端 {server_cost:.1f}s）"
+                              if server_cost is not None else "客户端（服务器无法直接访问）")
+            self.root.after(0, lambda n=target_name, r=route_text: self.progress_dialog.add_task_log(f"{n}: {r}"))
+            self.root.after(0, lambda n=target_name, r=route_text: self.add_operation_log(f"执行位置 {n}: {r}"))
+        
+        return server_targets, client_targets
+    
+    def process_images_worker_mixed(self, selected_images, server_targets, client_targets, images_path, labels_path, copy):
+        """同一任务中部分目标在客户端执行、部分在服务器端执行
+        
+        移动操作时先完成客户端目标的复制，再由服务器端完成剩余目标并移走源文件；
+        客户端部分失败时服务器端改为复制，保留源文件。
+        """
+        operation = "复制" if copy else "移动"
+        client_result = self.process_images_worker_local(selected_images, client_targets, images_path, labels_path, True)
+        if client_result.get("cancelled"):
+            return client_result
+        
+        client_ok = client_result.get("success") and not client_result.get("failed_operations")
+        server_copy = copy or not client_ok
+        server_result = self.process_images_worker_ssh(selected_images, server_targets, images_path, labels_path, server_copy)
+        if server_result.get("cancelled"):
+            return server_result
+        
+        failed_operations = []
+        for part, part_result in (("客户端", client_result), ("服务器端", server_result)):
+            if not part_result.get("success"):
+                failed_operations.append(f"{part}执行失败: {part_result.get('error', '未知错误')}")
+            failed_operations.extend(part_result.get("failed_operations", []))
+        if not copy and server_copy:
+            failed_operations.append("客户端目标未全部成功，源文件已保留（服务器端目标改为复制）")
+        
+        return {
+            "success": bool(client_result.get("success") or server_result.get("success")),
+            "total_operations": client_result.get("total_operations", 0) + server_result.get("total_operations", 0),
+            "failed_operations": failed_operations,
+            "operation": operation,
+            "selected_images": selected_images,
+            "selected_targets": client_targets + server_targets,
+            "copy": copy,
+            "manifest_path": server_result.get("manifest_path") or client_result.get("manifest_path"),
+            "ssh_stats": server_result.get("ssh_stats"),
+            "summary_path": server_result.get("summary_path")
+        }
+    
+    def get_concurrency_controller(self, key, initial=2, max_limit=None):
+        """获取（或创建）指定目标/主机的自适应并发控制器
+        
+        控制器在任务之间保留，使每个目标和主机的并发数持续收敛。
+        
+        Args:
+            key: 控制器键，如 "target:<路径>" 或 "host:<主机>"
+            initial: 首次创建时的初始并发数
+            max_limit: 覆盖配置中的并发上限（协程执行的操作不占线程，可以更高）
+            
+        Returns:
+            AdaptiveConcurrencyController对象，未启用自适应并发时返回None
+        """
+        options = self.transfer_config.get("adaptive_concurrency", {})
+        if not options.get("enabled", True):
+            return None
+        
+        with self.concurrency_lock:
+            controller = self.concurrency_controllers.get(key)
+            if controller is None:
+                controller = AdaptiveConcurrencyController(
+                    key,
+                    initial=initial,
+                    min_limit=options.get("min", 1),
+                    max_limit=max_limit or options.get("max", 16),
+                    window_seconds=options.get("window_seconds", 2.0)
+                )
+                self.concurrency_controllers[key] = controller
+            return controller
+    
+    def _get_rate_limiter(self, kind, name, limits):
+        """获取（或创建）共享的限速器，配置变化时重建"""
+        bytes_per_sec = limits.get("bytes_per_sec", 0) or 0
+        ops_per_sec = limits.get("ops_per_sec", 0) or 0
+        with self.concurrency_lock:
+            limiter = self.rate_limiters.get((kind, name))
+            if (limiter is None or limiter.bytes_per_sec != bytes_per_sec
+                    or limiter.ops_per_sec != ops_per_sec):
+                limiter = TransferRateLimiter(f"{kind}:{name}", bytes_per_sec, ops_per_sec)
+                self.rate_limiters[(kind, name)] = limiter
+            return limiter
+    
+    def get_rate_limiters(self, target_path=None, host=None):
+        """获取适用于一次传输的限速器列表（目标限速 + 主机限速）
+        
+        Args:
+            target_path: 目标目录路径（Windows或Linux格式）
+            host: 主机名，未指定时从SMB路径中解析
+            
+        Returns:
+            list: 已启用的TransferRateLimiter列表
+        """
+        rate_limits = self.transfer_config.get("rate_limits", {})
+        limiters = []
+        
+        if target_path:
+            target_configs = rate_limits.get("targets", {})
+            target_limits = target_configs.get(target_path)
+            if target_limits is None:
+                # 服务器模式下传入的是Linux路径，按转换后的路径匹配配置中的Windows路径
+                for configured_path, limits in target_configs.items():
+                    if self.convert_windows_to_linux_path(configured_path).rstrip('/') == target_path.rstrip('/'):
+                        target_limits = limits
+                        break
+            if target_limits is None:
+                target_limits = rate_limits.get("default", {})
+            limiters.append(self._get_rate_limiter("target", target_path, target_limits))
+            if host is None and target_path.startswith('\\\\'):
+                host = target_path.lstrip('\\').split('\\', 1)[0]
+        
+        if host:
+            host_limits = rate_limits.get("hosts", {}).get(host)
+            if host_limits:
+                limiters.append(self._get_rate_limiter("host", host, host_limits))
+        
+        return [limiter for limiter in limiters if limiter.is_limited()]
+    
+    def throttle(self, limiters, nbytes=0, ops=0):
+        """按限速器列表消耗配额，必要时阻塞
+        
+        Returns:
+            bool: 是否成功（任务取消时返回False）
+        """
+        for limiter in limiters:
+            if not limiter.consume(nbytes, ops, lambda: self.task_cancelled):
+                return False
+        return True
+    
+    def get_rsync_bwlimit_option(self, target_dir=None, concurrency=1):
+        """根据限速配置生成rsync的--bwlimit参数（KiB/s）
+        
+        多个rsync进程同时运行时限额按进程数平分，合计不超过配置的限速。
+        
+        Args:
+            target_dir: 目标目录
+            concurrency: 可能同时运行的rsync进程数
+        """
+        host = self.ssh_config.get("host", "")
+        byte_limits = [limiter.bytes_per_sec for limiter in self.get_rate_limiters(target_dir, host)
+                       if limiter.bytes_per_sec > 0]
+        if not byte_limits:
+            return ""
+        return f" --bwlimit={max(1, int(min(byte_limits) / max(1, concurrency) // 1024))}"
+    
+    def get_lane_workers(self, target_path):
+        """获取目标目录传输通道的并发线程数
+        
+        Args:
+            target_path: 目标目录路径
+            
+        Returns:
+            int: 并发线程数，可在transfer_config["target_lane_workers"]中按目标覆盖
+        """
+        overrides = self.transfer_config.get("target_lane_workers", {})
+        return max(1, int(overrides.get(target_path, self.transfer_config.get("lane_workers", 2))))
+    
+    def begin_ssh_stats(self):
+        """为新的服务器模式任务重建SSH操作统计，更新按节流推送到进度对话框"""
+        def on_update(stats):
+            if self.progress_dialog:
+                self.root.after(0, lambda: self.progress_dialog.update_ssh_stats(stats))
+        
+        self.ssh_stats = SSHOperationStats(on_update=on_update)
+        return self.ssh_stats
+    
+    def finish_ssh_job(self, result, ssh_stats, operation_type):
+        """把SSH统计附加到任务结果，并与结果一起写入任务摘要（与传输清单同名的.summary.json）
+        
+        Args:
+            result: 任务结果字典（会被就地补充ssh_stats和summary_path）
+            ssh_stats: 本任务的SSHOperationStats
+            operation_type: 操作类型 'copy' 或 'move'
+            
+        Returns:
+            dict: 补充后的任务结果
+        """
+        stats = ssh_stats.snapshot()
+        result["ssh_stats"] = stats
+        if self.progress_dialog:
+            self.root.after(0, lambda: self.progress_dialog.update_ssh_stats(stats))
+        
+        if result.get("manifest_path"):
+            summary_path = os.path.splitext(result["manifest_path"])[0] + ".summary.json"
+        else:
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            summary_path = os.path.join(self.manifest_dir, f"transfer_{timestamp}_{operation_type}.summary.json")
+        summary = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "host": self.ssh_config.get("host", ""),
+            "operation": operation_type,
+            "success": bool(result.get("success")),
+            "total_operations": result.get("total_operations", 0),
+            "failed_operations": len(result.get("failed_operations", [])),
+            "error": result.get("error"),
+            "ssh": stats
+        }
+        try:
+            os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+            with open(summary_path, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            result["summary_path"] = summary_path
+        except Exception as e:
+            print(f"写入任务摘要失败: {e}")
+        return result
+    
+    def create_transfer_manifest(self, operation_type):
+        """为当前任务创建传输清单
+        
+        Args:
+            operation_type: 操作类型 'copy' 或 'move'
+            
+        Returns:
+            TransferManifest对象，未启用或创建失败时返回None
+        """
+        if not self.transfer_config.get("write_manifest", True):
+            return None
         
-        selected_images = self.get_selected_images()
-        if not selected_images:
-            return
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        manifest_path = os.path.join(self.manifest_dir, f"transfer_{timestamp}_{operation_type}.jsonl")
+        try:
+            return TransferManifest(manifest_path, self.transfer_config.get("hash_algorithm", "blake2b"))
+        except Exception as e:
+            print(f"创建传输清单失败: {e}")
+            return None
+    
+    def copy_file_with_hash(self, source_path, target_path, limiters=None):
+        """复制文件并在同一缓冲区上计算校验值，避免二次读取
         
-        # 获取数据集目录路径
-        dataset_path = Path(self.source_dir.get())
-        images_path = dataset_path / "images"
-        labels_path = dataset_path / "labels"
+        Args:
+            source_path: 源文件路径
+            target_path: 目标文件路径
+            limiters: 可选的限速器列表，按缓冲区消耗带宽配额
+            
+        Returns:
+            tuple: (文件大小, 校验值十六进制字符串, 耗时秒数)
+        """
+        checksum = StreamChecksum(self.transfer_config.get("hash_algorithm", "blake2b"))
+        buffer_size = self.transfer_config.get("copy_buffer_size", 1024 * 1024)
+        
+        limiters = limiters or []
+        start_time = time.perf_counter()
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        
+        # 等待限速配额时任务被取消，throttle返回False
+        if not self.throttle(limiters, ops=1):
+            raise Exception("任务已取消")
+        with open(source_path, 'rb') as src:
+            with open(target_path, 'wb') as dst:
+                try:
+                    while True:
+                        n = src.readinto(buffer)
+                        if not n:
+                            break
+                        if not self.throttle(limiters, nbytes=n):
+                            raise Exception("任务已取消")
+                        chunk = view[:n]
+                        dst.write(chunk)
+                        checksum.update(chunk)
+                except BaseException:
+                    # 出错或取消时删除不完整的目标文件
+                    dst.close()
+                    os.remove(target_path)
+                    raise
+        
+        # 保持与shutil.copy2一致的元数据
+        shutil.copystat(source_path, target_path)
+        
+        duration = time.perf_counter() - start_time
+        return checksum.size, checksum.hexdigest(), duration
+    
+    def get_tar_stream_direction(self, source_root, target_path):
+        """客户端执行的目标能否经SSH通道以tar流传输
         
-        operation = "复制" if copy else "移动"
-        target_names = [name for name, _ in selected_targets]
-        result = messagebox.askyesno("确认", 
-            f"确定要{operation} {len(selected_images)} 个数据集文件（images+labels）到以下目录吗？\n" +
-            "\n".join([f"- {name}" for name in target_names]))
-        if not result:
-            return
+        Args:
+            source_root: 源数据集目录（含images和labels）
+            target_path: 目标目录
         
-        # 启动异步任务
-        self.start_async_process(selected_images, selected_targets, images_path, labels_path, copy)
+        Returns:
+            str: "download"（源在服务器、目标不在）、"upload"（目标在服务器、源不在）或None
+        """
+        options = self.transfer_config.get("tar_pipe", {})
+        if self.operation_mode.get() != "server" or not self.ssh_config.get("host"):
+            return None
+        if not options.get("enabled", True) or not options.get("client_stream", True):
+            return None
+        source_remote = self.is_server_reachable(source_root)
+        target_remote = self.is_server_reachable(target_path)
+        if source_remote == target_remote or not self.get_server_capabilities().get("tar"):
+            return None
+        return "download" if source_remote else "upload"
     
-    def start_async_process(self, selected_images, selected_targets, images_path, labels_path, copy):
-        """启动异步处理任务"""
-        operation = "复制" if copy else "移动"
+    def stream_tar_download(self, remote_root, files, limiters=None, manifest=None, is_cancelled=None):
+        """服务器上的一批文件打包为一个tar流，经SSH通道下载并在本地解包
         
-        # 创建进度对话框
-        self.progress_dialog = ProgressDialog(self.root, f"{operation}进度")
-        self.progress_dialog.add_task_log(f"开始{operation}任务: {len(selected_images)} 个文件到 {len(selected_targets)} 个目录")
+        每个文件先写入临时文件再重命名，中途取消不会留下不完整的目标文件。
         
-        # 重置取消标志
-        self.task_cancelled = False
+        Args:
+            remote_root: 服务器上的源根目录（Linux路径）
+            files: {相对路径: (清单中记录的源路径, 本地目标路径)}，如 "images/a.jpg"
+            limiters: 可选的限速器列表
+            manifest: 可选的TransferManifest
+            is_cancelled: 返回是否已取消的函数
         
-        # 提交异步任务
-        self.current_task = self.executor.submit(
-            self.process_images_worker, 
-            selected_images, selected_targets, images_path, labels_path, copy
-        )
+        Returns:
+            int: 完成的文件数
+        """
+        host = self.ssh_config.get("host", "")
+        algorithm = self.transfer_config.get("hash_algorithm", "blake2b")
+        buffer_size = self.transfer_config.get("copy_buffer_size", 1024 * 1024)
+        limiters = limiters or []
+        started = time.time()
+        traffic = {"sent": 0, "received": 0}
+        done = 0
+        
+        with self.ssh_pool.connection(host) as connection:
+            channel = connection.client.get_transport().open_session()
+            self.register_active_channel(channel)
+            try:
+                channel.exec_command(self.cancellable_command(
+                    f"cd -- {shlex.quote(remote_root)} && tar --null --no-recursion -T - -cf -"))
+                
+                # 文件名列表与tar流并行传输，避免输出窗口填满后双方互相等待
+                def feed_names():
+                    try:
+                        data = b"".join(name.encode('utf-8') + b"\0" for name in files)
+                        channel.sendall(data)
+                        traffic["sent"] += len(data)
+                    except Exception as e:
+                        print(f"tar文件列表写入失败: {e}")
+                    finally:
+                        try:
+                            channel.shutdown_write()
+                        except Exception:
+                            pass
+                
+                writer = threading.Thread(target=feed_names, daemon=True)
+                writer.start()
+                
+                with tarfile.open(fileobj=channel.makefile('rb'), mode='r|', encoding='utf-8') as archive:
+                    for member in archive:
+                        if is_cancelled and is_cancelled():
+                            raise Exception("任务已取消")
+                        entry = files.get(member.name)
+                        if entry is None or not member.isfile():
+                            raise Exception(f"tar流中出现意外的条目: {member.name}")
+                        source_path, target_path = entry
+                        
+                        self.throttle(limiters, ops=1)
+                        member_start = time.perf_counter()
+                        checksum = StreamChecksum(algorithm)
+                        temp_path = f"{target_path}.{uuid.uuid4().hex[:8]}.part"
+                        try:
+                            with archive.extractfile(member) as src, open(temp_path, 'wb') as dst:
+                                while True:
+                                    chunk = src.read(buffer_size)
+                                    if not chunk:
+                                        break
+                                    self.throttle(limiters, nbytes=len(chunk))
+                                    dst.write(chunk)
+                                    checksum.update(chunk)
+                            os.utime(temp_path, (member.mtime, member.mtime))
+                            os.replace(temp_path, target_path)
+                        except BaseException:
+                            if os.path.exists(temp_path):
+                                os.remove(temp_path)
+                            raise
+                        
+                        if manifest:
+                            manifest.record(source_path, target_path, checksum.size, checksum.hexdigest(),
+                                            time.perf_counter() - member_start)
+                        traffic["received"] += checksum.size
+                        done += 1
+                
+                writer.join()
+                exit_code = channel.recv_exit_status()
+                stderr_text = channel.makefile_stderr('rb').read().decode('utf-8', errors='replace')
+            finally:
+                channel.close()
+                self.unregister_active_channel(channel)
+        
+        # 打开channel和执行命令各一次往返，整批文件随后在同一channel上顺序传输
+        self.ssh_stats.record("tar", time.time() - started, traffic["sent"], traffic["received"], round_trips=2)
+        if done < len(files):
+            raise Exception(f"tar流下载不完整（退出码 {exit_code}，完成 {done}/{len(files)}）: {stderr_text.strip()}")
+        return done
+    
+    def stream_tar_upload(self, remote_root, files, limiters=None, manifest=None, is_cancelled=None):
+        """本地的一批文件打包为一个tar流，经SSH通道上传并在服务器上解包
         
-        # 启动进度监控
-        self.monitor_task_progress()
+        服务器端解包失败或被中止时删除正在写入的文件。
+        
+        Args:
+            remote_root: 服务器上的目标根目录（Linux路径）
+            files: {相对路径: (本地源路径, 清单中记录的目标路径)}
+            limiters: 可选的限速器列表
+            manifest: 可选的TransferManifest，服务器确认解包成功后才记录
+            is_cancelled: 返回是否已取消的函数
+        
+        Returns:
+            int: 完成的文件数
+        """
+        host = self.ssh_config.get("host", "")
+        algorithm = self.transfer_config.get("hash_algorithm", "blake2b")
+        limiters = limiters or []
+        started = time.time()
+        records = []
+        extract_cmd = ("shopt -s lastpipe; set -o pipefail; cur=; "
+                       "trap 'rm -f -- \"$cur\"; exit 130' TERM INT HUP PIPE; "
+                       f"cd -- {shlex.quote(remote_root)} && tar --quoting-style=literal -xvf - | "
+                       "while IFS= read -r n; do cur=$n; done; "
+                       "rc=$?; if [ $rc -ne 0 ]; then rm -f -- \"$cur\"; fi; [ $rc -eq 0 ]")
+        
+        with self.ssh_pool.connection(host) as connection:
+            channel = connection.client.get_transport().open_session()
+            self.register_active_channel(channel)
+            try:
+                channel.exec_command(self.cancellable_command(extract_cmd))
+                stream = ChannelWriter(channel)
+                with tarfile.open(fileobj=stream, mode='w|', format=tarfile.GNU_FORMAT, encoding='utf-8') as archive:
+                    for name, (source_path, target_path) in files.items():
+                        if is_cancelled and is_cancelled():
+                            raise Exception("任务已取消")
+                        self.throttle(limiters, ops=1)
+                        member_start = time.perf_counter()
+                        checksum = StreamChecksum(algorithm)
+                        info = archive.gettarinfo(source_path, arcname=name)
+                        with open(source_path, 'rb') as f:
+                            archive.addfile(info, ChecksumReader(f, checksum, lambda n: self.throttle(limiters, nbytes=n)))
+                        records.append((source_path, target_path, checksum.size, checksum.hexdigest(),
+                                        time.perf_counter() - member_start))
+                channel.shutdown_write()
+                exit_code = channel.recv_exit_status()
+                stderr_text = channel.makefile_stderr('rb').read().decode('utf-8', errors='replace')
+            finally:
+                channel.close()
+                self.unregister_active_channel(channel)
+        
+        self.ssh_stats.record("tar", time.time() - started, stream.bytes_written, round_trips=2)
+        if exit_code != 0:
+            raise Exception(f"tar流上传失败（退出码 {exit_code}）: {stderr_text.strip()}")
+        if manifest:
+            for record in records:
+                manifest.record(*record)
+        return len(records)
     
-    def process_images_worker(self, selected_images, selected_targets, images_path, labels_path, copy):
-        """异步处理图片的工作线程"""
-        # 根据操作模式选择不同的处理方法
-        if self.operation_mode.get() == "server":
-            return self.process_images_worker_ssh(selected_images, selected_targets, images_path, labels_path, copy)
-        else:
-            return self.process_images_worker_local(selected_images, selected_targets, images_path, labels_path, copy)
+    def transfer_tar_stream(self, direction, source_root, target_root, work_items, limiters=None, manifest=None,
+                            is_cancelled=None):
+        """以一个tar流传输一批 (图片, 标签) 到目标目录的images和labels下
+        
+        Args:
+            direction: get_tar_stream_direction的返回值
+            source_root: 源数据集目录
+            target_root: 目标目录
+            work_items: [(图片路径, 标签路径或None), ...]
+        
+        Returns:
+            int: 完成的文件数
+        """
+        files = {}
+        for image_path, label_path in work_items:
+            for kind, path in (("images", image_path), ("labels", label_path)):
+                if path:
+                    name = f"{kind}/{os.path.basename(str(path))}"
+                    target_path = Path(target_root) / kind / os.path.basename(str(path))
+                    files[name] = (str(path), str(target_path))
+        
+        if direction == "download":
+            remote_root = self.convert_windows_to_linux_path(str(source_root))
+            return self.stream_tar_download(remote_root, files, limiters, manifest, is_cancelled)
+        remote_root = self.convert_windows_to_linux_path(str(target_root))
+        return self.stream_tar_upload(remote_root, files, limiters, manifest, is_cancelled)
     
     def process_images_worker_local(self, selected_images, selected_targets, images_path, labels_path, copy):
-        """Windows本地模式的图片处理工作线程"""
+        """Windows本地模式的图片处理工作线程
+        
+        每个目标目录使用独立的传输通道，快速目标不会被慢速目标（如远程SMB共享）拖慢，
+        任务总耗时取决于最慢的通道而不是所有目标耗时之和。
+        """
         operation = "复制" if copy else "移动"
         total_operations = 0
         failed_operations = []
         
+        # 创建传输清单，复制时同步记录校验值
+        manifest = self.create_transfer_manifest("copy" if copy else "move")
+        
+        def is_cancelled():
+            return self.task_cancelled or (self.progress_dialog and self.progress_dialog.is_cancelled())
+        
         try:
             # 更新进度
             self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, len(selected_images) * len(selected_targets), "创建目录结构..."))
             
             # 为每个目标目录创建images和labels子目录
-            for i, (target_name, target_path) in enumerate(selected_targets):
-                if self.task_cancelled or (self.progress_dialog and self.progress_dialog.is_cancelled()):
+            ready_targets = []
+            for target_name, target_path in selected_targets:
+                if is_cancelled():
                     return {"cancelled": True}
                     
                 target_images_path = Path(target_path) / "images"
@@ -2114,72 +5393,138 @@ class ImageManager:
                 try:
                     target_images_path.mkdir(exist_ok=True)
                     target_labels_path.mkdir(exist_ok=True)
+                    ready_targets.append((target_name, target_path))
                     self.root.after(0, lambda name=target_name: self.progress_dialog.add_task_log(f"创建目录结构: {name}"))
                 except Exception as e:
                     failed_operations.append(f"创建目录结构 -> {target_name}: {str(e)}")
                     self.root.after(0, lambda name=target_name, err=str(e): self.progress_dialog.add_task_log(f"创建目录失败: {name} - {err}"))
                     continue
             
-            # 存储需要删除的原文件（仅用于移动操作）
-            files_to_delete = []
-            
-            # 处理每个图片文件
-            total_files = len(selected_images)
-            for file_index, image_path in enumerate(selected_images):
-                if self.task_cancelled or (self.progress_dialog and self.progress_dialog.is_cancelled()):
-                    return {"cancelled": True}
-                
+            # 预先解析每个图片对应的label文件，所有通道共享
+            work_items = []
+            for image_path in selected_images:
                 filename = os.path.basename(image_path)
                 label_filename = os.path.splitext(filename)[0] + ".txt"
                 label_path = images_path.parent / "labels" / label_filename
+                work_items.append((image_path, label_path if label_path.exists() else None))
+            
+            # 按需重排执行顺序以减少机械硬盘寻道
+            ordered_items = self.order_for_locality(work_items, key=lambda item: item[0])
+            
+            # 为每个目标目录创建独立的传输通道
+            lanes = []
+            stream_batch = max(1, self.transfer_config.get("tar_pipe", {}).get("stream_batch_files", 200))
+            for target_name, target_path in ready_targets:
+                target_images_dir = Path(target_path) / "images"
+                target_labels_dir = Path(target_path) / "labels"
+                target_limiters = self.get_rate_limiters(target_path)
+                lane_workers = self.get_lane_workers(target_path)
+                controller = self.get_concurrency_controller(f"target:{target_path}", initial=lane_workers)
                 
-                # 记录需要删除的文件（移动操作时使用）
-                if not copy:
-                    files_to_delete.append((image_path, label_path if label_path.exists() else None))
+                stream_direction = self.get_tar_stream_direction(images_path.parent, target_path)
+                if stream_direction:
+                    # 源和目标一端在服务器上：每批文件经SSH通道以一个tar流传输，不再逐个文件SMB读写
+                    def transfer_batch(batch, target_root=target_path, direction=stream_direction,
+                                       limiters=target_limiters):
+                        return self.transfer_tar_stream(direction, images_path.parent, target_root, batch,
+                                                        limiters, manifest, is_cancelled)
+                    
+                    lane = TransferLane(target_name, transfer_batch,
+                                        workers=controller.max_limit if controller else lane_workers,
+                                        is_cancelled=is_cancelled,
+                                        controller=controller,
+                                        item_weight=len)
+                    for start in range(0, len(ordered_items), stream_batch):
+                        lane.put(ordered_items[start:start + stream_batch])
+                    lanes.append(lane)
+                    self.root.after(0, lambda name=target_name, d=stream_direction: self.progress_dialog.add_task_log(
+                        f"{name}: 经SSH通道以tar流{'下载' if d == 'download' else '上传'}"))
+                    continue
                 
-                # 复制到所有目标目录
-                for target_index, (target_name, target_path) in enumerate(selected_targets):
-                    if self.task_cancelled or (self.progress_dialog and self.progress_dialog.is_cancelled()):
-                        return {"cancelled": True}
+                def transfer_item(item, images_dir=target_images_dir, labels_dir=target_labels_dir,
+                                  limiters=target_limiters):
+                    image_path, label_path = item
+                    filename = os.path.basename(image_path)
+                    target_image_path = images_dir / filename
                     
-                    target_images_dir = Path(target_path) / "images"
-                    target_labels_dir = Path(target_path) / "labels"
-                    target_image_path = target_images_dir / filename
-                    target_label_path = target_labels_dir / label_filename
+                    # 处理图片文件（边复制边计算校验值，按目标/主机限速）
+                    size, file_hash, duration = self.copy_file_with_hash(image_path, target_image_path, limiters)
+                    if manifest:
+                        manifest.record(image_path, target_image_path, size, file_hash, duration)
+                    operations = 1
                     
-                    try:
-                        # 处理图片文件
-                        shutil.copy2(image_path, target_image_path)
-                        total_operations += 1
-                        
-                        # 处理对应的label文件（如果存在）
-                        if label_path.exists():
-                            shutil.copy2(str(label_path), target_label_path)
-                            total_operations += 1
-                        
-                        # 更新进度
-                        current_progress = file_index * len(selected_targets) + target_index + 1
-                        total_progress = total_files * len(selected_targets)
-                        progress_text = f"{operation}中: {filename} -> {target_name} ({current_progress}/{total_progress})"
-                        
-                        self.root.after(0, lambda cp=current_progress, tp=total_progress, pt=progress_text: 
-                                       self.progress_dialog.update_overall_progress(cp, tp, pt))
-                        
-                        if target_index == 0:  # 只在第一个目标目录时记录日志，避免重复
-                            self.root.after(0, lambda fn=filename: self.progress_dialog.add_task_log(f"处理文件: {fn}"))
-                        
-                    except Exception as e:
-                        failed_operations.append(f"{filename} -> {target_name}: {str(e)}")
-                        self.root.after(0, lambda fn=filename, tn=target_name, err=str(e): 
-                                       self.progress_dialog.add_task_log(f"失败: {fn} -> {tn} - {err}"))
-            
-            # 如果是移动操作，删除原文件
-            if not copy and not (self.task_cancelled or (self.progress_dialog and self.progress_dialog.is_cancelled())):
+                    # 处理对应的label文件（如果存在）
+                    if label_path:
+                        target_label_path = labels_dir / label_path.name
+                        size, file_hash, duration = self.copy_file_with_hash(str(label_path), target_label_path, limiters)
+                        if manifest:
+                            manifest.record(label_path, target_label_path, size, file_hash, duration)
+                        operations += 1
+                    return operations
+                
+                lane = TransferLane(target_name, transfer_item,
+                                    workers=controller.max_limit if controller else lane_workers,
+                                    is_cancelled=is_cancelled,
+                                    controller=controller)
+                for item in ordered_items:
+                    lane.put(item)
+                lanes.append(lane)
+            
+            # 启动所有通道，各自按自身速度推进
+            for lane in lanes:
+                lane.start()
+            
+            total_progress = sum(lane.total for lane in lanes)
+            finished_lanes = set()  # 已完成通道的序号（显示名称可能重复）
+            while len(finished_lanes) < len(lanes):
+                if is_cancelled():
+                    for lane in lanes:
+                        lane.join()
+                    return {"cancelled": True}
+                
+                current_progress = sum(lane.completed for lane in lanes)
+                lane_status = ", ".join(f"{lane.name} {lane.completed}/{lane.total}" for lane in lanes)
+                progress_text = f"{operation}中 ({current_progress}/{total_progress}): {lane_status}"
+                self.root.after(0, lambda cp=current_progress, tp=total_progress, pt=progress_text:
+                               self.progress_dialog.update_overall_progress(cp, tp, pt))
+                
+                for index, lane in enumerate(lanes):
+                    if index not in finished_lanes and lane.is_done():
+                        finished_lanes.add(index)
+                        self.root.after(0, lambda ln=lane.name, n=lane.completed, t=lane.elapsed():
+                                       self.progress_dialog.add_task_log(f"目标完成: {ln} - {n} 个文件，用时 {t:.1f} 秒"))
+                
+                time.sleep(0.2)
+            
+            # 汇总各通道结果（失败项按自然顺序报告）
+            natural_position = {image_path: i for i, image_path in enumerate(selected_images)}
+            failed_images = set()
+            for lane in lanes:
+                total_operations += lane.operations
+                # tar流通道的条目是一批文件，整批失败时逐个报告
+                lane_failures = [(work_item, error) for item, error in lane.failed
+                                 for work_item in (item if isinstance(item, list) else [item])]
+                lane_failures.sort(key=lambda failure: natural_position.get(failure[0][0], 0))
+                for (image_path, _), error in lane_failures:
+                    failed_images.add(image_path)
+                    filename = os.path.basename(image_path)
+                    failed_operations.append(f"{filename} -> {lane.name}: {error}")
+                    self.root.after(0, lambda fn=filename, tn=lane.name, err=error:
+                                   self.progress_dialog.add_task_log(f"失败: {fn} -> {tn} - {err}"))
+            
+            # 如果是移动操作，删除原文件（仅删除所有目标都成功的文件）
+            # 有目标目录创建失败时，该目标没有收到任何文件，不删除任何原文件
+            if not copy and len(ready_targets) < len(selected_targets):
+                failed_operations.append("部分目标目录创建失败，已保留所有原文件")
+                self.root.after(0, lambda: self.progress_dialog.add_task_log("部分目标目录创建失败，不删除原文件"))
+            elif not copy and not is_cancelled():
                 self.root.after(0, lambda: self.progress_dialog.add_task_log("删除原文件..."))
                 
-                for image_path, label_path in files_to_delete:
-                    if self.task_cancelled or (self.progress_dialog and self.progress_dialog.is_cancelled()):
+                for image_path, label_path in work_items:
+                    if is_cancelled():
                         return {"cancelled": True}
+                    if image_path in failed_images:
+                        continue
                     
                     try:
                         # 删除图片文件
@@ -2202,7 +5547,8 @@ class ImageManager:
                 "operation": operation,
                 "selected_images": selected_images,
                 "selected_targets": selected_targets,
-                "copy": copy
+                "copy": copy,
+                "manifest_path": manifest.manifest_path if manifest else None
             }
             
         except Exception as e:
@@ -2211,8 +5557,11 @@ class ImageManager:
                 "error": str(e),
                 "operation": operation
             }
+        finally:
+            if manifest:
+                manifest.close()
     
-    def execute_batch_ssh_operations(self, operations, operation_type="copy", max_workers=4, atomic=True):
+    def execute_batch_ssh_operations(self, operations, operation_type="copy", max_workers=4, atomic=True, progress=None):
         """批量执行SSH操作，支持并行处理和数据一致性保证
         
         Args:
@@ -2220,6 +5569,7 @@ class ImageManager:
             operation_type: 操作类型 'copy' 或 'move'
             max_workers: 最大并行工作线程数
             atomic: 是否启用原子性操作（事务性保证）
+            progress: 可选的TransferProgressTracker，接收实时进度
             
         Returns:
             dict: 操作结果
@@ -2237,107 +5587,88 @@ class ImageManager:
         
         if atomic:
             # 使用事务性操作保证原子性
-            return self._execute_atomic_operations(operations, operation_type, max_workers)
+            return self._execute_atomic_operations(operations, operation_type, max_workers, progress)
         else:
             # 根据操作数量选择处理策略
             if len(operations) <= 10:
                 # 少量文件使用批量脚本
-                return self._execute_batch_script(operations, operation_type)
+                return self._execute_batch_script(operations, operation_type, progress)
             else:
                 # 大量文件使用并行处理
-                return self._execute_parallel_operations(operations, operation_type, max_workers)
-    def _execute_batch_script(self, operations, operation_type="copy"):
-        """使用批量脚本执行SSH操作（增强版）"""
+                return self._execute_parallel_operations(operations, operation_type, max_workers, progress)
+    def _execute_batch_script(self, operations, operation_type="copy", progress=None):
+        """使用批量脚本执行SSH操作（增强版），每完成一个操作输出一行进度标记
+        
+        脚本被中止（任务取消）时由trap删除正在写入的不完整目标文件；移动操作失败或取消时，
+        本次调用已移动的文件按条件移回原位置。
+        """
         script_path = None
-        backup_script_path = None
+        moved_until = 0  # 移动操作中可能已执行的操作数（回滚范围）
         
         try:
+            ssh_client = self.get_ssh_client()
+            host_limiters = self.get_rate_limiters(host=self.ssh_config.get("host", ""))
+            
+            # 服务器端按IOPS限速：在脚本中的每个操作之后插入sleep
+            ops_limits = [limiter.ops_per_sec for limiter in host_limiters if limiter.ops_per_sec > 0]
+            op_delay_line = f"sleep {1.0 / min(ops_limits):.3f}" if ops_limits else None
+            
             # 分批处理大量操作，避免脚本过大
             batch_size = 100
             total_success = 0
-            total_failed = 0
+            q = shlex.quote
+            verb = "mv" if operation_type == "move" else "cp"
             
             for i in range(0, len(operations), batch_size):
                 batch_operations = operations[i:i + batch_size]
                 
                 # 创建临时脚本文件路径
                 script_path = f"/tmp/batch_operations_{int(time.time())}_{i}.sh"
-                backup_script_path = f"/tmp/backup_operations_{int(time.time())}_{i}.sh"
-                
-                # 构建批量操作脚本
-                script_lines = ["#!/bin/bash", "set -e"]
-                backup_lines = ["#!/bin/bash", "set -e"]
                 
-                # 为移动操作准备备份脚本（用于回滚）
-                if operation_type == "move":
-                    script_lines.append("# 批量移动操作")
-                    for source_path, target_path, file_type in batch_operations:
-                        script_lines.append(f"mv '{source_path}' '{target_path}'")
-                        # 备份脚本用于回滚
-                        backup_lines.append(f"mv '{target_path}' '{source_path}'")
-                else:
-                    script_lines.append("# 批量复制操作")
-                    for source_path, target_path, file_type in batch_operations:
-                        script_lines.append(f"cp '{source_path}' '{target_path}'")
+                # 构建批量操作脚本：run_op记录当前操作，收到中止信号时源文件仍在说明目标不完整
+                script_lines = [
+                    "#!/bin/bash",
+                    "set -e",
+                    "cur_src=; cur_dst=",
+                    "run_op() { cur_src=$2; cur_dst=$3; \"$1\" -- \"$2\" \"$3\"; cur_src=; }",
+                    "on_signal() { if [ -n \"$cur_src\" ] && [ -e \"$cur_src\" ]; then rm -f -- \"$cur_dst\"; fi; "
+                    f"rm -f -- {q(script_path)}; exit 130; }}",
+                    "trap on_signal TERM INT HUP PIPE",
+                    "# 批量移动操作" if operation_type == "move" else "# 批量复制操作"
+                ]
+                for op_index, (source_path, target_path, file_type) in enumerate(batch_operations):
+                    script_lines.append(f"run_op {verb} {q(source_path)} {q(target_path)}")
+                    script_lines.append(f"echo '{TransferProgressTracker.OP_MARKER} {op_index}'")
+                    if op_delay_line:
+                        script_lines.append(op_delay_line)
                 
-                script_content = "\n".join(script_lines)
-                backup_content = "\n".join(backup_lines)
-                
-                # 使用SFTP上传脚本文件，避免参数列表过长问题
+                # 使用持久SFTP会话上传脚本文件（同时设置执行权限），避免参数列表过长问题
                 try:
-                    sftp = ssh_client.open_sftp()
-                    
-                    # 上传主脚本
-                    with sftp.open(script_path, 'w') as f:
-                        f.write(script_content)
-                    
-                    # 如果是移动操作，也上传备份脚本
-                    if operation_type == "move":
-                        with sftp.open(backup_script_path, 'w') as f:
-                            f.write(backup_content)
-                    
-                    sftp.close()
+                    self.upload_remote_files({script_path: "\n".join(script_lines)}, mode=0o755)
                     print(f"脚本文件上传成功: {script_path}")
-                    
                 except Exception as e:
                     return {"success": False, "error": f"SFTP脚本上传失败: {str(e)}"}
                 
-                # 设置脚本执行权限
-                chmod_cmd = f"chmod +x '{script_path}'"
-                if operation_type == "move":
-                    chmod_cmd += f" && chmod +x '{backup_script_path}'"
-                
-                stdout, stderr, exit_code = self.execute_ssh_command(chmod_cmd, retry_count=2)
-                if exit_code != 0:
-                    return {"success": False, "error": f"设置脚本权限失败: {stderr}"}
-                
-                # 执行批量操作脚本（带重试）
-                exec_cmd = f"bash '{script_path}'"
-                stdout, stderr, exit_code = self.execute_ssh_command(exec_cmd, retry_count=2)
-            
-                # 清理脚本文件
-                cleanup_cmd = f"rm -f '{script_path}'"
-                if operation_type == "move":
-                    cleanup_cmd += f" '{backup_script_path}'"
-                try:
-                    self.execute_ssh_command(cleanup_cmd)
-                except:
-                    pass  # 清理失败不影响主要操作
+                # 执行批量操作脚本（带重试），实时解析进度标记；脚本执行后删除自身
+                moved_until = i + len(batch_operations)
+                exec_cmd = self.cancellable_command(
+                    f"bash {q(script_path)}; rc=$?; rm -f {q(script_path)}; exit $rc")
+                on_output = progress.stream_parser([src for src, _, _ in batch_operations]) if progress else None
+                stdout, stderr, exit_code = self.execute_ssh_command(exec_cmd, retry_count=2, on_output=on_output)
+                script_path = None
                 
                 if exit_code == 0:
                     total_success += len(batch_operations)
                 else:
-                    total_failed += len(batch_operations)
-                    # 如果是移动操作且失败，尝试回滚
+                    # 如果是移动操作且失败，回滚本次调用已移动的文件
                     if operation_type == "move":
-                        try:
-                            rollback_cmd = f"bash '{backup_script_path}'"
-                            self.execute_ssh_command(rollback_cmd)
-                        except:
-                            pass  # 回滚失败记录但不中断
+                        self.wait_remote_abort()
+                        self._rollback_successful_moves(
+                            [{"success": True, "operation": op} for op in operations[:moved_until]])
                     
                     return {
                         "success": False,
+                        "cancelled": self.task_cancelled,
                         "error": f"批量操作失败: {stderr}",
                         "operations_count": len(batch_operations),
                         "batch_index": i
@@ -2350,80 +5681,108 @@ class ImageManager:
             }
                 
         except Exception as e:
+            if self.task_cancelled and operation_type == "move" and moved_until:
+                # 任务取消：等待服务器上的脚本退出后，把已移动的文件移回原位置
+                self.wait_remote_abort()
+                self._rollback_successful_moves(
+                    [{"success": True, "operation": op} for op in operations[:moved_until]])
             # 确保清理临时文件
             if script_path:
                 try:
-                    cleanup_cmd = f"rm -f '{script_path}'"
-                    if backup_script_path:
-                        cleanup_cmd += f" '{backup_script_path}'"
-                    self.execute_ssh_command(cleanup_cmd)
+                    self.execute_ssh_command(f"rm -f {shlex.quote(script_path)}")
                 except:
                     pass
-            return {"success": False, "error": f"批量操作异常: {str(e)}"}
+            return {"success": False, "cancelled": self.task_cancelled, "error": f"批量操作异常: {str(e)}"}
+    
+    def run_async_ssh_job(self, job_func):
+        """在异步编排器中执行服务器端任务，阻塞当前工作线程直到完成或取消
+        
+        Args:
+            job_func: 接收AsyncSSHJob、返回协程的函数
+            
+        Returns:
+            协程的返回值（任务取消时抛出异常）
+        """
+        host = self.ssh_config.get("host", "")
+        return self.async_orchestrator.run(host, job_func, lambda: self.task_cancelled)
     
-    def _execute_parallel_operations(self, operations, operation_type="copy", max_workers=4):
+    def _execute_parallel_operations(self, operations, operation_type="copy", max_workers=4, progress=None):
         """并行执行SSH操作
         
+        每个操作是事件循环中的一个协程，命令在少量持久shell channel上流水线执行，
+        在途操作数由自适应控制器决定，不受线程数限制。
+        
         Args:
             operations: 操作列表
             operation_type: 操作类型
-            max_workers: 最大并行工作线程数
+            max_workers: 初始在途操作数
+            progress: 可选的TransferProgressTracker
             
         Returns:
             dict: 操作结果
         """
-        import threading
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        
         try:
             # 检查SSH连接
             ssh_client = self.get_ssh_client()
             if not ssh_client:
                 return {"success": False, "error": "无法建立SSH连接"}
             
-            # 线程安全的结果收集
-            results = []
-            results_lock = threading.Lock()
-            failed_operations = []
+            # 按主机自适应调整在途操作数，max_workers仅作为初始值
+            host = self.ssh_config.get("host", "")
+            async_max = self.transfer_config.get("adaptive_concurrency", {}).get("async_max", 256)
+            controller = self.get_concurrency_controller(f"host:{host}:async", initial=max_workers * 4,
+                                                         max_limit=async_max)
             
-            def execute_single_operation(operation):
+            async def execute_single_operation(job, operation):
                 """执行单个文件操作"""
                 source_path, target_path, file_type = operation
+                if controller:
+                    await job.acquire(controller)
+                
+                result = None
                 try:
-                    # 为每个线程获取独立的SSH客户端
-                    thread_ssh = self.get_ssh_client()
-                    if not thread_ssh:
-                        return {"success": False, "error": "线程SSH连接失败", "operation": operation}
+                    # 按目标和主机的IOPS配额限速，只有配置了限速时才需要到线程中等待
+                    target_root = os.path.dirname(os.path.dirname(target_path))
+                    limiters = [limiter for limiter in self.get_rate_limiters(target_root, host)
+                                if limiter.is_limited()]
+                    if limiters:
+                        await job.to_thread(self.throttle, limiters, 0, 1)
                     
                     # 执行操作
-                    if operation_type == "move":
-                        cmd = f"mv '{source_path}' '{target_path}'"
-                    else:
-                        cmd = f"cp '{source_path}' '{target_path}'"
-                    
-                    stdout, stderr, exit_code = self.execute_ssh_command(cmd)
+                    verb = "mv" if operation_type == "move" else "cp"
+                    cmd = f"{verb} {shlex.quote(source_path)} {shlex.quote(target_path)}"
+                    stdout, stderr, exit_code = await job.execute(cmd)
                     
                     if exit_code == 0:
-                        return {"success": True, "operation": operation}
+                        result = {"success": True, "operation": operation}
+                        if progress:
+                            progress.add(1, progress.size_of(source_path))
                     else:
-                        return {"success": False, "error": stderr, "operation": operation}
+                        result = {"success": False, "error": stderr, "operation": operation}
                         
                 except Exception as e:
-                    return {"success": False, "error": str(e), "operation": operation}
+                    result = {"success": False, "error": str(e), "operation": operation}
+                finally:
+                    if controller:
+                        controller.release(success=bool(result and result["success"]))
+                    # 被取消的在途操作在远程可能已经完成，按成功记录以便回滚时检查
+                    results.append(result or {"success": True, "operation": operation, "cancelled": True})
             
-            # 使用线程池并行执行
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 提交所有任务
-                future_to_operation = {executor.submit(execute_single_operation, op): op for op in operations}
-                
-                # 收集结果
-                for future in as_completed(future_to_operation):
-                    result = future.result()
-                    
-                    with results_lock:
-                        results.append(result)
-                        if not result["success"]:
-                            failed_operations.append(result["operation"])
+            async def run_all(job):
+                await asyncio.gather(*(execute_single_operation(job, op) for op in operations))
+            
+            # 结果在操作完成时即时记录，任务取消后已完成的移动仍可回滚
+            results = []
+            try:
+                self.run_async_ssh_job(run_all)
+            except Exception as e:
+                if operation_type == "move":
+                    self.wait_remote_abort()
+                    self._rollback_successful_moves(results)
+                return {"success": False, "cancelled": self.task_cancelled, "error": str(e),
+                        "operations_count": len(operations), "success_count": 0, "method": "parallel"}
+            
+            failed_operations = [r["operation"] for r in results if not r["success"]]
             
             # 统计结果
             success_count = sum(1 for r in results if r["success"])
@@ -2454,31 +5813,54 @@ class ImageManager:
             return {"success": False, "error": f"并行操作异常: {str(e)}"}
     
     def _rollback_successful_moves(self, results):
-        """回滚成功的移动操作"""
+        """回滚成功的移动操作
+        
+        取消时在途操作可能未执行，只回滚确实已移动的文件。全部文件在服务器上
+        一次处理：有辅助程序时作为一个请求提交，否则把 (目标, 源) 路径对以NUL分隔
+        写入列表文件，由一个shell循环逐个移回。
+        """
+        pairs = [result["operation"][:2] for result in results if result["success"] and "operation" in result]
+        if not pairs:
+            return
+        
         try:
-            for result in results:
-                if result["success"] and "operation" in result:
-                    source_path, target_path, file_type = result["operation"]
-                    # 回滚：将目标文件移回源位置
-                    rollback_cmd = f"mv '{target_path}' '{source_path}'"
-                    self.execute_ssh_command(rollback_cmd)
+            if self.ensure_remote_agent():
+                result = self.run_remote_agent([{"op": "restore", "pairs": pairs}])[0]
+                if result and result.get("ok"):
+                    for failure in result["failed"]:
+                        print(f"回滚失败: {failure}")
+                    return
+        except Exception as e:
+            print(f"辅助程序回滚失败，改用shell脚本: {e}")
+        
+        list_path = f"/tmp/image_manager_rollback_{uuid.uuid4().hex[:8]}.lst"
+        q = shlex.quote
+        try:
+            self.upload_remote_files({list_path: "".join(f"{target}\0{source}\0" for source, target in pairs)})
+            self.execute_ssh_command(
+                "while IFS= read -r -d '' target && IFS= read -r -d '' source; do "
+                "if [ -e \"$target\" ] && [ ! -e \"$source\" ]; then mv -- \"$target\" \"$source\"; fi; "
+                f"done < {q(list_path)}; rm -f {q(list_path)}")
         except Exception as e:
-             print(f"回滚操作失败: {e}")
+            print(f"回滚操作失败: {e}")
     
-    def _execute_atomic_operations(self, operations, operation_type="copy", max_workers=4):
+    def _execute_atomic_operations(self, operations, operation_type="copy", max_workers=4, progress=None):
         """原子性执行SSH操作，保证事务性和数据一致性
         
+        文件先暂存到目标目录下的隐藏事务目录（与目标同一文件系统），移动操作
+        优先使用硬链接暂存，全部暂存成功后逐个rename到最终位置；预检查、暂存、
+        提交和回滚都在同一个远程脚本中完成，整个事务只需一次命令往返。
+        
         Args:
             operations: 操作列表
             operation_type: 操作类型
             max_workers: 最大并行工作线程数
+            progress: 可选的TransferProgressTracker，暂存阶段每个文件输出一行进度
             
         Returns:
             dict: 操作结果
         """
-        import uuid
-        import time
-        
+        script_path = None
         try:
             ssh_client = self.get_ssh_client()
             if not ssh_client:
@@ -2486,142 +5868,659 @@ class ImageManager:
             
             # 生成事务ID
             transaction_id = str(uuid.uuid4())[:8]
-            temp_dir = f"/tmp/atomic_transaction_{transaction_id}"
-            
-            # 第一阶段：预检查和准备
+            script_path = f"/tmp/image_manager_txn_{transaction_id}.sh"
             print(f"开始原子性操作事务: {transaction_id}")
             
-            # 创建临时目录用于事务管理
-            create_temp_cmd = f"mkdir -p '{temp_dir}'"
-            stdout, stderr, exit_code = self.execute_ssh_command(create_temp_cmd)
-            if exit_code != 0:
-                return {"success": False, "error": f"创建事务临时目录失败: {stderr}"}
-            
-            # 预检查所有源文件是否存在
-            missing_files = []
-            for source_path, target_path, file_type in operations:
-                check_cmd = f"test -f '{source_path}'"
-                stdout, stderr, exit_code = self.execute_ssh_command(check_cmd)
-                if exit_code != 0:
-                    missing_files.append(source_path)
-            
-            if missing_files:
-                # 清理临时目录
-                self.execute_ssh_command(f"rm -rf '{temp_dir}'")
+            # 每个目标目录一个暂存目录，保证提交时的rename不跨文件系统
+            stage_dirs = {}
+            staged_operations = []
+            for i, (source_path, target_path, file_type) in enumerate(operations):
+                target_dir = posixpath.dirname(target_path)
+                if target_dir not in stage_dirs:
+                    stage_dirs[target_dir] = f"{target_dir}/.image_manager_txn_{transaction_id}"
+                staged_operations.append((source_path, f"{stage_dirs[target_dir]}/{i}", target_path))
+            
+            q = shlex.quote
+            all_stage_dirs = " ".join(q(stage_dir) for stage_dir in stage_dirs.values())
+            lines = [
+                "#!/bin/bash",
+                "set -u",
+                f"cleanup() {{ rm -rf -- {all_stage_dirs}; }}",
+                "committed_final=()",
+                "committed_backup=()",
+                "rollback() {",
+                "  local i",
+                "  for ((i=${#committed_final[@]}-1; i>=0; i--)); do",
+                "    if [ -e \"${committed_backup[$i]}\" ]; then",
+                "      mv -f -- \"${committed_backup[$i]}\" \"${committed_final[$i]}\"",
+                "    else",
+                "      rm -f -- \"${committed_final[$i]}\"",
+                "    fi",
+                "  done",
+                "}",
+                # 任务取消时整个进程组收到SIGTERM（输出channel被关闭时为SIGPIPE）：暂存阶段只需清理，提交阶段先回滚
+                "phase=check",
+                "on_signal() {",
+                "  [ \"$phase\" = commit ] && rollback",
+                f"  cleanup; rm -f -- {q(script_path)}; exit 130",
+                "}",
+                "trap on_signal TERM INT HUP PIPE",
+                "# 第一阶段：预检查所有源文件",
+                "missing=0"
+            ]
+            for source_path, _, _ in staged_operations:
+                lines.append(f"[ -f {q(source_path)} ] || {{ printf 'MISSING %s\\n' {q(source_path)} >&2; missing=1; }}")
+            lines.append("[ $missing -eq 0 ] || exit 3")
+            
+            # 第二阶段：暂存到目标文件系统（移动操作优先硬链接，不产生数据拷贝）
+            lines.append("# 第二阶段：暂存")
+            lines.append("phase=stage")
+            lines.append(f"mkdir -p -- {all_stage_dirs} || {{ cleanup; exit 4; }}")
+            for op_index, (source_path, stage_path, _) in enumerate(staged_operations):
+                if operation_type == "move":
+                    stage_cmd = f"{{ ln -- {q(source_path)} {q(stage_path)} 2>/dev/null || cp -p -- {q(source_path)} {q(stage_path)}; }}"
+                else:
+                    stage_cmd = f"cp -p -- {q(source_path)} {q(stage_path)}"
+                lines.append(f"{stage_cmd} || {{ printf 'STAGE_FAILED %s\\n' {q(source_path)} >&2; cleanup; exit 4; }}")
+                lines.append(f"echo '{TransferProgressTracker.OP_MARKER} {op_index}'")
+            
+            # 第三阶段：rename提交，已存在的目标先硬链接备份以便回滚
+            # 先登记再rename，rename之后、登记之前收到中止信号也能回滚
+            lines.append("# 第三阶段：提交")
+            lines.append("phase=commit")
+            for _, stage_path, target_path in staged_operations:
+                backup_path = f"{stage_path}.orig"
+                lines.append(
+                    f"{{ [ ! -e {q(target_path)} ] || ln -- {q(target_path)} {q(backup_path)}; }} && "
+                    f"committed_final+=({q(target_path)}) && committed_backup+=({q(backup_path)}) && "
+                    f"mv -f -- {q(stage_path)} {q(target_path)} || "
+                    f"{{ printf 'COMMIT_FAILED %s\\n' {q(target_path)} >&2; rollback; cleanup; exit 5; }}"
+                )
+            
+            # 全部提交成功后事务已完成，之后忽略中止信号，保证源文件删除完整执行
+            lines.append("trap '' TERM INT HUP PIPE")
+            if operation_type == "move":
+                lines.append("# 删除源文件")
+                for source_path, _, _ in staged_operations:
+                    lines.append(f"rm -f -- {q(source_path)}")
+            lines.append("cleanup")
+            lines.append("exit 0")
+            
+            try:
+                self.upload_remote_files({script_path: "\n".join(lines) + "\n"})
+            except Exception as e:
+                return {"success": False, "error": f"SFTP脚本上传失败: {str(e)}"}
+            
+            # 执行事务脚本并删除脚本本身，一次往返
+            run_cmd = self.cancellable_command(f"bash {q(script_path)}; rc=$?; rm -f {q(script_path)}; exit $rc")
+            on_output = progress.stream_parser([src for src, _, _ in operations]) if progress else None
+            try:
+                stdout, stderr, exit_code = self.execute_ssh_command(run_cmd, on_output=on_output)
+            except Exception:
+                if self.task_cancelled:
+                    # 脚本收到中止信号后自行回滚和清理，等待其退出
+                    script_path = None
+                    self.wait_remote_abort()
+                    return {"success": False, "cancelled": True, "error": "任务已取消（事务已回滚或已完整提交）",
+                            "transaction_id": transaction_id}
+                raise
+            script_path = None
+            
+            if exit_code == 0:
+                return {
+                    "success": True,
+                    "operations_count": len(operations),
+                    "transaction_id": transaction_id,
+                    "method": "atomic"
+                }
+            
+            if exit_code == 3:
+                missing_files = [line[len("MISSING "):] for line in stderr.splitlines() if line.startswith("MISSING ")]
                 return {
                     "success": False,
                     "error": f"源文件不存在: {', '.join(missing_files[:5])}{'...' if len(missing_files) > 5 else ''}"
                 }
-            
-            # 第二阶段：执行操作到临时位置
-            temp_operations = []
-            for i, (source_path, target_path, file_type) in enumerate(operations):
-                temp_target = f"{temp_dir}/file_{i}_{file_type}"
-                temp_operations.append((source_path, temp_target, target_path, file_type))
-            
-            # 先复制所有文件到临时位置
-            failed_temp_ops = []
-            for source_path, temp_target, final_target, file_type in temp_operations:
-                copy_cmd = f"cp '{source_path}' '{temp_target}'"
-                stdout, stderr, exit_code = self.execute_ssh_command(copy_cmd)
-                if exit_code != 0:
-                    failed_temp_ops.append((source_path, stderr))
-            
-            if failed_temp_ops:
-                # 清理临时目录
-                self.execute_ssh_command(f"rm -rf '{temp_dir}'")
+            if exit_code == 4:
                 return {
                     "success": False,
-                    "error": f"临时复制失败: {failed_temp_ops[0][1]}",
-                    "failed_count": len(failed_temp_ops)
+                    "error": f"暂存失败: {stderr.strip()}",
+                    "transaction_id": transaction_id
                 }
             
-            # 第三阶段：原子性提交
-            commit_script_path = f"{temp_dir}/commit.sh"
-            rollback_script_path = f"{temp_dir}/rollback.sh"
+            print(f"提交失败，已回滚: {stderr}")
+            return {
+                "success": False,
+                "error": f"原子性操作失败并已回滚: {stderr}",
+                "transaction_id": transaction_id,
+                "operations_count": len(operations)
+            }
+                
+        except Exception as e:
+            # 异常情况：尝试清理脚本文件
+            if script_path:
+                try:
+                    self.execute_ssh_command(f"rm -f {shlex.quote(script_path)}")
+                except:
+                    pass
+            return {"success": False, "error": f"原子性操作异常: {str(e)}"}
+    
+    def _probe_server_capabilities(self, host=None):
+        """一次命令探测服务器能力
+        
+        Args:
+            host: 探测的主机，默认为主服务器
+        
+        Returns:
+            dict: 能力字典，如 {"rsync": True, "python3": True, "reflink": False, "nproc": 8, ...}
+        """
+        share_root = self.get_host_config(host).get("share_path", "/")
+        share_path = shlex.quote(share_root)
+        probe_cmd = "; ".join([
+            'for t in rsync python3 tar inotifywait; do '
+            'if command -v "$t" >/dev/null 2>&1; then echo "$t=1"; else echo "$t=0"; fi; done',
+            'echo "rsync_version=$(rsync --version 2>/dev/null | head -n1 | awk \'{print $3}\')"',
+            'echo "nproc=$(nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1)"',
+            'echo "home=$HOME"',
+            # 在share所在文件系统上实测cp --reflink=always是否可用
+            f'p=$(mktemp -p {share_path} .image_manager_probe.XXXXXX 2>/dev/null) && '
+            '{ if cp --reflink=always "$p" "$p.r" 2>/dev/null; then echo reflink=1; else echo reflink=0; fi; '
+            'rm -f "$p" "$p.r"; } || echo reflink=0',
+            f'echo "fs_share=$(stat -f -c %T {share_path} 2>/dev/null)"',
+            'echo "fs_tmp=$(stat -f -c %T /tmp 2>/dev/null)"'
+        ])
+        stdout, stderr, exit_code = self.execute_ssh_command(probe_cmd, host=host)
+        
+        values = {}
+        for line in stdout.splitlines():
+            if "=" in line:
+                key, value = line.split("=", 1)
+                values[key.strip()] = value.strip()
+        if "rsync" not in values:
+            raise Exception(f"服务器能力探测失败: {stderr.strip()}")
+        
+        try:
+            nproc = max(1, int(values.get("nproc", "1")))
+        except ValueError:
+            nproc = 1
+        return {
+            "rsync": values.get("rsync") == "1",
+            "rsync_version": values.get("rsync_version", ""),
+            "python3": values.get("python3") == "1",
+            "tar": values.get("tar") == "1",
+            "inotifywait": values.get("inotifywait") == "1",
+            "reflink": values.get("reflink") == "1",
+            "nproc": nproc,
+            "home": values.get("home", ""),
+            "fs_types": {
+                share_root: values.get("fs_share", ""),
+                "/tmp": values.get("fs_tmp", "")
+            }
+        }
+    
+    def get_server_capabilities(self, refresh=False, host=None):
+        """获取主机的能力（按主机缓存并持久化，超过有效期才重新探测）
+        
+        Args:
+            refresh: 是否忽略缓存强制重新探测
+            host: 主机，默认为主服务器
             
-            # 构建提交脚本
-            commit_lines = ["#!/bin/bash", "set -e"]
-            rollback_lines = ["#!/bin/bash", "set -e"]
+        Returns:
+            dict: 能力字典；探测失败时返回空字典，调用方按"未知"处理
+        """
+        host = host or self.ssh_config.get("host", "")
+        with self.capability_lock:
+            if self.server_capabilities is None:
+                self.server_capabilities = {}
+                try:
+                    if os.path.exists(self.capability_cache_file):
+                        with open(self.capability_cache_file, 'r', encoding='utf-8') as f:
+                            self.server_capabilities = json.load(f)
+                except Exception as e:
+                    print(f"加载服务器能力缓存失败: {e}")
             
-            for source_path, temp_target, final_target, file_type in temp_operations:
-                # 提交：将临时文件移动到最终位置
-                commit_lines.append(f"mv '{temp_target}' '{final_target}'")
-                
-                # 回滚脚本：如果是移动操作，需要能够恢复
-                if operation_type == "move":
-                    rollback_lines.append(f"mv '{final_target}' '{source_path}'")
-                else:
-                    rollback_lines.append(f"rm -f '{final_target}'")
+            cached = self.server_capabilities.get(host)
+            if cached and not refresh and time.time() - cached.get("probed_at", 0) < self.capability_ttl:
+                return cached
+        
+        try:
+            capabilities = self._probe_server_capabilities(host)
+        except Exception as e:
+            print(f"服务器能力探测失败: {e}")
+            return {}
+        capabilities["probed_at"] = time.time()
+        
+        with self.capability_lock:
+            self.server_capabilities[host] = capabilities
+            try:
+                with open(self.capability_cache_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.server_capabilities, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                print(f"保存服务器能力缓存失败: {e}")
+        
+        self.add_operation_log(
+            f"服务器能力（{host}）: rsync={'有' if capabilities['rsync'] else '无'}, "
+            f"python3={'有' if capabilities['python3'] else '无'}, "
+            f"reflink={'支持' if capabilities['reflink'] else '不支持'}, CPU核数={capabilities['nproc']}"
+        )
+        return capabilities
+    
+    def ensure_remote_agent(self):
+        """确保服务器上已有辅助程序（按内容哈希缓存，内容不变时只上传一次）
+        
+        Returns:
+            辅助程序相对于HOME的路径；服务器没有python3时返回None
+        """
+        host = self.ssh_config.get("host", "")
+        if host in self.remote_agent_paths:
+            return self.remote_agent_paths[host]
+        
+        if not self.get_server_capabilities().get("python3", True):
+            self.remote_agent_paths[host] = None
+            return None
+        
+        agent_path = f".cache/image_manager/agent_{REMOTE_AGENT_HASH}.py"
+        check_cmd = (
+            'mkdir -p "$HOME/.cache/image_manager" && '
+            'if command -v python3 >/dev/null 2>&1; then '
+            f'test -f "$HOME/{agent_path}" && echo present || echo missing; '
+            'else echo no_python; fi; printf "%s\\n" "$HOME"'
+        )
+        stdout, stderr, exit_code = self.execute_ssh_command(check_cmd)
+        lines = stdout.strip().splitlines()
+        status = lines[0].strip() if lines else ""
+        home_dir = lines[-1].strip() if len(lines) > 1 else ""
+        
+        if status == "no_python":
+            self.remote_agent_paths[host] = None
+            return None
+        if status not in ("present", "missing"):
+            raise Exception(f"检查服务器辅助程序失败: {stderr.strip()}")
+        
+        if status == "missing":
+            # 先写临时文件再重命名，避免并发任务读到不完整的程序
+            # SFTP不展开~，使用服务器返回的HOME拼出绝对路径
+            remote_path = f"{home_dir}/{agent_path}" if home_dir else agent_path
+            self.upload_remote_files({remote_path: REMOTE_AGENT_SOURCE}, atomic=True)
+            print(f"服务器辅助程序上传成功: ~/{agent_path}")
+        
+        self.remote_agent_paths[host] = agent_path
+        return agent_path
+    
+    def remote_agent_available(self):
+        """服务器辅助程序是否可用；检查或上传失败时返回False，由调用方改用shell命令"""
+        try:
+            return self.ensure_remote_agent() is not None
+        except Exception as e:
+            print(f"服务器辅助程序不可用，改用shell命令: {e}")
+            return False
+    
+    def run_remote_agent(self, requests, on_result=None, compressed=False, retry_missing=True):
+        """向服务器辅助程序批量提交请求，并流式读取每个请求的结果
+        
+        请求以JSON行的形式写入stdin，辅助程序每完成一个请求就输出一行结果，
+        整批请求只需一个channel。
+        
+        Args:
+            requests: 请求列表，如 [{"op": "copy", "src": ..., "dst": ...}, ...]
+            on_result: 每收到一个结果时调用的回调 on_result(request, result)
+            compressed: 是否使用压缩连接（扫描、配对等返回大量文本的请求）
+            retry_missing: 辅助程序文件已被删除时，是否重新上传后再执行一次
+            
+        Returns:
+            list: 与requests顺序一致的结果列表；任务取消时未返回结果的位置为None
+        """
+        agent_path = self.ensure_remote_agent()
+        if not agent_path:
+            raise Exception("服务器上没有可用的python3，无法使用辅助程序")
+        
+        requests = [dict(request, id=i) for i, request in enumerate(requests)]
+        results = [None] * len(requests)
+        host = self.ssh_config.get("host", "")
+        started = time.time()
+        traffic = {"sent": 0, "received": 0}
+        
+        with self.get_ssh_pool(compressed).connection(host) as connection:
+            channel = connection.client.get_transport().open_session()
+            self.register_active_channel(channel)
+            channel.exec_command(self.cancellable_command(f'python3 "$HOME/{agent_path}"'))
+            
+            # 写入与读取并行进行，避免输出窗口填满后双方互相等待
+            def feed_requests():
+                try:
+                    for request in requests:
+                        # 保持默认的ASCII转义：服务器在C locale下的python3.6按ASCII解码stdin
+                        data = (json.dumps(request) + "\n").encode('utf-8')
+                        channel.sendall(data)
+                        traffic["sent"] += len(data)
+                except Exception as e:
+                    print(f"辅助程序请求写入失败: {e}")
+                finally:
+                    # 无论是否写完都要关闭输入，否则辅助程序会一直等待
+                    try:
+                        channel.shutdown_write()
+                    except Exception:
+                        pass
+            
+            writer = threading.Thread(target=feed_requests, daemon=True)
+            writer.start()
+            
+            received = 0
+            stdout_file = channel.makefile('rb')
+            for line in stdout_file:
+                traffic["received"] += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                result = json.loads(line.decode('utf-8'))
+                index = result.get("id")
+                if index is None or not (0 <= index < len(results)):
+                    continue
+                results[index] = result
+                received += 1
+                if on_result:
+                    on_result(requests[index], result)
+            
+            writer.join()
+            exit_code = channel.recv_exit_status()
+            stderr_text = channel.makefile_stderr('rb').read().decode('utf-8', errors='replace')
+            channel.close()
+            self.unregister_active_channel(channel)
+        
+        # 打开channel和执行命令各一次往返，请求和结果随后在同一channel上流式传输
+        self.ssh_stats.record("agent", time.time() - started, traffic["sent"], traffic["received"],
+                              round_trips=2, commands=len(requests))
+        
+        if received < len(requests) and self.task_cancelled:
+            # 取消时channel被关闭，返回已完成的部分，由调用方回滚
+            return results
+        if received == 0 and retry_missing and "can't open file" in stderr_text:
+            # 缓存的辅助程序已在服务器上被删除（如清理了~/.cache）：清除缓存，重新上传后再执行一次
+            print(f"服务器辅助程序已不存在，重新上传: ~/{agent_path}")
+            self.remote_agent_paths.pop(host, None)
+            return self.run_remote_agent(requests, on_result, compressed, retry_missing=False)
+        if received < len(requests):
+            raise Exception(f"辅助程序异常退出（退出码 {exit_code}，完成 {received}/{len(requests)}）: {stderr_text.strip()}")
+        
+        return results
+    
+    def execute_agent_operations(self, operations, operation_type="copy", manifest=None, progress=None):
+        """使用服务器辅助程序批量执行复制/移动，逐个返回状态并边复制边计算校验值
+        
+        Args:
+            operations: 操作列表 [(src, dst, ftype), ...]
+            operation_type: 操作类型 'copy' 或 'move'
+            manifest: 可选的TransferManifest，记录每个文件的校验值
+            progress: 可选的TransferProgressTracker，每个文件完成时更新
             
-            # 如果是移动操作，在提交脚本中删除源文件
+        Returns:
+            dict: 操作结果
+        """
+        if not operations:
+            return {"success": True, "operations_count": 0, "method": "agent"}
+        
+        algorithm = self.transfer_config.get("hash_algorithm", "blake2b")
+        requests = [
+            {"op": operation_type, "src": src, "dst": dst, "algorithm": algorithm}
+            for src, dst, ftype in operations
+        ]
+        def on_result(request, result):
+            if result.get("ok") and manifest:
+                manifest.record(request["src"], request["dst"], result.get("size"),
+                                result.get("hash"), result.get("duration", 0))
+            if progress:
+                progress.add(1, result.get("size") or 0)
+        
+        try:
+            results = self.run_remote_agent(requests, on_result)
+        except Exception as e:
+            return {"success": False, "error": f"辅助程序执行异常: {str(e)}"}
+        
+        if None in results:
+            # 任务已取消：辅助程序按顺序处理请求，第一个没有结果的请求可能已在服务器上完成
+            done_count = results.index(None)
             if operation_type == "move":
-                for source_path, temp_target, final_target, file_type in temp_operations:
-                    commit_lines.append(f"rm -f '{source_path}'")
-            
-            # 使用SFTP上传脚本，避免参数列表过长问题
-            commit_content = "\n".join(commit_lines)
-            rollback_content = "\n".join(rollback_lines)
-            
+                self.wait_remote_abort()
+                self._rollback_successful_moves(
+                    [{"success": True, "operation": operations[i]}
+                     for i in range(min(done_count + 1, len(operations)))
+                     if results[i] is None or results[i].get("ok")])
+            return {"success": False, "cancelled": True, "error": "任务已取消",
+                    "operations_count": len(requests),
+                    "success_count": sum(1 for result in results if result and result.get("ok")), "method": "agent"}
+        
+        failed = [(request, result) for request, result in zip(requests, results) if not result.get("ok")]
+        success_count = len(requests) - len(failed)
+        
+        if not failed:
+            return {"success": True, "operations_count": success_count, "method": "agent"}
+        
+        # 移动操作部分失败时，将已成功的文件移回原位置
+        if operation_type == "move" and success_count > 0:
+            rollback_requests = [
+                {"op": "move", "src": request["dst"], "dst": request["src"], "algorithm": algorithm}
+                for request, result in zip(requests, results) if result.get("ok")
+            ]
             try:
-                sftp = ssh_client.open_sftp()
-                
-                # 上传提交脚本
-                with sftp.open(commit_script_path, 'w') as f:
-                    f.write(commit_content)
-                
-                # 上传回滚脚本
-                with sftp.open(rollback_script_path, 'w') as f:
-                    f.write(rollback_content)
-                
-                sftp.close()
-                print(f"原子性操作脚本上传成功: {commit_script_path}")
-                
+                self.run_remote_agent(rollback_requests)
             except Exception as e:
-                self.execute_ssh_command(f"rm -rf '{temp_dir}'")
-                return {"success": False, "error": f"SFTP脚本上传失败: {str(e)}"}
-            
-            # 设置脚本权限
-            chmod_cmd = f"chmod +x '{commit_script_path}' '{rollback_script_path}'"
-            self.execute_ssh_command(chmod_cmd)
+                print(f"回滚操作失败: {e}")
+        
+        first_request, first_result = failed[0]
+        return {
+            "success": False,
+            "error": f"辅助程序操作部分失败，成功: {success_count}/{len(requests)}，"
+                     f"首个错误: {os.path.basename(first_request['src'])} - {first_result.get('error')}",
+            "operations_count": len(requests),
+            "success_count": success_count,
+            "failed_destinations": [request["dst"] for request, _ in failed],
+            "method": "agent"
+        }
+    
+    def plan_server_fanout(self, operations):
+        """将多目标复制拆分为"每个源文件一次真实复制"和"从第一份副本派生"两部分
+        
+        Args:
+            operations: 复制操作列表 [(src, dst, ftype), ...]
             
-            # 执行提交
-            commit_cmd = f"bash '{commit_script_path}'"
-            stdout, stderr, exit_code = self.execute_ssh_command(commit_cmd)
+        Returns:
+            tuple: (primary_operations, fanout_operations)，fanout_operations中的源是第一份副本
+        """
+        first_copies = {}
+        primary_operations = []
+        fanout_operations = []
+        for src, dst, ftype in operations:
+            if src in first_copies:
+                fanout_operations.append((first_copies[src], dst, ftype))
+            else:
+                first_copies[src] = dst
+                primary_operations.append((src, dst, ftype))
+        return primary_operations, fanout_operations
+    
+    def execute_fanout_operations(self, operations, manifest=None, progress=None):
+        """在服务器上从第一份副本派生其余目标（不再读取原始源文件）
+        
+        同一文件系统内：图片优先硬链接（可配置），否则在支持时使用cp --reflink；
+        跨文件系统时从第一份副本本地复制（副本刚写入，通常仍在页缓存中）。
+        
+        Args:
+            operations: 派生操作列表 [(第一份副本, dst, ftype), ...]
+            manifest: 可选的TransferManifest，派生文件沿用第一份副本的校验值
+            progress: 可选的TransferProgressTracker
             
-            if exit_code == 0:
-                # 成功：清理临时目录
-                self.execute_ssh_command(f"rm -rf '{temp_dir}'")
-                return {
-                    "success": True,
-                    "operations_count": len(operations),
-                    "transaction_id": transaction_id,
-                    "method": "atomic"
-                }
+        Returns:
+            dict: 操作结果
+        """
+        if not operations:
+            return {"success": True, "operations_count": 0, "method": "fanout"}
+        
+        q = shlex.quote
+        try:
+            # 一次stat取得所有相关目录的设备号，判断是否在同一文件系统
+            directories = sorted({posixpath.dirname(path) for src, dst, _ in operations for path in (src, dst)})
+            stdout, stderr, exit_code = self.execute_ssh_command(
+                "stat -c '%d %n' -- " + " ".join(q(directory) for directory in directories))
+            # 按输出中的路径对应，个别目录stat失败时不影响其他目录
+            devices = {}
+            for line in stdout.splitlines():
+                device, _, directory = line.partition(" ")
+                if device.isdigit():
+                    devices[directory] = device
+            
+            reflink = self.get_server_capabilities().get("reflink", False)
+            hardlink_images = self.transfer_config.get("fanout_hardlink_images", True)
+            
+            script_path = f"/tmp/image_manager_fanout_{uuid.uuid4().hex[:8]}.sh"
+            # 任务取消时删除正在派生的目标（第一份副本不受影响）
+            lines = ["#!/bin/bash", "failed=0", "cur=",
+                     f"trap 'rm -f -- \"$cur\" {q(script_path)}; exit 130' TERM INT HUP PIPE"]
+            for op_index, (src, dst, ftype) in enumerate(operations):
+                same_fs = devices.get(posixpath.dirname(src)) is not None and \
+                    devices.get(posixpath.dirname(src)) == devices.get(posixpath.dirname(dst))
+                if same_fs and hardlink_images and ftype == "image":
+                    # 硬链接数达到上限（EMLINK）或文件系统不支持硬链接时改为复制
+                    derive = (f"{{ [ {q(src)} -ef {q(dst)} ] || ln -f -- {q(src)} {q(dst)} 2>/dev/null || "
+                              f"cp -p -- {q(src)} {q(dst)}; }}")
+                elif same_fs and reflink:
+                    derive = f"cp --reflink=always -p -- {q(src)} {q(dst)}"
+                else:
+                    derive = f"cp -p -- {q(src)} {q(dst)}"
+                # 第一份副本不存在（复制失败）时不派生
+                lines.append(f"cur={q(dst)}; [ -f {q(src)} ] && {derive} && "
+                             f"echo '{TransferProgressTracker.OP_MARKER} {op_index}' || "
+                             f"{{ printf 'FAILED %s\\n' {q(dst)} >&2; failed=1; }}")
+            lines.append("exit $failed")
+            
+            self.upload_remote_files({script_path: "\n".join(lines) + "\n"})
+            run_cmd = self.cancellable_command(f"bash {q(script_path)}; rc=$?; rm -f {q(script_path)}; exit $rc")
+            on_output = progress.stream_parser([src for src, _, _ in operations]) if progress else None
+            stdout, stderr, exit_code = self.execute_ssh_command(run_cmd, on_output=on_output)
+        except Exception as e:
+            return {"success": False, "error": f"派生副本异常: {str(e)}"}
+        
+        failed = [line[len("FAILED "):] for line in stderr.splitlines() if line.startswith("FAILED ")]
+        if manifest:
+            failed_set = set(failed)
+            for src, dst, _ in operations:
+                recorded = manifest.lookup(src)
+                if dst not in failed_set and recorded:
+                    manifest.record(src, dst, recorded[0], recorded[1], 0)
+        
+        if exit_code == 0:
+            return {"success": True, "operations_count": len(operations), "method": "fanout"}
+        return {
+            "success": False,
+            "error": f"派生副本部分失败，成功: {len(operations) - len(failed)}/{len(operations)}，"
+                     f"首个失败: {failed[0] if failed else stderr.strip()}",
+            "operations_count": len(operations),
+            "success_count": len(operations) - len(failed),
+            "method": "fanout"
+        }
+    
+    def plan_tar_pipe(self, operations, source_sizes=None):
+        """挑出适合在服务器端以tar流传输的复制操作
+        
+        按 (源目录, 目标目录) 分组，文件数足够多且平均很小的组整组打包；大小未知的文件
+        （标签文件不在扫描索引中）按小文件处理。
+        
+        Args:
+            operations: 复制操作列表 [(src, dst, ftype), ...]
+            source_sizes: {源文件路径: 字节数}
+        
+        Returns:
+            tuple: (tar_groups, remaining_operations)，tar_groups为 [(源目录, 目标目录, 组内操作), ...]
+        """
+        options = self.transfer_config.get("tar_pipe", {})
+        if not operations or not options.get("enabled", True) or not self.get_server_capabilities().get("tar"):
+            return [], operations
+        
+        source_sizes = source_sizes or {}
+        groups = {}
+        remaining = []
+        for src, dst, ftype in operations:
+            # tar保留文件名，改名的操作不能打包
+            if posixpath.basename(src) != posixpath.basename(dst):
+                remaining.append((src, dst, ftype))
+                continue
+            groups.setdefault((posixpath.dirname(src), posixpath.dirname(dst)), []).append((src, dst, ftype))
+        
+        min_files = options.get("min_files", 32)
+        max_avg_size = options.get("max_avg_size", 256 * 1024)
+        tar_groups = []
+        for (src_dir, dst_dir), group in groups.items():
+            total_size = sum(source_sizes.get(src, 0) for src, _, _ in group)
+            if len(group) >= min_files and total_size <= max_avg_size * len(group):
+                tar_groups.append((src_dir, dst_dir, group))
             else:
-                # 失败：执行回滚
-                print(f"提交失败，执行回滚: {stderr}")
-                rollback_cmd = f"bash '{rollback_script_path}'"
-                self.execute_ssh_command(rollback_cmd)
-                
-                # 清理临时目录
-                self.execute_ssh_command(f"rm -rf '{temp_dir}'")
-                
-                return {
-                    "success": False,
-                    "error": f"原子性操作失败并已回滚: {stderr}",
-                    "transaction_id": transaction_id,
-                    "operations_count": len(operations)
-                }
-                
+                remaining.extend(group)
+        return tar_groups, remaining
+    
+    def execute_tar_pipe_operations(self, tar_groups, progress=None):
+        """在服务器上以 tar -c | tar -x 管道整组复制小文件，每组一个顺序数据流
+        
+        文件名列表由内置printf经管道传给tar，不受参数长度限制；解包端的文件名输出
+        换算为进度标记。任务取消时删除正在解包的文件。
+        
+        Args:
+            tar_groups: plan_tar_pipe返回的分组 [(源目录, 目标目录, 组内操作), ...]
+            progress: 可选的TransferProgressTracker
+        
+        Returns:
+            dict: 操作结果；failed_operations为失败组的操作，可交给其他方式重试
+        """
+        if not tar_groups:
+            return {"success": True, "operations_count": 0, "failed_operations": [], "method": "tar"}
+        
+        q = shlex.quote
+        marker = TransferProgressTracker.OP_MARKER
+        script_path = f"/tmp/image_manager_tar_{uuid.uuid4().hex[:8]}.sh"
+        # lastpipe让读取文件名的循环在当前shell中执行，trap能看到正在解包的文件
+        lines = ["#!/bin/bash", "shopt -s lastpipe", "set -o pipefail", "failed=0", "cur=",
+                 f"trap 'rm -f -- \"$cur\" {q(script_path)}; exit 130' TERM INT HUP PIPE"]
+        sources = []
+        for group_index, (src_dir, dst_dir, group) in enumerate(tar_groups):
+            names = " ".join(q(posixpath.basename(src)) for src, _, _ in group)
+            lines.append(
+                f"i={len(sources)}; cur=\n"
+                f"if mkdir -p -- {q(dst_dir)} && printf '%s\\0' {names} | "
+                f"tar -C {q(src_dir)} --null --no-recursion -T - -cf - | "
+                f"tar -C {q(dst_dir)} --quoting-style=literal -xvf - | "
+                f"while IFS= read -r n; do [ -n \"$cur\" ] && echo '{marker}' $i && i=$((i+1)); cur={q(dst_dir)}/$n; done; "
+                f"then [ -n \"$cur\" ] && echo '{marker}' $i; "
+                f"else echo 'FAILED {group_index}' >&2; failed=1; fi; cur=")
+            sources.extend(src for src, _, _ in group)
+        lines.append("exit $failed")
+        
+        try:
+            self.upload_remote_files({script_path: "\n".join(lines) + "\n"})
+            run_cmd = self.cancellable_command(f"bash {q(script_path)}; rc=$?; rm -f {q(script_path)}; exit $rc")
+            on_output = progress.stream_parser(sources) if progress else None
+            stdout, stderr, exit_code = self.execute_ssh_command(run_cmd, on_output=on_output)
         except Exception as e:
-            # 异常情况：尝试清理
-            try:
-                if 'temp_dir' in locals():
-                    self.execute_ssh_command(f"rm -rf '{temp_dir}'")
-            except:
-                pass
-            return {"success": False, "error": f"原子性操作异常: {str(e)}"}
+            return {
+                "success": False,
+                "cancelled": self.task_cancelled,
+                "error": f"tar流复制异常: {str(e)}",
+                "operations_count": 0,
+                "failed_operations": [op for _, _, group in tar_groups for op in group],
+                "method": "tar"
+            }
+        
+        failed_indexes = {int(line.split()[1]) for line in stderr.splitlines()
+                          if line.startswith("FAILED ") and line.split()[1].isdigit()}
+        if exit_code != 0 and not failed_indexes:
+            failed_indexes = set(range(len(tar_groups)))
+        failed_operations = [op for index in sorted(failed_indexes) for op in tar_groups[index][2]]
+        operations_count = len(sources) - len(failed_operations)
+        if not failed_operations:
+            return {"success": True, "operations_count": operations_count, "failed_operations": [], "method": "tar"}
+        errors = [line for line in stderr.splitlines() if line.strip() and not line.startswith("FAILED ")]
+        return {
+            "success": False,
+            "error": f"tar流复制失败 {len(failed_indexes)}/{len(tar_groups)} 组: {errors[0] if errors else stderr.strip()}",
+            "operations_count": operations_count,
+            "failed_operations": failed_operations,
+            "method": "tar"
+        }
     
     def execute_rsync_operation(self, source_files, target_dir, operation_type="copy"):
         """使用rsync进行批量文件操作
@@ -2639,35 +6538,17 @@ class ImageManager:
             if not ssh_client:
                 return {"success": False, "error": "无法建立SSH连接"}
             
-            # 检查rsync是否可用，使用多种方式检查
-            # 首先尝试 command -v（POSIX标准）
-            check_cmd = "command -v rsync"
-            stdout, stderr, exit_code = self.execute_ssh_command(check_cmd)
-            
-            if exit_code != 0:
-                # 如果 command -v 失败，尝试 which
-                check_cmd = "which rsync"
-                stdout, stderr, exit_code = self.execute_ssh_command(check_cmd)
-                
-                if exit_code != 0:
-                    # 如果 which 也失败，尝试直接执行 rsync --version
-                    check_cmd = "rsync --version"
-                    stdout, stderr, exit_code = self.execute_ssh_command(check_cmd)
-                    
-                    if exit_code != 0:
-                        return {"success": False, "error": f"服务器上未安装rsync或rsync不可用: {stderr.strip()}"}
-            
-            self.add_operation_log(f"rsync检查成功: {stdout.strip()}")
+            # 使用缓存的服务器能力判断rsync是否可用，不再每次探测
+            capabilities = self.get_server_capabilities()
+            if not capabilities.get("rsync", True):
+                return {"success": False, "error": "服务器上未安装rsync"}
             
             # 使用SFTP创建临时文件列表，避免参数列表过长问题
             file_list_path = f"/tmp/rsync_files_{int(time.time())}.txt"
             file_list_content = "\n".join(source_files)
             
             try:
-                sftp = ssh_client.open_sftp()
-                with sftp.open(file_list_path, 'w') as f:
-                    f.write(file_list_content)
-                sftp.close()
+                self.upload_remote_files({file_list_path: file_list_content})
                 self.add_operation_log(f"rsync文件列表上传成功: {file_list_path}")
             except Exception as e:
                 return {"success": False, "error": f"SFTP文件列表上传失败: {str(e)}"}
@@ -2676,6 +6557,7 @@ class ImageManager:
             rsync_options = "-av --files-from='{}'".format(file_list_path)
             if operation_type == "move":
                 rsync_options += " --remove-source-files"
+            rsync_options += self.get_rsync_bwlimit_option(os.path.dirname(target_dir.rstrip('/')))
             
             # 执行rsync操作
             rsync_cmd = f"rsync {rsync_options} / '{target_dir}'"
@@ -2701,12 +6583,56 @@ class ImageManager:
         except Exception as e:
             return {"success": False, "error": f"rsync操作异常: {str(e)}"}
     
-    def execute_rsync_batch_operations(self, operations, operation_type="copy"):
+    def plan_rsync_shards(self, target_groups, source_sizes, nproc):
+        """把文件很多的目标目录拆成若干按字节数均衡的分片
+        
+        分片数 K = min(文件数 / min_files_per_shard, max_shards, 服务器CPU核数)；文件按大小
+        从大到小依次分给当前字节数（其次文件数）最少的分片，分片内保持原有顺序。
+        
+        Args:
+            target_groups: {目标目录: [(src, dst, ftype), ...]}
+            source_sizes: {源文件路径: 字节数}，来自扫描索引，未知时按0计
+            nproc: 服务器CPU核数
+        
+        Returns:
+            list: [(目标目录, 分片序号, 分片数, 分片内操作), ...]
+        """
+        options = self.transfer_config.get("rsync_shards", {})
+        min_files = max(1, options.get("min_files_per_shard", 500))
+        max_shards = max(1, min(options.get("max_shards", 8), nproc))
+        
+        shards = []
+        for target_dir, group_operations in target_groups.items():
+            shard_count = min(len(group_operations) // min_files, max_shards) if options.get("enabled", True) else 1
+            if shard_count <= 1:
+                shards.append((target_dir, 0, 1, group_operations))
+                continue
+            
+            loads = [(0, 0, index) for index in range(shard_count)]  # (字节数, 文件数, 分片序号)
+            assignment = {}
+            by_size = sorted(range(len(group_operations)),
+                             key=lambda i: source_sizes.get(group_operations[i][0], 0), reverse=True)
+            for op_index in by_size:
+                size, count, shard_index = heapq.heappop(loads)
+                assignment[op_index] = shard_index
+                heapq.heappush(loads, (size + source_sizes.get(group_operations[op_index][0], 0), count + 1, shard_index))
+            
+            shard_operations = [[] for _ in range(shard_count)]
+            for op_index, operation in enumerate(group_operations):
+                shard_operations[assignment[op_index]].append(operation)
+            shards.extend((target_dir, index, shard_count, ops) for index, ops in enumerate(shard_operations))
+        return shards
+    
+    def execute_rsync_batch_operations(self, operations, operation_type="copy", progress=None, source_sizes=None):
         """使用rsync执行批量文件操作（高性能优化版）
         
+        每个目标目录至少一个rsync进程，文件很多的目录再拆成按字节数均衡的分片并发执行。
+        
         Args:
             operations: 操作列表 [(src, dst, ftype), ...]
             operation_type: 操作类型 (copy/move)
+            progress: 可选的TransferProgressTracker，rsync每传完一个文件输出一行进度
+            source_sizes: {源文件路径: 字节数}，用于均衡分片；默认使用progress中的大小
             
         Returns:
             dict: 操作结果
@@ -2716,14 +6642,10 @@ class ImageManager:
             if not ssh_client:
                 return {"success": False, "error": "无法建立SSH连接"}
             
-            # 检查rsync是否可用
-            check_cmd = "command -v rsync || which rsync || rsync --version"
-            stdout, stderr, exit_code = self.execute_ssh_command(check_cmd)
-            
-            if exit_code != 0:
-                return {"success": False, "error": f"服务器上未安装rsync或rsync不可用: {stderr.strip()}"}
-            
-            self.add_operation_log("rsync检查成功")
+            # 使用缓存的服务器能力判断rsync是否可用，不再每次探测
+            capabilities = self.get_server_capabilities()
+            if not capabilities.get("rsync", True):
+                return {"success": False, "error": "服务器上未安装rsync"}
             
             # 按目标目录分组操作
             target_groups = {}
@@ -2733,49 +6655,74 @@ class ImageManager:
                     target_groups[target_dir] = []
                 target_groups[target_dir].append((src, dst, ftype))
             
-            # 并行处理多个目标目录
-            import threading
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-            
             total_files = 0
             failed_dirs = []
             
-            def process_target_dir(target_dir, group_operations):
-                """处理单个目标目录的rsync操作"""
+            # 大目录拆成按字节数均衡的分片，分片数取决于服务器CPU核数
+            if source_sizes is None:
+                source_sizes = progress.source_sizes if progress else {}
+            nproc = capabilities.get("nproc", 4)
+            shards = self.plan_rsync_shards(target_groups, source_sizes, nproc)
+            
+            # 按主机自适应调整并发rsync进程数
+            host = self.ssh_config.get("host", "")
+            # 初始并发不超过4和服务器CPU核数
+            initial_workers = min(4, nproc, len(shards))
+            controller = self.get_concurrency_controller(f"host:{host}:rsync", initial=initial_workers)
+            # 带宽限额按可能同时运行的rsync进程数（分片数，受控制器上限约束）平分
+            rsync_concurrency = min(len(shards), controller.max_limit) if controller else len(shards)
+            
+            # 每个分片的源文件列表写入服务器上的列表文件（NUL分隔），全部分片一次SFTP上传；
+            # 列表放在命令行中会受单个参数128KiB的限制（cancellable_command把整条命令作为一个参数）
+            list_paths = [f"/tmp/image_manager_rsync_{uuid.uuid4().hex[:8]}.lst" for _ in shards]
+            try:
+                self.upload_remote_files({
+                    list_path: "".join(f"{src}\0" for src, dst, ftype in group_operations)
+                    for list_path, (_, _, _, group_operations) in zip(list_paths, shards)
+                })
+            except Exception as e:
+                return {"success": False, "error": f"rsync文件列表上传失败: {str(e)}"}
+            
+            async def process_target_dir(job, target_dir, shard_index, shard_count, group_operations, list_path):
+                """处理单个目标目录（或其中一个分片）的rsync操作"""
+                if controller:
+                    await job.acquire(controller)
+                
+                result = None
+                try:
+                    result = await process_target_dir_inner(job, target_dir, group_operations, list_path)
+                    if shard_count > 1:
+                        result["target_dir"] = f"{target_dir} [分片 {shard_index + 1}/{shard_count}]"
+                    return result
+                finally:
+                    if controller:
+                        controller.release(success=bool(result and result["success"]),
+                                           files=len(group_operations))
+            
+            async def process_target_dir_inner(job, target_dir, group_operations, list_path):
+                """执行单个目标目录的rsync"""
                 try:
-                    # 确保目标目录存在
-                    mkdir_cmd = f"mkdir -p '{target_dir}'"
-                    self.execute_ssh_command(mkdir_cmd)
-                    
-                    # 使用更高效的rsync方式：直接构建源文件列表
-                    source_files = [src for src, dst, ftype in group_operations]
-                    
-                    # 创建临时文件列表（只包含源文件路径）
-                    timestamp = int(time.time())
-                    dir_hash = hash(target_dir) % 10000
-                    file_list = f"/tmp/rsync_files_{timestamp}_{dir_hash}.txt"
-                    
-                    # 上传文件列表
-                    sftp = ssh_client.open_sftp()
-                    with sftp.open(file_list, 'w') as f:
-                        f.write("\n".join(source_files))
-                    sftp.close()
-                    
                     # 使用高性能rsync参数：
                     # -a: 归档模式（保持权限、时间戳等）
                     # -v: 详细输出
-                    # --files-from: 从文件读取源文件列表
+                    # --files-from --from0: 从上传的列表文件读取NUL分隔的源文件列表
                     # --no-relative: 不保持相对路径结构
-                    # --progress: 显示进度（可选）
                     # -W: 整文件传输（对于局域网更快）
-                    # --inplace: 就地更新（减少磁盘I/O）
-                    rsync_cmd = f"rsync -avW --inplace --files-from='{file_list}' / '{target_dir}/'"
+                    # --out-format: 每传完一个文件输出一行（含字节数），用于实时进度
+                    # 不使用--inplace：rsync先写临时文件再rename，被中止时自行删除临时文件，不留下不完整的目标
+                    bwlimit = self.get_rsync_bwlimit_option(os.path.dirname(target_dir.rstrip('/')), rsync_concurrency)
+                    out_format = f"--out-format='{TransferProgressTracker.FILE_MARKER} %l %n'"
+                    quoted_list = shlex.quote(list_path)
+                    # 只有rsync本身在可中止的进程组中执行；无论结果如何都删除列表文件
+                    rsync_cmd = (
+                        f"mkdir -p {shlex.quote(target_dir)} && " +
+                        self.cancellable_command(
+                            f"rsync -avW --no-relative --from0{bwlimit} {out_format} "
+                            f"--files-from={quoted_list} / {shlex.quote(target_dir + '/')}") +
+                        f"; rc=$?; rm -f {quoted_list}; exit $rc")
                     
-                    stdout, stderr, exit_code = self.execute_ssh_command(rsync_cmd)
-                    
-                    # 清理临时文件
-                    cleanup_cmd = f"rm -f '{file_list}'"
-                    self.execute_ssh_command(cleanup_cmd)
+                    on_output = progress.stream_parser() if progress else None
+                    stdout, stderr, exit_code = await job.execute(rsync_cmd, timeout=3600, on_output=on_output)
                     
                     if exit_code == 0:
                         self.add_operation_log(f"rsync完成目标目录 {target_dir}: {len(group_operations)} 个文件")
@@ -2786,26 +6733,32 @@ class ImageManager:
                 except Exception as e:
                     return {"success": False, "error": str(e), "target_dir": target_dir, "files_count": len(group_operations)}
             
-            # 使用线程池并行处理目标目录（最多4个并发）
-            max_workers = min(4, len(target_groups))
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 提交所有任务
-                future_to_dir = {
-                    executor.submit(process_target_dir, target_dir, group_operations): target_dir
-                    for target_dir, group_operations in target_groups.items()
-                }
-                
-                # 收集结果
-                for future in as_completed(future_to_dir):
-                    result = future.result()
-                    if result["success"]:
-                        total_files += result["files_count"]
-                    else:
-                        failed_dirs.append(f"{result['target_dir']}: {result['error']}")
+            async def run_all(job):
+                return await asyncio.gather(*(
+                    process_target_dir(job, target_dir, shard_index, shard_count, group_operations, list_path)
+                    for (target_dir, shard_index, shard_count, group_operations), list_path in zip(shards, list_paths)
+                ))
+            
+            # 各目标目录（分片）的rsync以协程并发执行，进度汇总到同一个跟踪器，实际并发数由自适应控制器决定
+            try:
+                results = self.run_async_ssh_job(run_all)
+            except Exception:
+                # 任务被取消时未执行的分片不会删除自己的列表文件
+                try:
+                    self.execute_ssh_command("rm -f " + " ".join(shlex.quote(path) for path in list_paths))
+                except Exception as e:
+                    print(f"清理rsync文件列表失败: {e}")
+                raise
+            for result in results:
+                if result["success"]:
+                    total_files += result["files_count"]
+                else:
+                    failed_dirs.append(f"{result['target_dir']}: {result['error']}")
             
             if failed_dirs:
                 return {
                     "success": False,
+                    "cancelled": self.task_cancelled,
                     "error": f"部分目录rsync失败: {'; '.join(failed_dirs)}",
                     "files_count": total_files
                 }
@@ -2813,66 +6766,419 @@ class ImageManager:
             return {
                 "success": True,
                 "files_count": total_files,
-                "stdout": f"rsync并行批量操作完成，共处理 {total_files} 个文件到 {len(target_groups)} 个目录"
+                "stdout": f"rsync并行批量操作完成，共处理 {total_files} 个文件到 {len(target_groups)} 个目录（{len(shards)} 个分片）"
             }
                 
         except Exception as e:
             return {"success": False, "error": f"rsync批量操作异常: {str(e)}"}
     
+    def start_remote_command(self, command, host=None, on_output=None):
+        """在指定主机上以独立channel启动可中止的命令，调用方可以写入stdin
+        
+        Args:
+            command: shell命令（经cancellable_command包装，任务取消时被中止）
+            host: 执行命令的主机，默认为主服务器
+            on_output: 可选的stdout流式回调 on_output(text)
+        
+        Returns:
+            RemoteCommand: 调用方必须调用wait()结束命令并归还连接
+        """
+        host = host or self.ssh_config.get("host", "")
+        connection = self.ssh_pool.checkout(host)
+        channel = None
+        try:
+            channel = connection.client.get_transport().open_session()
+            self.register_active_channel(channel)
+            channel.exec_command(self.cancellable_command(command))
+        except Exception as e:
+            if channel is not None:
+                self.unregister_active_channel(channel)
+            self.ssh_pool.checkin(connection, broken=self._is_connection_error(e))
+            raise
+        
+        def on_close(closed_channel):
+            self.unregister_active_channel(closed_channel)
+            self.ssh_pool.checkin(connection)
+        
+        return RemoteCommand(channel, on_output, on_close)
+    
+    def _direct_ssh_target(self, dst_host):
+        """主服务器登录目标服务器使用的ssh命令和登录名（rsync、ssh方式）
+        
+        Returns:
+            tuple: (ssh命令, "用户@地址")
+        """
+        host_config = self.get_host_config(dst_host)
+        address = host_config.get("direct_address") or dst_host
+        user = host_config.get("direct_user") or host_config.get("username", "")
+        ssh_command = (f"ssh -o BatchMode=yes -o ConnectTimeout=10 -o StrictHostKeyChecking=accept-new "
+                       f"-p {int(host_config.get('port', 22) or 22)}")
+        return ssh_command, f"{user}@{address}"
+    
+    def get_direct_transfer_method(self, dst_host, refresh=False):
+        """主服务器向另一台服务器直接传输文件的方式（按主机缓存，有效期与服务器能力相同）
+        
+        按direct_transfer.methods的顺序选用第一个可用的方式：rsync、ssh要求两端都有对应工具，
+        并且主服务器能以密钥免密登录目标服务器（以BatchMode实测）；tcp要求两端都有python3和tar。
+        
+        Args:
+            dst_host: ssh_config.hosts中的主机
+            refresh: 是否忽略缓存重新探测
+        
+        Returns:
+            str: "rsync"、"ssh"或"tcp"；都不可用时返回None，目标改由客户端处理
+        """
+        options = self.transfer_config.get("direct_transfer", {})
+        if not options.get("enabled", True) or dst_host not in self.ssh_config.get("hosts", {}):
+            return None
+        with self.direct_transfer_lock:
+            cached = self.direct_transfer_methods.get(dst_host)
+            if cached and not refresh and time.time() - cached[1] < self.capability_ttl:
+                return cached[0]
+        
+        source = self.get_server_capabilities()
+        target = self.get_server_capabilities(host=dst_host)
+        if not source or not target:
+            # 探测失败不缓存，下次任务重新探测
+            return None
+        
+        method = None
+        key_login = None
+        for candidate in options.get("methods", ["rsync", "ssh", "tcp"]):
+            if candidate == "tcp":
+                usable = all(capabilities.get("python3") and capabilities.get("tar") for capabilities in (source, target))
+            elif candidate in ("rsync", "ssh"):
+                tool = "rsync" if candidate == "rsync" else "tar"
+                usable = source.get(tool) and target.get(tool)
+                if usable and key_login is None:
+                    ssh_command, login = self._direct_ssh_target(dst_host)
+                    try:
+                        _, _, exit_code = self.execute_ssh_command(f"{ssh_command} {shlex.quote(login)} true",
+                                                                   retry_count=0)
+                        key_login = exit_code == 0
+                    except Exception as e:
+                        print(f"测试服务器之间免密登录失败: {e}")
+                        key_login = False
+                usable = usable and key_login
+            else:
+                usable = False
+            if usable:
+                method = candidate
+                break
+        
+        with self.direct_transfer_lock:
+            self.direct_transfer_methods[dst_host] = (method, time.time())
+        self.add_operation_log(f"服务器之间直接传输 {self.ssh_config.get('host', '')} -> {dst_host}: "
+                               f"{method or '不可用，改由客户端传输'}")
+        return method
+    
+    def _direct_extract_script(self, dst_dir, receive_command):
+        """目标服务器上的解包脚本：receive_command输出的tar流解包到dst_dir，每个文件输出一个进度标记
+        
+        先解包到目标目录下的临时目录，数据流完整结束后才整组改名到目标目录；被中止或数据流
+        不完整时删除临时目录，目标目录中不会出现不完整的文件。
+        """
+        q = shlex.quote
+        marker = TransferProgressTracker.OP_MARKER
+        stage = f"{dst_dir.rstrip('/')}/.image_manager_{uuid.uuid4().hex[:8]}"
+        return (
+            f"shopt -s lastpipe; set -o pipefail; i=0; stage={q(stage)}\n"
+            "trap 'rm -rf -- \"$stage\"; exit 130' TERM INT HUP PIPE\n"
+            'mkdir -p -- "$stage" && cd -- "$stage" || exit 1\n'
+            f"if {receive_command} | tar --quoting-style=literal -xvf - | "
+            f"while IFS= read -r n; do echo '{marker}' $i; i=$((i+1)); done\n"
+            "then find . -mindepth 1 -maxdepth 1 -exec mv -f -t .. -- {} +; rc=$?\n"
+            "else rc=1; fi\n"
+            'cd .. && rm -rf -- "$stage"; exit $rc\n'
+        )
+    
+    def _direct_transfer_group(self, method, dst_host, src_dir, dst_dir, group, operation_type, progress):
+        """把主服务器上同一目录的一组文件推送到目标服务器的同一目录
+        
+        Returns:
+            str: 失败原因；成功时返回None
+        """
+        q = shlex.quote
+        # 错误信息只取stderr的第一行（tar等工具会逐个文件重复报错）
+        first_line = lambda text: next((line.strip() for line in text.splitlines() if line.strip()), "")
+        names = b"".join(posixpath.basename(src).encode('utf-8') + b"\0" for src, _, _ in group)
+        on_output = progress.stream_parser([src for src, _, _ in group]) if progress else None
+        started = time.time()
+        receiver = None
+        token_line = b""
+        
+        if method == "rsync":
+            ssh_command, login = self._direct_ssh_target(dst_host)
+            remove = " --remove-source-files" if operation_type == "move" else ""
+            command = (f"cd -- {q(src_dir)} && rsync -a -s --from0 --files-from=- "
+                       f"--out-format='{TransferProgressTracker.FILE_MARKER} %l %n'{remove} -e {q(ssh_command)} "
+                       f"--rsync-path={q(f'mkdir -p -- {q(dst_dir)} && rsync')} ./ {q(f'{login}:{dst_dir}/')}")
+        elif method == "ssh":
+            ssh_command, login = self._direct_ssh_target(dst_host)
+            extract = "bash -c " + q(self._direct_extract_script(dst_dir, "cat"))
+            command = (f"set -o pipefail; cd -- {q(src_dir)} && tar --null --no-recursion -T - -cf - | "
+                       f"{ssh_command} {q(login)} {q(extract)}")
+        else:
+            # tcp：先在目标服务器上启动接收端，取得端口号后再启动源服务器上的发送端
+            # 令牌作为stdin的第一行写入，由shell读入环境变量，不出现在任何进程的命令行中
+            options = self.transfer_config.get("direct_transfer", {})
+            token_line = (uuid.uuid4().hex + "\n").encode()
+            read_token = "IFS= read -r IMGMGR_DIRECT_TOKEN && export IMGMGR_DIRECT_TOKEN"
+            # 配置了direct_address时只在该地址上监听，否则监听所有地址
+            bind_address = self.get_host_config(dst_host).get("direct_address") or ""
+            receive = (f"{{ {read_token} && python3 -c {q(DIRECT_RECEIVER_SOURCE)} {q(bind_address)} "
+                       f"{float(options.get('connect_timeout', 60))} {int(options.get('tcp_port', 0))}; }}")
+            receiver = self.start_remote_command("bash -c " + q(self._direct_extract_script(dst_dir, receive)),
+                                                 host=dst_host, on_output=on_output)
+            try:
+                receiver.write(token_line)
+            except Exception as e:
+                print(f"写入接收端令牌失败: {e}")
+            match = receiver.wait_for_stderr(r"PORT (\d+)", timeout=30)
+            if not match:
+                receiver.close_stdin()
+                _, stderr, exit_code = receiver.wait()
+                return f"接收端启动失败（退出码 {exit_code}）: {first_line(stderr)}"
+            address = self.get_host_config(dst_host).get("direct_address") or dst_host
+            command = (f"set -o pipefail; {read_token} && cd -- {q(src_dir)} && "
+                       f"tar --null --no-recursion -T - -cf - | "
+                       f"python3 -c {q(DIRECT_SENDER_SOURCE)} {q(address)} {match.group(1)}")
+        
+        try:
+            sender = self.start_remote_command(command, on_output=None if receiver else on_output)
+        except Exception:
+            if receiver:
+                receiver.close_stdin()
+                receiver.wait()
+            raise
+        try:
+            sender.write(token_line + names)
+        except Exception as e:
+            print(f"写入文件列表失败: {e}")
+        finally:
+            sender.close_stdin()
+        _, stderr, exit_code = sender.wait()
+        bytes_sent, bytes_received = sender.bytes_sent, sender.bytes_received
+        error = f"发送失败（退出码 {exit_code}）: {first_line(stderr)}" if exit_code != 0 else None
+        if receiver:
+            # 发送端失败时关闭stdin，接收端不再等待连接
+            receiver.close_stdin()
+            _, receiver_stderr, receiver_exit_code = receiver.wait()
+            bytes_received += receiver.bytes_received
+            receiver_stderr = re.sub(r"PORT \d+\n?", "", receiver_stderr)
+            if receiver_exit_code != 0 and error is None:
+                error = f"接收失败（退出码 {receiver_exit_code}）: {first_line(receiver_stderr)}"
+        # 文件数据不经过客户端，这里只统计命令、文件名和进度输出；每个命令打开channel和执行各一次往返
+        self.ssh_stats.record("direct", time.time() - started, bytes_sent, bytes_received,
+                              round_trips=4 if receiver else 2, commands=2 if receiver else 1)
+        if error or self.task_cancelled:
+            return error or "任务已取消"
+        
+        if operation_type == "move" and method != "rsync":
+            # 整组都已写入目标服务器后才删除源文件
+            remover = self.start_remote_command(f"cd -- {q(src_dir)} && xargs -0 rm -f --")
+            try:
+                remover.write(names)
+            finally:
+                remover.close_stdin()
+            _, stderr, exit_code = remover.wait()
+            if exit_code != 0:
+                return f"已复制到目标服务器，但删除源文件失败: {first_line(stderr)}"
+        return None
+    
+    def execute_direct_transfer(self, dst_host, operations, operation_type="copy", progress=None):
+        """把主服务器上的文件直接推送到另一台服务器，文件数据只在两台服务器之间传输
+        
+        按 (源目录, 目标目录) 分组，每组一个数据流：rsync方式在主服务器上经ssh推送；ssh方式为
+        tar -c | ssh 目标服务器 tar -x；tcp方式由目标服务器上的接收端监听端口、主服务器上的发送端
+        连接后传输tar流，客户端只转发端口号。移动操作在整组成功后才删除源文件
+        （rsync方式由--remove-source-files逐个删除）。
+        
+        Args:
+            dst_host: 目标服务器（ssh_config.hosts中的主机）
+            operations: [(主服务器上的源路径, 目标服务器上的目标路径, ftype), ...]
+            operation_type: 'copy' 或 'move'
+            progress: 可选的TransferProgressTracker
+        
+        Returns:
+            dict: 操作结果；failed_operations为失败组的操作
+        """
+        method = self.get_direct_transfer_method(dst_host)
+        if method is None:
+            return {"success": False, "error": f"主服务器无法直接传输到 {dst_host}", "operations_count": 0,
+                    "failed_operations": list(operations), "method": None}
+        
+        groups = {}
+        failed_operations = []
+        errors = []
+        for src, dst, ftype in operations:
+            # 数据流保留文件名，改名的操作不能直接传输
+            if posixpath.basename(src) != posixpath.basename(dst):
+                failed_operations.append((src, dst, ftype))
+                continue
+            groups.setdefault((posixpath.dirname(src), posixpath.dirname(dst)), []).append((src, dst, ftype))
+        if failed_operations:
+            errors.append(f"{len(failed_operations)} 个文件需要改名，不能直接传输")
+        
+        operations_count = 0
+        for (src_dir, dst_dir), group in groups.items():
+            if self.task_cancelled:
+                failed_operations.extend(group)
+                continue
+            try:
+                error = self._direct_transfer_group(method, dst_host, src_dir, dst_dir, group, operation_type, progress)
+            except Exception as e:
+                error = str(e)
+            if error:
+                failed_operations.extend(group)
+                errors.append(f"{dst_dir}: {error}")
+            else:
+                operations_count += len(group)
+        
+        if not failed_operations:
+            return {"success": True, "operations_count": operations_count, "failed_operations": [], "method": method}
+        return {
+            "success": False,
+            "cancelled": self.task_cancelled,
+            "error": f"直接传输到 {dst_host}（{method}）失败: {errors[0] if errors else '未知错误'}",
+            "operations_count": operations_count,
+            "failed_operations": failed_operations,
+            "method": method
+        }
+    
+    def pair_remote_labels(self, ordered_images, linux_labels_path, use_agent):
+        """在服务器上查找每个图片对应的label文件
+        
+        Args:
+            ordered_images: 图片路径列表
+            linux_labels_path: 服务器上labels目录的Linux路径，为空时不配对
+            use_agent: 是否可以使用远程辅助程序
+        
+        Returns:
+            dict: {图片文件名: label文件名}，没有label的图片不在其中
+        """
+        label_map = {}
+        if linux_labels_path and use_agent:
+            # 辅助程序一次列出labels目录完成全部配对
+            try:
+                pair_result = self.run_remote_agent([{
+                    "op": "pair",
+                    "images": [os.path.basename(image_path) for image_path in ordered_images],
+                    "labels_dir": linux_labels_path,
+                    "exts": ['.txt', '.xml', '.json']
+                }], compressed=True)[0]
+            except Exception as e:
+                pair_result = {"ok": False, "error": str(e)}
+            if pair_result is not None and pair_result.get("ok"):
+                return pair_result["labels"]
+            if self.task_cancelled:
+                return label_map
+            # 辅助程序在该服务器上无法正常运行：本会话内不再使用，改用shell命令配对
+            print(f"辅助程序标签配对失败，改用shell命令: {pair_result and pair_result.get('error')}")
+            self.remote_agent_paths[self.ssh_config.get("host", "")] = None
+        if linux_labels_path:
+            # 没有python3时，每个图片一个检查命令，全部在同一会话中流水线执行
+            label_commands = []
+            for image_path in ordered_images:
+                base_name = os.path.splitext(os.path.basename(image_path))[0]
+                candidates = " ".join(shlex.quote(f"{linux_labels_path}/{base_name}{ext}")
+                                      for ext in ['.txt', '.xml', '.json'])
+                label_commands.append(f"for f in {candidates}; do if [ -f \"$f\" ]; then basename \"$f\"; break; fi; done")
+            
+            label_results = self.execute_ssh_commands(label_commands, compressed=True)
+            for image_path, (stdout, _, _) in zip(ordered_images, label_results):
+                if stdout.strip():
+                    label_map[os.path.basename(image_path)] = stdout.strip()
+        return label_map
+    
     def process_images_worker_ssh(self, selected_images, selected_targets, images_path, labels_path, copy):
         """SSH服务器模式的图片处理工作线程（优化版本）"""
         operation = "复制" if copy else "移动"
+        operation_type = "copy" if copy else "move"
         total_operations = 0
         failed_operations = []
+        manifest = None
+        ssh_stats = self.begin_ssh_stats()
+        # 新的远程进程组标识，取消时只中止本任务启动的远程命令
+        self.remote_job_id = uuid.uuid4().hex[:12]
+        
+        def cancelled_result():
+            """任务取消后的结果（各执行方式在返回前已完成回滚或清理）"""
+            self.wait_remote_abort()
+            if manifest:
+                manifest.close()
+            self.close_ssh_connection()
+            return self.finish_ssh_job({
+                "success": False,
+                "cancelled": True,
+                "error": "任务已取消",
+                "total_operations": total_operations,
+                "operation": operation
+            }, ssh_stats, operation_type)
         
         try:
             # 获取SSH客户端
             ssh_client = self.get_ssh_client()
             if not ssh_client:
-                return {
+                return self.finish_ssh_job({
                     "success": False,
                     "error": "无法建立SSH连接",
                     "operation": operation
-                }
+                }, ssh_stats, operation_type)
             
             # 更新进度
             self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, len(selected_images) * len(selected_targets), "准备批量操作..."))
             
             # 转换路径为Linux格式
-            linux_images_path = self.convert_windows_to_linux_path(images_path)
-            linux_labels_path = self.convert_windows_to_linux_path(labels_path) if labels_path else None
+            linux_images_path = self.convert_windows_to_linux_path(str(images_path))
+            linux_labels_path = self.convert_windows_to_linux_path(str(labels_path)) if labels_path else None
             
             # 批量创建所有需要的目录（去重优化）
             directories_to_create = set()
             target_paths_map = {}
+            primary_host = self.ssh_config.get("host", "")
+            direct_dirs = {}  # {其他服务器上的目标目录: 服务器}，由直接传输在目标服务器上创建
             
             for target_name, target_path in selected_targets:
                 linux_target_path = self.convert_windows_to_linux_path(target_path)
                 target_images_path = f"{linux_target_path}/images"
                 target_labels_path = f"{linux_target_path}/labels"
                 
-                directories_to_create.add(target_images_path)
-                directories_to_create.add(target_labels_path)
+                target_host = self.host_for_path(target_path) or primary_host
+                if target_host == primary_host:
+                    directories_to_create.add(target_images_path)
+                    directories_to_create.add(target_labels_path)
+                else:
+                    direct_dirs[target_images_path] = target_host
+                    direct_dirs[target_labels_path] = target_host
                 target_paths_map[target_name] = (target_images_path, target_labels_path)
             
             # 创建目录
             self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, len(selected_images) * len(selected_targets), "创建远程目录结构..."))
-            for directory in directories_to_create:
-                if not self.create_ssh_directory(directory):
-                    failed_operations.append(f"创建目录失败: {directory}")
+            for directory in self.ensure_remote_directories(directories_to_create):
+                failed_operations.append(f"创建目录失败: {directory}")
+            if self.task_cancelled:
+                return cancelled_result()
+            
+            # 查找每个图片对应的label文件
+            ordered_images = self.order_for_locality(selected_images)
+            label_map = self.pair_remote_labels(ordered_images, linux_labels_path, self.remote_agent_available())
+            # 配对失败时辅助程序会被标记为不可用，后续操作随之改用shell命令
+            use_agent = self.remote_agent_available()
             
             # 准备批量操作列表
             batch_operations = []
             
+            source_sizes = {}  # {源文件Linux路径: 字节数}，来自扫描索引，用于进度统计
+            
             # 为每个目标目录准备操作
             for target_index, (target_name, target_path) in enumerate(selected_targets):
                 target_images_path, target_labels_path = target_paths_map[target_name]
                 
-                # 准备图片文件操作
-                for img_index, image_path in enumerate(selected_images):
+                # 准备图片文件操作（按需按磁盘局部性排序）
+                for img_index, image_path in enumerate(ordered_images):
                     if self.task_cancelled or (self.progress_dialog and self.progress_dialog.is_cancelled()):
-                        self.close_ssh_connection()
-                        return {"cancelled": True}
+                        return cancelled_result()
                     
                     # 获取文件名（不包含路径）
                     image_name = os.path.basename(image_path)
@@ -2880,6 +7186,7 @@ class ImageManager:
                     # 构建源文件的完整Linux路径（从数据集的images目录）
                     source_image_file = f"{linux_images_path}/{image_name}"
                     target_image_file = f"{target_images_path}/{image_name}"
+                    source_sizes[source_image_file] = self.scan_index.get(image_path, {}).get("size", 0)
                     
                     # 添加图片操作到批量列表
                     if copy or target_index < len(selected_targets) - 1:
@@ -2889,60 +7196,148 @@ class ImageManager:
                         # 移动操作且是最后一个目标
                         batch_operations.append((source_image_file, target_image_file, "image_move"))
                     
-                    # 查找对应的label文件
-                    if linux_labels_path:
-                        base_name = os.path.splitext(image_name)[0]
-                        for ext in ['.txt', '.xml', '.json']:
-                            label_name = base_name + ext
-                            # 构建源标签文件的完整Linux路径（从数据集的labels目录）
-                            source_label_file = f"{linux_labels_path}/{label_name}"
-                            
-                            # 检查Linux服务器上是否存在该标签文件
-                            check_cmd = f"test -f '{source_label_file}'"
-                            _, _, exit_code = self.execute_ssh_command(check_cmd)
-                            
-                            if exit_code == 0:  # 文件存在
-                                target_label_file = f"{target_labels_path}/{label_name}"
-                                
-                                # 添加标签操作到批量列表
-                                if copy or target_index < len(selected_targets) - 1:
-                                    batch_operations.append((source_label_file, target_label_file, "label"))
-                                else:
-                                    batch_operations.append((source_label_file, target_label_file, "label_move"))
-                                break
+                    # 添加对应的label文件
+                    label_name = label_map.get(image_name)
+                    if label_name:
+                        # 构建源标签文件的完整Linux路径（从数据集的labels目录）
+                        source_label_file = f"{linux_labels_path}/{label_name}"
+                        target_label_file = f"{target_labels_path}/{label_name}"
+                        
+                        # 添加标签操作到批量列表
+                        if copy or target_index < len(selected_targets) - 1:
+                            batch_operations.append((source_label_file, target_label_file, "label"))
+                        else:
+                            batch_operations.append((source_label_file, target_label_file, "label_move"))
             
             # 分离复制和移动操作
             copy_operations = [(src, dst, ftype) for src, dst, ftype in batch_operations if not ftype.endswith('_move')]
             move_operations = [(src, dst, ftype.replace('_move', '')) for src, dst, ftype in batch_operations if ftype.endswith('_move')]
             
+            # 目标在其他服务器上的操作由主服务器直接推送到该服务器
+            direct_copy_operations = {}  # {目标服务器: [(src, dst, ftype), ...]}
+            direct_move_operations = {}
+            if direct_dirs:
+                for operations, direct_operations in ((copy_operations, direct_copy_operations),
+                                                      (move_operations, direct_move_operations)):
+                    for src, dst, ftype in operations:
+                        dst_host = direct_dirs.get(posixpath.dirname(dst))
+                        if dst_host:
+                            direct_operations.setdefault(dst_host, []).append((src, dst, ftype))
+                copy_operations = [op for op in copy_operations if posixpath.dirname(op[1]) not in direct_dirs]
+                move_operations = [op for op in move_operations if posixpath.dirname(op[1]) not in direct_dirs]
+            
+            # 多目标时每个源文件只真实复制一次，其余目标在服务器上从第一份副本派生
+            fanout_operations = []
+            if self.transfer_config.get("server_fanout", True):
+                copy_operations, fanout_operations = self.plan_server_fanout(copy_operations)
+                for src, dst, _ in copy_operations:
+                    source_sizes[dst] = source_sizes.get(src, 0)
+            
+            # 辅助程序逐个返回状态，可以实时更新进度并记录校验值
+            manifest = self.create_transfer_manifest("copy" if copy else "move") if use_agent else None
+            
+            # 所有执行方式都把逐文件进度汇总到同一个跟踪器，显示吞吐量和剩余时间
+            progress = TransferProgressTracker(
+                total_files=len(batch_operations),
+                total_bytes=sum(source_sizes.get(src, 0) for src, _, _ in batch_operations),
+                source_sizes=source_sizes,
+                on_update=lambda stats: self.root.after(0, lambda: self.progress_dialog.update_transfer_stats(stats))
+            )
+            
             # 执行批量复制操作
             if copy_operations:
-                self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, len(selected_images) * len(selected_targets), f"批量复制 {len(copy_operations)} 个文件..."))
+                self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, 0, f"批量复制 {len(copy_operations)} 个文件..."))
+            failed_primaries = set()  # 复制失败的目标文件，不能作为派生副本的来源
+            if copy_operations and use_agent:
+                agent_result = self.execute_agent_operations(copy_operations, "copy", manifest, progress)
+                if not agent_result["success"]:
+                    failed_operations.append(f"批量复制失败: {agent_result['error']}")
+                    failed_primaries.update(agent_result.get("failed_destinations",
+                                                             [dst for _, dst, _ in copy_operations]))
+                else:
+                    total_operations += agent_result["operations_count"]
+                    self.root.after(0, lambda: self.progress_dialog.add_task_log(f"辅助程序复制完成: {agent_result['operations_count']} 个文件"))
+            elif copy_operations:
+                # 大量小文件（主要是标签）的目录整组打包为tar流，失败的组和其余文件交给rsync
+                tar_groups, copy_operations = self.plan_tar_pipe(copy_operations, source_sizes)
+                if tar_groups:
+                    tar_result = self.execute_tar_pipe_operations(tar_groups, progress)
+                    total_operations += tar_result["operations_count"]
+                    self.root.after(0, lambda: self.progress_dialog.add_task_log(
+                        f"tar流复制完成: {tar_result['operations_count']} 个文件（{len(tar_groups)} 组）"))
+                    if not tar_result["success"] and not self.task_cancelled:
+                        self.root.after(0, lambda: self.progress_dialog.add_task_log(f"{tar_result['error']}，改用rsync重试"))
+                        copy_operations = copy_operations + tar_result["failed_operations"]
                 
                 # 尝试使用rsync，如果失败则使用批量脚本
                 # rsync需要按目标目录分组处理
-                rsync_result = self.execute_rsync_batch_operations(copy_operations, "copy")
-                
-                if not rsync_result["success"]:
-                    # rsync失败，使用批量脚本
-                    self.root.after(0, lambda: self.progress_dialog.add_task_log(f"rsync不可用，使用批量脚本: {rsync_result['error']}"))
-                    batch_result = self.execute_batch_ssh_operations(copy_operations, "copy")
+                if copy_operations and not self.task_cancelled:
+                    rsync_result = self.execute_rsync_batch_operations(copy_operations, "copy", progress=progress)
                     
-                    if not batch_result["success"]:
-                        failed_operations.append(f"批量复制失败: {batch_result['error']}")
-                    else:
-                        total_operations += batch_result["operations_count"]
-                        self.root.after(0, lambda: self.progress_dialog.add_task_log(f"批量复制完成: {batch_result['operations_count']} 个文件"))
+                    if rsync_result["success"]:
+                        total_operations += rsync_result["files_count"]
+                        self.root.after(0, lambda: self.progress_dialog.add_task_log(f"rsync复制完成: {rsync_result['files_count']} 个文件"))
+                    elif not self.task_cancelled:
+                        # rsync失败（不是因为任务取消），使用批量脚本
+                        self.root.after(0, lambda: self.progress_dialog.add_task_log(f"rsync不可用，使用批量脚本: {rsync_result['error']}"))
+                        batch_result = self.execute_batch_ssh_operations(copy_operations, "copy", progress=progress)
+                        
+                        if not batch_result["success"]:
+                            failed_operations.append(f"批量复制失败: {batch_result['error']}")
+                            # 批量脚本不返回逐文件结果，本批文件都不作为派生来源
+                            failed_primaries.update(dst for _, dst, _ in copy_operations)
+                        else:
+                            total_operations += batch_result["operations_count"]
+                            self.root.after(0, lambda: self.progress_dialog.add_task_log(f"批量复制完成: {batch_result['operations_count']} 个文件"))
+            
+            if self.task_cancelled:
+                return cancelled_result()
+            
+            if failed_primaries:
+                skipped_fanout = [op for op in fanout_operations if op[0] in failed_primaries]
+                fanout_operations = [op for op in fanout_operations if op[0] not in failed_primaries]
+                if skipped_fanout:
+                    failed_operations.append(f"派生副本跳过: {len(skipped_fanout)} 个文件的第一份副本复制失败")
+            
+            if fanout_operations:
+                fanout_result = self.execute_fanout_operations(fanout_operations, manifest, progress)
+                if not fanout_result["success"]:
+                    failed_operations.append(f"派生副本失败: {fanout_result['error']}")
                 else:
-                    total_operations += rsync_result["files_count"]
-                    self.root.after(0, lambda: self.progress_dialog.add_task_log(f"rsync复制完成: {rsync_result['files_count']} 个文件"))
+                    total_operations += fanout_result["operations_count"]
+                    self.root.after(0, lambda: self.progress_dialog.add_task_log(f"派生副本完成: {fanout_result['operations_count']} 个文件"))
             
-            # 执行批量移动操作
-            if move_operations:
-                self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, len(selected_images) * len(selected_targets), f"批量移动 {len(move_operations)} 个文件..."))
-                
+            for dst_host, operations in direct_copy_operations.items():
+                if self.task_cancelled:
+                    break
+                self.root.after(0, lambda h=dst_host, n=len(operations): self.progress_dialog.update_overall_progress(
+                    0, 0, f"直接复制 {n} 个文件到 {h}..."))
+                direct_result = self.execute_direct_transfer(dst_host, operations, "copy", progress)
+                total_operations += direct_result["operations_count"]
+                if not direct_result["success"]:
+                    failed_operations.append(f"{direct_result['error']}（{len(direct_result['failed_operations'])} 个文件）")
+                else:
+                    self.root.after(0, lambda h=dst_host, r=direct_result: self.progress_dialog.add_task_log(
+                        f"直接复制到 {h} 完成（{r['method']}）: {r['operations_count']} 个文件"))
+            
+            if self.task_cancelled:
+                return cancelled_result()
+            
+            # 执行批量移动操作（复制失败时不再移动，避免源文件丢失）
+            if move_operations and (not use_agent or not failed_operations):
+                self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, 0, f"批量移动 {len(move_operations)} 个文件..."))
+            if move_operations and use_agent and not failed_operations:
+                agent_result = self.execute_agent_operations(move_operations, "move", manifest, progress)
+                if not agent_result["success"]:
+                    failed_operations.append(f"批量移动失败: {agent_result['error']}")
+                else:
+                    total_operations += agent_result["operations_count"]
+                    self.root.after(0, lambda: self.progress_dialog.add_task_log(f"辅助程序移动完成: {agent_result['operations_count']} 个文件"))
+            elif move_operations and use_agent:
+                failed_operations.append(f"复制阶段失败，已跳过 {len(move_operations)} 个文件的移动以保留源文件")
+            elif move_operations:
                 # 移动操作使用批量脚本（支持回滚）
-                batch_result = self.execute_batch_ssh_operations(move_operations, "move")
+                batch_result = self.execute_batch_ssh_operations(move_operations, "move", progress=progress)
                 
                 if not batch_result["success"]:
                     failed_operations.append(f"批量移动失败: {batch_result['error']}")
@@ -2950,10 +7345,39 @@ class ImageManager:
                     total_operations += batch_result["operations_count"]
                     self.root.after(0, lambda: self.progress_dialog.add_task_log(f"批量移动完成: {batch_result['operations_count']} 个文件"))
             
+            for dst_host, operations in direct_move_operations.items():
+                if self.task_cancelled:
+                    failed_operations.append(f"任务已取消，未移动 {len(operations)} 个文件到 {dst_host}")
+                    continue
+                if failed_operations:
+                    # 源文件删除后无法回滚，前面有失败时不再移动
+                    failed_operations.append(f"复制阶段失败，已跳过 {len(operations)} 个文件到 {dst_host} 的移动以保留源文件")
+                    continue
+                self.root.after(0, lambda h=dst_host, n=len(operations): self.progress_dialog.update_overall_progress(
+                    0, 0, f"直接移动 {n} 个文件到 {h}..."))
+                direct_result = self.execute_direct_transfer(dst_host, operations, "move", progress)
+                total_operations += direct_result["operations_count"]
+                if not direct_result["success"]:
+                    failed_operations.append(f"{direct_result['error']}（{len(direct_result['failed_operations'])} 个文件）")
+                else:
+                    self.root.after(0, lambda h=dst_host, r=direct_result: self.progress_dialog.add_task_log(
+                        f"直接移动到 {h} 完成（{r['method']}）: {r['operations_count']} 个文件"))
+            
+            if self.task_cancelled and failed_operations:
+                # 移动阶段被取消（已回滚）；取消前已全部完成时按正常结果返回
+                return cancelled_result()
+            
+            progress.finish()
+            if manifest:
+                manifest.close()
+            if failed_operations:
+                # 失败可能是目录已被外部删除，下次任务重新确认本任务用到的目录
+                self.forget_remote_directories(directories_to_create)
+            
             # 关闭SSH连接
             self.close_ssh_connection()
             
-            return {
+            return self.finish_ssh_job({
                 "success": True,
                 "total_operations": total_operations,
                 "failed_operations": failed_operations,
@@ -2961,18 +7385,300 @@ class ImageManager:
                 "selected_images": selected_images,
                 "selected_targets": selected_targets,
                 "copy": copy,
-                "batch_optimized": True
-            }
+                "batch_optimized": True,
+                "manifest_path": manifest.manifest_path if manifest else None
+            }, ssh_stats, operation_type)
             
 
             
         except Exception as e:
+            if self.task_cancelled:
+                return cancelled_result()
+            if manifest:
+                manifest.close()
             self.close_ssh_connection()
-            return {
+            return self.finish_ssh_job({
                 "success": False,
                 "error": str(e),
                 "operation": operation
-            }
+            }, ssh_stats, operation_type)
+    
+    def remote_file_sizes(self, paths):
+        """用一条命令获取服务器上一批文件的大小
+        
+        Args:
+            paths: 文件的Linux路径列表
+        
+        Returns:
+            dict: {路径: 字节数}，不存在的文件不在其中
+        """
+        sizes = {}
+        if not paths:
+            return sizes
+        # 文件名经printf和xargs传给stat，不受命令行长度限制；不存在的文件只在stderr中报错
+        quoted_paths = " ".join(shlex.quote(path) for path in paths)
+        stdout, _, _ = self.execute_ssh_command(
+            f"printf '%s\\0' {quoted_paths} | xargs -0 stat -c '%s %n' --", compressed=True)
+        for line in stdout.splitlines():
+            size, _, path = line.partition(" ")
+            if size.isdigit():
+                sizes[path] = int(size)
+        return sizes
+    
+    def _sftp_readv(self, remote_file, chunks):
+        """按块预读远程文件，在途请求数受transfer_config["download"]["prefetch_requests"]限制"""
+        max_requests = self.transfer_config.get("download", {}).get("prefetch_requests", 64) or None
+        try:
+            return remote_file.readv(chunks, max_concurrent_prefetch_requests=max_requests)
+        except TypeError:
+            # paramiko 3.3之前的readv不支持限制在途请求数，一次发出全部请求
+            return remote_file.readv(chunks)
+    
+    def download_file(self, sftp, remote_path, local_path, size, offset, progress=None, limiters=None):
+        """经SFTP下载一个文件，数据先写入 本地路径.part，完整后改名
+        
+        .part中已有offset字节时从该位置续传。每轮用readv预读window_size的数据，
+        读请求在SFTP会话中流水线发出，不必逐块等待往返。
+        
+        Args:
+            sftp: paramiko SFTPClient
+            remote_path: 服务器上的Linux路径
+            local_path: 本地目标路径
+            size: 远程文件大小
+            offset: 续传起点（.part的大小），0表示重新下载
+            progress: 可选的TransferProgressTracker，按块累计字节数
+            limiters: 限速器列表
+        
+        Returns:
+            tuple: (本次下载的字节数, 校验值)；任务取消时返回None（保留.part供续传）
+        """
+        options = self.transfer_config.get("download", {})
+        block_size = max(32 * 1024, int(options.get("block_size", 1024 * 1024)))
+        window_size = max(block_size, int(options.get("window_size", 8 * 1024 * 1024)))
+        part_path = local_path + ".part"
+        checksum = StreamChecksum(self.transfer_config.get("hash_algorithm", "blake2b"))
+        
+        if offset:
+            # 续传时先对已下载的部分计算校验值，清单中记录的是完整文件的校验值
+            with open(part_path, 'rb') as f:
+                for data in iter(lambda: f.read(block_size), b''):
+                    checksum.update(data)
+            offset = checksum.size
+        
+        with open(part_path, 'ab' if offset else 'wb') as local_file:
+            if offset < size:
+                with sftp.open(remote_path, 'rb') as remote_file:
+                    position = offset
+                    while position < size:
+                        # 每轮预读的数据全部读完后再检查取消，不留下未取回的读请求
+                        if self.task_cancelled:
+                            return None
+                        window_end = min(size, position + window_size)
+                        chunks = [(start, min(block_size, window_end - start))
+                                  for start in range(position, window_end, block_size)]
+                        for data in self._sftp_readv(remote_file, chunks):
+                            local_file.write(data)
+                            checksum.update(data)
+                            if progress:
+                                progress.add(0, len(data))
+                            if limiters:
+                                self.throttle(limiters, nbytes=len(data))
+                        position = window_end
+        
+        if checksum.size != size:
+            raise Exception(f"文件大小不一致（服务器 {size}，本地 {checksum.size}），文件可能正在被修改")
+        os.replace(part_path, local_path)
+        return size - offset, checksum.hexdigest()
+    
+    def execute_sftp_downloads(self, downloads, progress=None, manifest=None, limiters=None):
+        """用多个连接池连接并发下载文件，每个连接一个持久SFTP会话
+        
+        Args:
+            downloads: [(远程路径, 本地路径, 字节数, 续传起点), ...]
+            progress: 可选的TransferProgressTracker
+            manifest: 可选的TransferManifest
+            limiters: 限速器列表
+        
+        Returns:
+            dict: {"operations_count": 完成的文件数, "failed": [失败说明, ...]}
+        """
+        host = self.ssh_config.get("host", "")
+        options = self.transfer_config.get("download", {})
+        workers = max(1, min(int(options.get("connections", 4)), self.max_pool_size, len(downloads)))
+        pending = deque(downloads)
+        queue_lock = threading.Lock()
+        result = {"operations_count": 0, "failed": []}
+        
+        def next_download():
+            with queue_lock:
+                return pending.popleft() if pending and not self.task_cancelled else None
+        
+        def download_worker():
+            connection_errors = 0
+            while connection_errors <= 2 and not self.task_cancelled:
+                try:
+                    with self.ssh_pool.connection(host) as connection:
+                        sftp = connection.get_sftp()
+                        while True:
+                            item = next_download()
+                            if item is None:
+                                return
+                            remote_path, local_path, size, offset = item
+                            started = time.time()
+                            try:
+                                downloaded = self.download_file(sftp, remote_path, local_path, size, offset,
+                                                                progress, limiters)
+                            except Exception as e:
+                                with queue_lock:
+                                    result["failed"].append(f"下载失败: {remote_path} ({e})")
+                                if self._is_connection_error(e):
+                                    raise
+                                # 出错后会话中可能残留未完成的请求，换新会话
+                                connection.reset_sftp()
+                                sftp = connection.get_sftp()
+                                continue
+                            if downloaded is None:
+                                return
+                            # 打开、预读、关闭
+                            self.ssh_stats.record("download", time.time() - started, 0, downloaded[0], round_trips=3)
+                            if manifest:
+                                manifest.record(remote_path, local_path, size, downloaded[1], time.time() - started)
+                            if progress:
+                                progress.add(1, 0)
+                            with queue_lock:
+                                result["operations_count"] += 1
+                except Exception as e:
+                    connection_errors += 1
+                    print(f"下载连接出错: {e}")
+                    time.sleep(connection_errors)
+        
+        threads = [threading.Thread(target=download_worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # 连接反复出错时剩余的文件不再下载
+        if not self.task_cancelled:
+            for remote_path, _, _, _ in pending:
+                result["failed"].append(f"下载失败: {remote_path} (无法建立SSH连接)")
+        return result
+    
+    def download_images_worker(self, selected_images, images_path, labels_path, local_dir):
+        """把选中范围的图片和标签从服务器下载到本地目录的工作线程
+        
+        本地已有大小一致的文件时跳过；上次中断留下的.part文件从已下载的位置续传。
+        文件分配到多个连接上并发下载，每个文件用SFTP预读流水线读取。
+        """
+        operation = "下载"
+        operation_type = "download"
+        failed_operations = []
+        manifest = None
+        ssh_stats = self.begin_ssh_stats()
+        self.remote_job_id = uuid.uuid4().hex[:12]
+        
+        def cancelled_result():
+            """任务取消：已完成的文件保留，未完成的文件保留为.part供下次续传"""
+            self.wait_remote_abort()
+            if manifest:
+                manifest.close()
+            return self.finish_ssh_job({
+                "success": False,
+                "cancelled": True,
+                "error": "任务已取消",
+                "operation": operation
+            }, ssh_stats, operation_type)
+        
+        try:
+            self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, len(selected_images), "查找标签文件..."))
+            linux_images_path = self.convert_windows_to_linux_path(str(images_path))
+            linux_labels_path = self.convert_windows_to_linux_path(str(labels_path)) if labels_path else None
+            ordered_images = self.order_for_locality(selected_images)
+            label_map = self.pair_remote_labels(ordered_images, linux_labels_path, self.remote_agent_available())
+            if self.task_cancelled:
+                return cancelled_result()
+            
+            # [(远程路径, 本地路径)]，图片和标签分别放在本地目录的images和labels下
+            files = []
+            for image_path in ordered_images:
+                image_name = os.path.basename(image_path)
+                files.append((f"{linux_images_path}/{image_name}", os.path.join(local_dir, "images", image_name)))
+                label_name = label_map.get(image_name)
+                if label_name:
+                    files.append((f"{linux_labels_path}/{label_name}", os.path.join(local_dir, "labels", label_name)))
+            
+            self.root.after(0, lambda: self.progress_dialog.update_overall_progress(0, len(files), "比较本地文件..."))
+            remote_sizes = self.remote_file_sizes([remote_path for remote_path, _ in files])
+            os.makedirs(os.path.join(local_dir, "images"), exist_ok=True)
+            if label_map:
+                os.makedirs(os.path.join(local_dir, "labels"), exist_ok=True)
+            
+            downloads = []
+            skipped = 0
+            for remote_path, local_path in files:
+                size = remote_sizes.get(remote_path)
+                if size is None:
+                    failed_operations.append(f"服务器上不存在: {remote_path}")
+                    continue
+                if os.path.isfile(local_path) and os.path.getsize(local_path) == size:
+                    skipped += 1
+                    continue
+                part_path = local_path + ".part"
+                offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+                if offset > size:
+                    # 服务器上的文件已变小，重新下载
+                    offset = 0
+                downloads.append((remote_path, local_path, size, offset))
+            
+            # 吞吐量只统计本次实际传输的字节，跳过的文件和续传前已有的部分不计入
+            progress = TransferProgressTracker(
+                total_files=len(downloads),
+                total_bytes=sum(size - offset for _, _, size, offset in downloads),
+                on_update=lambda stats: self.root.after(0, lambda: self.progress_dialog.update_transfer_stats(stats))
+            )
+            if skipped:
+                self.root.after(0, lambda: self.progress_dialog.add_task_log(f"跳过本地已有的 {skipped} 个文件"))
+            
+            downloaded = 0
+            if downloads:
+                resumed = sum(1 for download in downloads if download[3])
+                self.root.after(0, lambda: self.progress_dialog.update_overall_progress(
+                    0, 0, f"下载 {len(downloads)} 个文件" + (f"（续传 {resumed} 个）..." if resumed else "...")))
+                manifest = self.create_transfer_manifest(operation_type)
+                download_result = self.execute_sftp_downloads(
+                    downloads, progress, manifest, self.get_rate_limiters(host=self.ssh_config.get("host", "")))
+                downloaded = download_result["operations_count"]
+                failed_operations.extend(download_result["failed"])
+            if self.task_cancelled:
+                return cancelled_result()
+            
+            progress.finish()
+            if manifest:
+                manifest.close()
+            self.root.after(0, lambda: self.progress_dialog.add_task_log(f"下载完成: {downloaded} 个文件"))
+            
+            return self.finish_ssh_job({
+                "success": True,
+                "total_operations": downloaded + skipped,
+                "failed_operations": failed_operations,
+                "operation": operation,
+                "selected_images": selected_images,
+                "selected_targets": [("本地", local_dir)],
+                "copy": True,
+                "download": True,
+                "manifest_path": manifest.manifest_path if manifest else None
+            }, ssh_stats, operation_type)
+        
+        except Exception as e:
+            if self.task_cancelled:
+                return cancelled_result()
+            if manifest:
+                manifest.close()
+            return self.finish_ssh_job({
+                "success": False,
+                "error": str(e),
+                "operation": operation
+            }, ssh_stats, operation_type)
     
     def monitor_task_progress(self):
         """监控任务进度"""
@@ -3012,6 +7718,14 @@ class ImageManager:
         copy = result["copy"]
         
         self.progress_dialog.add_task_log(f"任务完成: 总操作 {total_operations} 次")
+        if result.get("manifest_path"):
+            self.progress_dialog.add_task_log(f"传输清单: {result['manifest_path']}")
+        if result.get("ssh_stats"):
+            self.progress_dialog.add_task_log(SSHOperationStats.format_summary(result["ssh_stats"]))
+            for line in SSHOperationStats.format_details(result["ssh_stats"]):
+                self.progress_dialog.add_task_log(f"  {line}")
+        if result.get("summary_path"):
+            self.progress_dialog.add_task_log(f"任务摘要: {result['summary_path']}")
         self.progress_dialog.task_completed()
         
         # 显示结果
@@ -3027,10 +7741,11 @@ class ImageManager:
                 f"成功{operation}了 {len(selected_images)} 个数据集文件到 {len(selected_targets)} 个目录")
             self.add_operation_log(f"{operation}操作完成: 成功{operation}了 {len(selected_images)} 个数据集文件到 {len(selected_targets)} 个目录")
         
-        # 清除所有选中的复选框
-        for key, var in self.target_checkbox_vars.items():
-            if var.get():
-                var.set(False)
+        # 清除所有选中的复选框（下载任务不使用目标目录，保留勾选）
+        if not result.get("download"):
+            for key, var in self.target_checkbox_vars.items():
+                if var.get():
+                    var.set(False)
         
         # 如果是移动操作，重新检测目录
         if not copy:
@@ -3220,6 +7935,7 @@ class ImageManager:
         if self.progress_dialog:
             self.progress_dialog.close_dialog()
         self.executor.shutdown(wait=False)
+        self.async_orchestrator.shutdown()
         
         self.root.destroy()
 